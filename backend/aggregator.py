@@ -2,15 +2,27 @@ import statistics
 import json
 import math
 import time
-from typing import List, Dict, Optional
+from itertools import compress
+from typing import List, Dict, Optional, Tuple
 from backend.sources.base import BaseSource
 from backend.circuit_breaker import CircuitBreaker
 from backend.redis_client import redis_client
 from backend.config import get_settings
 from backend.metrics import record_aggregate
 from backend.market_hours import is_market_open
+from backend.history import HistoryTrimmer, append_history
+from backend.candles import CandleAggregator
+from backend.archive import tick_archive
+from backend.history_ring import recent_history
+from backend.latest import latest_table
+from backend.feed import POINTS_CHANNEL_PREFIX
 import logging
 
+try:
+    import numpy as np
+except ImportError:  # 未安裝 NumPy 時 aggregate_batch 退回逐一計算
+    np = None
+
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
@@ -32,10 +44,54 @@ PRICE_PRECISION = {
     "SIL": 2,
 }
 
+# 交易對數量低於此值時逐一計算較快 (NumPy 呼叫約 1.5 ms 的固定開銷大於迴圈成本)。
+# backend/tools/bench_aggregate (每個交易對 8 個來源) 的實測：
+# 15 → 0.2x、32 → 0.8x、64 → 約 1.0x、128 → 1.4x、200 → 1.7x、2000 → 1.7x；
+# 取第一個穩定勝出的規模，目前的 15 個交易對走逐一計算
+VECTORIZE_MIN_SYMBOLS = 128
+
+# 系統追蹤的全部交易對 (順序即前端/WS 預設順序)
+SYMBOLS = [
+    "XAU-USD", "XAG-USD", "USD-TWD", "PAXG-USD", "GC-F", "SI-F", "XAG-USDT", "XAU-USDT",
+    "DXY", "US10Y", "HG-F", "CL-F", "VIX", "GDX", "SIL"
+]
+
+class PublishPolicy:
+    """
+    變動抑制發布：只在四捨五入後的價格或開收盤狀態改變時發布，
+    否則每 heartbeat 秒補發一次心跳。heartbeat <= 0 時每次都發布。
+    """
+
+    def __init__(self, heartbeat: Optional[float] = None):
+        self.heartbeat = float(settings.PUBLISH_HEARTBEAT_SECONDS if heartbeat is None else heartbeat)
+        self._last: Dict[str, Tuple[float, bool, float]] = {}  # symbol -> (price, is_open, 發布時間)
+
+    def should_publish(self, output: Dict, now: Optional[float] = None) -> bool:
+        """只判斷是否需要發布；實際發布成功後需呼叫 record()"""
+        if now is None:
+            now = time.time()
+        last = self._last.get(output["symbol"])
+        return not (
+            self.heartbeat > 0
+            and last is not None
+            and last[:2] == (output["price"], output["is_market_open"])
+            and now - last[2] < self.heartbeat
+        )
+
+    def record(self, output: Dict, now: Optional[float] = None):
+        """記錄已發布的狀態 (pipeline 執行成功後呼叫，失敗時下一次仍會發布)"""
+        if now is None:
+            now = time.time()
+        self._last[output["symbol"]] = (output["price"], output["is_market_open"], now)
+
+
 class Aggregator:
     def __init__(self, sources: List[BaseSource]):
         self.sources = sources
         self.circuit_breaker = CircuitBreaker()
+        self.history_trimmer = HistoryTrimmer()
+        self.publish_policy = PublishPolicy()
+        self.candles = CandleAggregator()
         # 建立 source_name -> weight 的映射
         self.weights = {src.source_name: getattr(src, 'weight', 0.5) for src in sources}
 
@@ -85,10 +141,11 @@ class Aggregator:
              
         return filtered
 
-    async def aggregate(self, symbol: str, results: List[Dict]) -> Optional[Dict]:
+    def compute(self, symbol: str, results: List[Dict], now: Optional[float] = None) -> Optional[Tuple[Dict, float]]:
         """
-        處理來自不同數據源的結果並計算最終價格。
+        處理來自不同數據源的結果並計算最終價格 (純計算，不寫入 Redis)。
         使用加權平均並配合 MAD 異常值過濾。
+        回傳 (output, 加權延遲)；無有效數據時回傳 None。
         """
         valid_entries = []
         
@@ -118,7 +175,8 @@ class Aggregator:
             logger.warning(f"No valid data for {symbol}")
             return None
 
-        now = time.time()
+        if now is None:
+            now = time.time()
         fresh_entries = []
         for e in valid_entries:
             ts = e.get("timestamp")
@@ -181,7 +239,7 @@ class Aggregator:
         output = {
             "symbol": symbol,
             "price": round(final_price, precision),
-            "timestamp": latest_source_ts or time.time(),
+            "timestamp": latest_source_ts or now,
             "sources": len(fresh_entries),
             "details": sources_used,
             "fastest": fastest_source,
@@ -189,29 +247,246 @@ class Aggregator:
             "avgLatency": round(weighted_latency, 1),      # 加權延遲 (排除慢速來源)
             "is_market_open": is_market_open(symbol)       # 市場狀態
         }
-        
-        # 發布到 Redis PubSub 和儲存最新值
-        output_json = json.dumps(output)
-        await redis_client.publish(f"market:stream:{symbol}", output_json)
-        await redis_client.set(f"market:latest:{symbol}", output_json)
-
-        # 儲存歷史資料 (Redis sorted set)
-        history_key = f"market:history:{symbol}"
-        await redis_client.zadd(history_key, {output_json: output["timestamp"]})
-
-        # 依時間與筆數保留歷史
-        retention_hours = max(1, int(settings.HISTORY_RETENTION_HOURS))
-        cutoff_ts = time.time() - (retention_hours * 3600)
-        await redis_client.zremrangebyscore(history_key, 0, cutoff_ts)
-
-        # 保留最近 N 筆
-        max_points = max(1000, int(settings.HISTORY_MAX_POINTS))
-        total_points = await redis_client.zcard(history_key)
-        if total_points and total_points > max_points:
-            await redis_client.zremrangebyrank(history_key, 0, total_points - max_points - 1)
-
-        await record_aggregate(symbol, len(fresh_entries), weighted_latency)
-        
-        logger.info(f"{symbol}: {final_price:.2f} from {len(fresh_entries)} sources (fastest: {fastest_source})")
-        
-        return output
+        return output, weighted_latency
+
+    async def aggregate(self, symbol: str, results: List[Dict]) -> Optional[Dict]:
+        """計算單一交易對的聚合價格並發布"""
+        computed = self.compute(symbol, results)
+        if computed is None:
+            return None
+        await self._publish_many([computed])
+        return computed[0]
+
+    async def aggregate_batch(self, batch: Dict[str, List[Dict]]) -> Dict[str, Optional[Dict]]:
+        """
+        一次聚合多個交易對 (symbol -> 來源結果列表)。
+        安裝 NumPy 且交易對數量足夠時以向量化運算一次處理，輸出與逐一呼叫 aggregate 相同。
+        """
+        now = time.time()
+        if np is None or len(batch) < VECTORIZE_MIN_SYMBOLS:
+            computed = {symbol: self.compute(symbol, results, now) for symbol, results in batch.items()}
+        else:
+            computed = self.compute_batch(batch, now)
+
+        # 整個週期的寫入合併為單一 pipeline
+        await self._publish_many([item for item in computed.values() if item is not None])
+        return {symbol: item[0] if item else None for symbol, item in computed.items()}
+
+    def compute_batch(self, batch: Dict[str, List[Dict]], now: Optional[float] = None) -> Dict[str, Optional[Tuple[Dict, float]]]:
+        """
+        向量化版本的 compute：將所有交易對的來源價格、權重與資料年齡
+        打包成 (交易對 x 來源) 的 NumPy 陣列，一次完成新鮮度、MAD 過濾與加權平均。
+
+        逐欄 (來源) 累加而非呼叫 np.sum，確保浮點加總順序與純 Python 版本一致。
+        """
+        if now is None:
+            now = time.time()
+
+        symbols = list(batch.keys())
+        computed: Dict[str, Optional[Tuple[Dict, float]]] = {}
+        rows: List[List[Dict]] = []
+        row_sources: List[List[str]] = []
+        weights = self.weights
+        record_success = self.circuit_breaker.record_success
+
+        # 逐列只做過濾，欄位再以 list comprehension 一次取出成扁平列表，避免逐格 append / 賦值的開銷
+        flat: List[Dict] = []
+        counts: List[int] = []
+        for symbol in symbols:
+            entries = [
+                res for res in batch[symbol]
+                if res and res.get('price') is not None and not res['price'] <= 0
+            ]
+            sources = [res['source'] for res in entries]
+            # Circuit Breaker 記錄成功
+            for source in sources:
+                record_success(source)
+            if not entries:
+                logger.warning(f"No valid data for {symbol}")
+            rows.append(entries)
+            row_sources.append(sources)
+            flat.extend(entries)
+            counts.append(len(entries))
+
+        n_rows = len(symbols)
+        width = max(counts, default=0)
+        if width == 0:
+            return {symbol: None for symbol in symbols}
+
+        flat_price = [res['price'] for res in flat]
+        flat_weight = [weights.get(source, 0.5) for sources in row_sources for source in sources]
+        flat_latency = [res.get('latency', 0) for res in flat]
+        flat_ts = [res.get('timestamp') or 0.0 for res in flat]
+        flat_max_age = np.array([res.get('max_age') for res in flat], dtype=float)  # None -> NaN
+        row_counts = np.array(counts)
+        row_idx = np.repeat(np.arange(n_rows), row_counts)
+        col_idx = np.arange(len(flat)) - np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+
+        shape = (n_rows, width)
+        price = np.zeros(shape)
+        weight = np.zeros(shape)
+        latency = np.zeros(shape)
+        ts = np.zeros(shape)
+        max_age = np.full(shape, np.nan)
+        valid = np.zeros(shape, dtype=bool)
+        cells = (row_idx, col_idx)
+        price[cells] = flat_price
+        weight[cells] = flat_weight
+        latency[cells] = flat_latency
+        ts[cells] = flat_ts
+        max_age[cells] = flat_max_age
+        valid[cells] = True
+
+        # 新鮮度：有時間戳與 max_age 的資料才計算年齡並淘汰過期者
+        has_age = valid & (ts != 0) & ~np.isnan(max_age)
+        safe_max_age = np.where(has_age, max_age, 1.0)
+        age = np.maximum(0, now - ts)
+        stale = has_age & (age > safe_max_age)
+        decay = np.exp(-(age - 2.0) / np.maximum(1.0, safe_max_age / 2))
+        freshness = np.where(has_age & (age >= 2.0), decay, 1.0)
+        eff_weight = weight * freshness
+        fresh = valid & ~stale & (eff_weight > 0)
+        n_fresh = fresh.sum(axis=1)
+
+        # MAD 異常值過濾 (僅針對 >= 3 個來源的交易對)
+        keep = fresh.copy()
+        mad_rows = n_fresh >= 3
+        if mad_rows.any():
+            masked = np.where(fresh[mad_rows], price[mad_rows], np.nan)
+            median = np.nanmedian(masked, axis=1)
+            diff = np.abs(masked - median[:, None])
+            mad = np.nanmedian(diff, axis=1)
+            threshold = np.minimum(np.maximum(3 * mad, median * 0.0005), median * 0.01)
+            inliers = fresh[mad_rows] & (diff <= threshold[:, None])
+            # 全部被過濾的極端情況退回使用全部新鮮資料
+            inliers = np.where(inliers.any(axis=1)[:, None], inliers, fresh[mad_rows])
+            keep[mad_rows] = inliers
+
+        # 加權平均 (逐欄累加以維持與 Python sum 相同的加總順序)
+        kept_weight = np.where(keep, eff_weight, 0.0)
+        total_weight = np.zeros(n_rows)
+        weighted_sum = np.zeros(n_rows)
+        price_sum = np.zeros(n_rows)
+        for j in range(width):
+            total_weight += kept_weight[:, j]
+            weighted_sum += np.where(keep[:, j], price[:, j] * eff_weight[:, j], 0.0)
+            price_sum += np.where(keep[:, j], price[:, j], 0.0)
+        n_keep = np.maximum(keep.sum(axis=1), 1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            final_price = np.where(total_weight > 0, weighted_sum / total_weight, price_sum / n_keep)
+
+        # 前 5 快來源的加權延遲 (穩定排序，與 sorted() 結果一致)
+        fresh_latency = np.where(fresh, latency, np.inf)
+        order = np.argsort(fresh_latency, axis=1, kind="stable")
+        top_n = np.minimum(5, n_fresh)
+        top_weight = np.zeros(n_rows)
+        top_sum = np.zeros(n_rows)
+        for k in range(min(5, width)):
+            idx = order[:, k:k + 1]
+            in_top = (k < top_n)
+            w = np.take_along_axis(eff_weight, idx, axis=1)[:, 0]
+            lat = np.take_along_axis(latency, idx, axis=1)[:, 0]
+            top_weight += np.where(in_top, w, 0.0)
+            top_sum += np.where(in_top, lat * w, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weighted_latency = top_sum / top_weight
+
+        # 保留來源中最新的時間戳位置 (argmax 與 max() 同樣取第一個最大值；無時間戳的列另行判斷)
+        kept_ts = np.where(keep & (ts != 0), ts, -np.inf)
+        latest_idx = np.argmax(kept_ts, axis=1)
+        has_ts = np.isfinite(np.take_along_axis(kept_ts, latest_idx[:, None], axis=1)[:, 0])
+
+        # 轉回 Python 列表，避免逐元素存取 NumPy 純量的開銷
+        keep_rows = keep.tolist()
+        fresh_counts = n_fresh.tolist()
+        fastest_idx = order[:, 0].tolist()
+        latest_rows = latest_idx.tolist()
+        has_ts_rows = has_ts.tolist()
+        final_prices = final_price.tolist()
+        avg_latencies = weighted_latency.tolist()
+
+        for i, symbol in enumerate(symbols):
+            entries = rows[i]
+            if not entries:
+                computed[symbol] = None
+                continue
+            if fresh_counts[i] == 0:
+                logger.warning(f"No fresh data for {symbol}")
+                computed[symbol] = None
+                continue
+
+            fastest_entry = entries[fastest_idx[i]]
+            # 時間戳取自原始資料 (保留 int / float 型別，序列化結果與 compute 相同)
+            latest_source_ts = entries[latest_rows[i]].get('timestamp') if has_ts_rows[i] else None
+            precision = PRICE_PRECISION.get(symbol, 2)
+
+            output = {
+                "symbol": symbol,
+                "price": round(final_prices[i], precision),
+                "timestamp": latest_source_ts or now,
+                "sources": fresh_counts[i],
+                "details": list(compress(row_sources[i], keep_rows[i])),
+                "fastest": fastest_entry['source'],
+                "fastestLatency": round(fastest_entry.get('latency', 0), 1),
+                "avgLatency": round(avg_latencies[i], 1),
+                "is_market_open": is_market_open(symbol)
+            }
+            computed[symbol] = (output, avg_latencies[i])
+
+        return computed
+
+    async def _publish_many(self, items: List[Tuple[Dict, float]]):
+        """
+        將一個聚合週期內所有交易對的結果以單一 MULTI/EXEC pipeline 寫入 Redis：
+        發布、最新值與歷史追加，整批只需一次往返。
+        歷史裁剪由 HistoryTrimmer 在背景攤銷執行。
+        """
+        if not items:
+            return
+
+        now = time.time()
+        published = []
+        payloads = []
+        candle_changes = []
+        sharded = settings.INGEST_MODE == "sharded"
+        pipe = await redis_client.pipeline(transaction=True)
+        for output, _ in items:
+            symbol = output["symbol"]
+            output_json = json.dumps(output)
+            payloads.append(output_json)
+
+            # 發布到 Redis PubSub (價格/開收盤狀態未變時抑制，僅送心跳) 和儲存最新值
+            should_publish = self.publish_policy.should_publish(output, now)
+            if should_publish:
+                pipe.publish(f"market:stream:{symbol}", output_json)
+            published.append(should_publish)
+            pipe.set(f"market:latest:{symbol}", output_json)
+
+            # 儲存歷史資料 (依 HISTORY_STORE 寫入 ZSET 或壓縮儲存)
+            append_history(pipe, output, output_json)
+            if sharded:
+                # 每一點 (不受變動抑制) 通知 API 進程的近期歷史緩衝
+                pipe.publish(f"{POINTS_CHANNEL_PREFIX}{symbol}", output_json)
+
+            # 增量更新 OHLC K 線
+            changed = self.candles.update(symbol, output["price"], output["timestamp"])
+            self.candles.write(pipe, symbol, changed)
+            candle_changes.append(changed)
+        await pipe.execute()
+
+        # 寫入成功後才更新發布狀態與記憶體中的 K 線，失敗時兩者與 Redis 保持一致
+        for (output, _), was_published, changed in zip(items, published, candle_changes):
+            if was_published:
+                self.publish_policy.record(output, now)
+            self.candles.commit(output["symbol"], changed)
+
+        for (output, _), output_json in zip(items, payloads):
+            self.history_trimmer.note_insert(output["symbol"])
+            recent_history.append(output["symbol"], output["timestamp"], output["price"], output_json)
+            latest_table.update(output["symbol"], output_json, output["timestamp"])
+            if settings.ARCHIVE_ENABLED:
+                tick_archive.add(output["symbol"], output["timestamp"], output["price"])
+
+        for (output, weighted_latency), was_published in zip(items, published):
+            await record_aggregate(output["symbol"], output["sources"], weighted_latency, was_published)
+            logger.info(f"{output['symbol']}: {output['price']:.2f} from {output['sources']} sources (fastest: {output['fastest']})")
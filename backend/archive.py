@@ -0,0 +1,209 @@
+"""
+本機磁碟的長期 tick 封存 (append-only)。
+
+每個 symbol 每天 (UTC) 一個檔案：{ARCHIVE_DIR}/{symbol}/{YYYY-MM-DD}.bin
+內容為固定寬度的二進位紀錄 (<dd：timestamp, price，每筆 16 bytes)，依時間遞增寫入，
+因此檔案本身即為時間索引：讀取時以 mmap + 二分搜尋直接定位區間。
+
+寫入由 Aggregator 先放入記憶體緩衝，再由背景維護任務批次 (asyncio.to_thread) 追加到檔案。
+Redis 只保留近期資料，/api/v1/history 查詢更舊的區間時會落到這裡。
+"""
+import asyncio
+import bisect
+import mmap
+import os
+import shutil
+import struct
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from backend.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+RECORD = struct.Struct("<dd")  # timestamp (epoch 秒), price
+
+# 舊檔清理的檢查間隔
+CLEANUP_INTERVAL = 3600
+
+
+def _day_of(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+class _Timestamps:
+    """讓 bisect 直接在 mmap 上比較紀錄的時間戳"""
+
+    def __init__(self, buf):
+        self._buf = buf
+
+    def __len__(self):
+        return len(self._buf) // RECORD.size
+
+    def __getitem__(self, index: int) -> float:
+        return RECORD.unpack_from(self._buf, index * RECORD.size)[0]
+
+
+class TickArchive:
+    def __init__(self, root: Optional[str] = None, flush_interval: Optional[float] = None):
+        self.root = root or settings.ARCHIVE_DIR
+        self.flush_interval = float(flush_interval or settings.ARCHIVE_FLUSH_SECONDS)
+        self._buffer: Dict[str, List[Tuple[float, float]]] = {}
+        self._last_ts: Dict[str, float] = {}  # symbol -> 已寫入的最後時間戳 (維持檔案遞增)
+        self._last_flush = 0.0
+        self._last_cleanup = 0.0
+
+    def _path(self, symbol: str, day: str) -> str:
+        return os.path.join(self.root, symbol, f"{day}.bin")
+
+    # ── 寫入 ─────────────────────────────────────────────────────────────
+
+    def add(self, symbol: str, ts: float, price: float):
+        """寫入路徑呼叫：只放入記憶體緩衝"""
+        self._buffer.setdefault(symbol, []).append((ts, price))
+
+    async def flush_due(self, now: Optional[float] = None) -> int:
+        if now is None:
+            now = time.time()
+        if now - self._last_flush < self.flush_interval:
+            return 0
+        self._last_flush = now
+        written = await self.flush()
+        if now - self._last_cleanup >= CLEANUP_INTERVAL:
+            self._last_cleanup = now
+            await asyncio.to_thread(self._cleanup, now)
+        return written
+
+    async def flush(self) -> int:
+        """將緩衝批次寫入檔案 (在執行緒中進行，不阻塞事件迴圈)"""
+        if not self._buffer:
+            return 0
+        buffer, self._buffer = self._buffer, {}
+        return await asyncio.to_thread(self._write, buffer)
+
+    def _write(self, buffer: Dict[str, List[Tuple[float, float]]]) -> int:
+        written = 0
+        for symbol, points in buffer.items():
+            last_ts = self._last_ts.get(symbol)
+            by_day: Dict[str, bytearray] = {}
+            for ts, price in points:
+                day = _day_of(ts)
+                if last_ts is None:
+                    last_ts = self._read_last_ts(symbol, day)
+                # 丟棄亂序的舊點，確保檔案時間遞增可二分搜尋
+                if last_ts is not None and ts < last_ts:
+                    continue
+                by_day.setdefault(day, bytearray()).extend(RECORD.pack(ts, price))
+                last_ts = ts
+                written += 1
+            if last_ts is not None:
+                self._last_ts[symbol] = last_ts
+            for day, data in by_day.items():
+                path = self._path(symbol, day)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "ab") as f:
+                    f.write(data)
+        return written
+
+    def _read_last_ts(self, symbol: str, day: str) -> Optional[float]:
+        path = self._path(symbol, day)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        if size < RECORD.size:
+            return None
+        with open(path, "rb") as f:
+            f.seek((size // RECORD.size - 1) * RECORD.size)
+            return RECORD.unpack(f.read(RECORD.size))[0]
+
+    def _cleanup(self, now: float):
+        """刪除超過 ARCHIVE_RETENTION_DAYS 的日檔"""
+        cutoff = _day_of(now - max(1, int(settings.ARCHIVE_RETENTION_DAYS)) * 86400)
+        if not os.path.isdir(self.root):
+            return
+        for symbol in os.listdir(self.root):
+            directory = os.path.join(self.root, symbol)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if name.endswith(".bin") and name[:-4] < cutoff:
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError as e:
+                        logger.warning(f"Error removing archive file {name}: {e}")
+            if not os.listdir(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+
+    # ── 讀取 ─────────────────────────────────────────────────────────────
+
+    async def read(self, symbol: str, start: float, end: float, limit: int) -> List[Tuple[float, float]]:
+        return await asyncio.to_thread(self._read, symbol, start, end, limit)
+
+    def _read(self, symbol: str, start: float, end: float, limit: int) -> List[Tuple[float, float]]:
+        """回傳 [start, end) 內時間遞增的最後 limit 筆，由最新的日檔往回讀"""
+        if end <= start or limit <= 0:
+            return []
+        first_day = datetime.fromtimestamp(start, timezone.utc).date()
+        day = datetime.fromtimestamp(end, timezone.utc).date()
+        chunks: List[List[Tuple[float, float]]] = []
+        remaining = limit
+        while day >= first_day and remaining > 0:
+            records = self._read_day(symbol, day.strftime("%Y-%m-%d"), start, end, remaining)
+            if records:
+                chunks.append(records)
+                remaining -= len(records)
+            day -= timedelta(days=1)
+        return [record for chunk in reversed(chunks) for record in chunk]
+
+    async def iter_read(self, symbol: str, start: float, end: float, chunk_size: int):
+        """依時間遞增逐批產生 [start, end) 內的紀錄 (匯出用，記憶體只保留一批)"""
+        if end <= start:
+            return
+        day = datetime.fromtimestamp(start, timezone.utc).date()
+        last_day = datetime.fromtimestamp(end, timezone.utc).date()
+        while day <= last_day:
+            name = day.strftime("%Y-%m-%d")
+            # 日檔只會追加，先定位的索引在讀取期間保持有效
+            lo, hi = await asyncio.to_thread(self._day_bounds, symbol, name, start, end)
+            while lo < hi:
+                upper = min(hi, lo + chunk_size)
+                yield await asyncio.to_thread(self._read_slice, symbol, name, lo, upper)
+                lo = upper
+            day += timedelta(days=1)
+
+    def _day_bounds(self, symbol: str, day: str, start: float, end: float) -> Tuple[int, int]:
+        path = self._path(symbol, day)
+        try:
+            if os.path.getsize(path) < RECORD.size:
+                return 0, 0
+        except OSError:
+            return 0, 0
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            timestamps = _Timestamps(buf)
+            return bisect.bisect_left(timestamps, start), bisect.bisect_left(timestamps, end)
+
+    def _read_slice(self, symbol: str, day: str, lo: int, hi: int) -> List[Tuple[float, float]]:
+        with open(self._path(symbol, day), "rb") as f:
+            f.seek(lo * RECORD.size)
+            return list(RECORD.iter_unpack(f.read((hi - lo) * RECORD.size)))
+
+    def _read_day(self, symbol: str, day: str, start: float, end: float, limit: int) -> List[Tuple[float, float]]:
+        path = self._path(symbol, day)
+        try:
+            if os.path.getsize(path) < RECORD.size:
+                return []
+        except OSError:
+            return []
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            timestamps = _Timestamps(buf)
+            lo = bisect.bisect_left(timestamps, start)
+            hi = bisect.bisect_left(timestamps, end)
+            lo = max(lo, hi - limit)
+            return list(RECORD.iter_unpack(buf[lo * RECORD.size:hi * RECORD.size]))
+
+
+tick_archive = TickArchive()
@@ -1,30 +1,82 @@
-import time
-from typing import Optional, Set
+import asyncio
+import logging
+from typing import FrozenSet, Optional
 
 from fastapi import HTTPException, Request, WebSocket, status
 
 from backend.config import get_settings
 from backend.redis_client import redis_client
+from backend.rate_limit import rate_limiter
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
 
-_rate_state = {}
-_rate_state_last_cleanup = 0.0
-_rate_state_cleanup_interval = 300.0
+def _parse_keys(raw: str) -> FrozenSet[str]:
+    raw = (raw or "").strip()
+    if not raw:
+        return frozenset()
+    return frozenset(k.strip() for k in raw.split(",") if k.strip())
 
 
-def _parse_allowed_keys() -> Set[str]:
-    raw = (settings.API_KEYS or "").strip()
-    if not raw:
-        return set()
-    return {k.strip() for k in raw.split(",") if k.strip()}
+def _parse_allowed_keys() -> FrozenSet[str]:
+    return _parse_keys(settings.API_KEYS)
 
 
-def _parse_admin_keys() -> Set[str]:
-    raw = (settings.ADMIN_API_KEYS or "").strip()
-    if not raw:
-        return set()
-    return {k.strip() for k in raw.split(",") if k.strip()}
+def _parse_admin_keys() -> FrozenSet[str]:
+    return _parse_keys(settings.ADMIN_API_KEYS)
+
+
+# 管理端變更 key 後發布於此頻道，各進程收到即重新載入
+AUTH_INVALIDATE_CHANNEL = "auth:invalidate"
+
+
+class KeyCache:
+    """
+    API key 集合的進程內快取 (frozenset)：驗證時不需任何 Redis 往返。
+    動態 key 與停用 key 由 Redis 載入，收到 AUTH_INVALIDATE_CHANNEL 時立即重新載入，
+    另每 AUTH_CACHE_REFRESH_SECONDS 秒完整重新載入一次作為保險。
+    """
+
+    def __init__(self):
+        self.env_keys = _parse_allowed_keys()
+        self.admin_keys = _parse_admin_keys()
+        self.dynamic_keys: FrozenSet[str] = frozenset()
+        self.disabled_keys: FrozenSet[str] = frozenset()
+        self.loaded = False
+
+    async def refresh(self):
+        pipe = await redis_client.pipeline(transaction=False)
+        pipe.smembers("auth:dynamic_keys")
+        pipe.smembers("auth:disabled_keys")
+        dynamic, disabled = await pipe.execute()
+        # 以整個 frozenset 替換，讀取端不會看到更新到一半的集合
+        self.dynamic_keys = frozenset(dynamic or ())
+        self.disabled_keys = frozenset(disabled or ())
+        self.loaded = True
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            await self.refresh()
+
+    async def handle_invalidate(self, channel: str, data: str):
+        await self.refresh()
+
+    async def refresh_loop(self):
+        while True:
+            await asyncio.sleep(max(1, int(settings.AUTH_CACHE_REFRESH_SECONDS)))
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing API key cache: {e}")
+
+
+key_cache = KeyCache()
+
+
+async def invalidate_key_cache():
+    """管理端變更 key 後呼叫：本進程立即重新載入，並通知其他進程"""
+    await key_cache.refresh()
+    await redis_client.publish(AUTH_INVALIDATE_CHANNEL, "1")
 
 
 def _extract_api_key_from_headers(headers) -> Optional[str]:
@@ -42,66 +94,37 @@ def _extract_api_key_from_headers(headers) -> Optional[str]:
     return None
 
 
-async def _get_dynamic_keys() -> Set[str]:
-    keys = await redis_client.smembers("auth:dynamic_keys")
-    return {k for k in keys} if keys else set()
-
-
 async def _is_allowed(api_key: Optional[str]) -> bool:
-    allowed = _parse_allowed_keys()
-    dynamic = await _get_dynamic_keys()
+    await key_cache.ensure_loaded()
+    allowed = key_cache.env_keys
+    dynamic = key_cache.dynamic_keys
     if not allowed and not dynamic:
         return True
     return api_key in allowed or api_key in dynamic
 
 
 def _is_admin_allowed(api_key: Optional[str]) -> bool:
-    allowed = _parse_admin_keys()
+    allowed = key_cache.admin_keys
     if not allowed:
         return False
     return api_key in allowed
 
 
-def _rate_limit_key(client_id: str, api_key: Optional[str], scope: str) -> str:
-    key_part = api_key or "anonymous"
-    return f"{client_id}:{key_part}:{scope}"
-
-
-def _check_rate_limit(client_id: str, api_key: Optional[str], scope: str) -> bool:
-    limit = max(1, int(settings.RATE_LIMIT_PER_MINUTE))
-    burst = max(0, int(settings.RATE_LIMIT_BURST))
-    max_allowed = limit + burst
-
-    global _rate_state_last_cleanup
-    now = time.time()
-    window = 60
-    key = _rate_limit_key(client_id, api_key, scope)
+async def _check_rate_limit(client_id: str, api_key: Optional[str], scope: str) -> bool:
+    return await rate_limiter.allow(client_id, api_key, scope)
 
-    if now - _rate_state_last_cleanup > _rate_state_cleanup_interval:
-        cutoff = now - (window * 2)
-        for k in list(_rate_state.keys()):
-            if _rate_state[k].get("start", 0) < cutoff:
-                _rate_state.pop(k, None)
-        _rate_state_last_cleanup = now
 
-    state = _rate_state.get(key)
-    if not state:
-        _rate_state[key] = {"start": now, "count": 1}
-        return True
+async def verify_api_key(request: Request) -> str:
+    return await _verify_request(request, _extract_api_key_from_headers(request.headers))
 
-    if now - state["start"] >= window:
-        _rate_state[key] = {"start": now, "count": 1}
-        return True
 
-    if state["count"] >= max_allowed:
-        return False
+async def verify_stream_api_key(request: Request) -> str:
+    """SSE 端點：瀏覽器的 EventSource 無法自訂 Header，另接受 api_key query 參數"""
+    api_key = _extract_api_key_from_headers(request.headers) or request.query_params.get("api_key")
+    return await _verify_request(request, api_key)
 
-    state["count"] += 1
-    return True
 
-
-async def verify_api_key(request: Request) -> str:
-    api_key = _extract_api_key_from_headers(request.headers)
+async def _verify_request(request: Request, api_key: Optional[str]) -> str:
     if not await _is_allowed(api_key):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key")
 
@@ -109,7 +132,7 @@ async def verify_api_key(request: Request) -> str:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="API key disabled")
 
     client = request.client.host if request.client else "unknown"
-    if not _check_rate_limit(client, api_key, request.url.path):
+    if not await _check_rate_limit(client, api_key, request.url.path):
         raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded")
 
     return api_key or ""
@@ -129,7 +152,7 @@ async def verify_ws_api_key(websocket: WebSocket) -> Optional[str]:
         return None
 
     client = websocket.client.host if websocket.client else "unknown"
-    if not _check_rate_limit(client, api_key, websocket.url.path):
+    if not await _check_rate_limit(client, api_key, websocket.url.path):
         await websocket.close(code=1008)
         return None
 
@@ -142,7 +165,7 @@ async def verify_admin_api_key(request: Request) -> str:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin API key")
 
     client = request.client.host if request.client else "unknown"
-    if not _check_rate_limit(client, api_key, request.url.path):
+    if not await _check_rate_limit(client, api_key, request.url.path):
         raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded")
 
     return api_key or ""
@@ -151,4 +174,5 @@ async def verify_admin_api_key(request: Request) -> str:
 async def _is_disabled(api_key: str) -> bool:
     if not api_key:
         return False
-    return bool(await redis_client.sismember("auth:disabled_keys", api_key))
+    await key_cache.ensure_loaded()
+    return api_key in key_cache.disabled_keys
@@ -0,0 +1,118 @@
+"""
+增量 OHLC K 線 (1m / 5m / 15m / 1h / 1d)。
+
+Aggregator 每產生一筆聚合結果就計算各週期的當前 K 線，
+並在同一個 pipeline 中寫回 Redis：market:candles:{symbol}:{tf}
+(ZSET，score = 區間起始時間，member = K 線 JSON)。
+pipeline 執行成功後才 commit 到記憶體，寫入失敗時記憶體與 Redis 不會分歧。
+各週期有各自的保留期限，由背景維護任務裁剪。
+"""
+import json
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from backend.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# 週期 -> 秒數
+TIMEFRAMES = {
+    "1m": 60,
+    "5m": 300,
+    "15m": 900,
+    "1h": 3600,
+    "1d": 86400,
+}
+
+# 週期 -> 保留秒數
+CANDLE_RETENTION = {
+    "1m": 7 * 86400,
+    "5m": 30 * 86400,
+    "15m": 90 * 86400,
+    "1h": 365 * 86400,
+    "1d": 10 * 365 * 86400,
+}
+
+CANDLE_TRIM_INTERVAL = 60
+
+
+def candles_key(symbol: str, tf: str) -> str:
+    return f"market:candles:{symbol}:{tf}"
+
+
+class CandleAggregator:
+    def __init__(self):
+        self._current: Dict[Tuple[str, str], Dict] = {}  # (symbol, tf) -> 當前 K 線
+        self._last_trim = 0.0
+
+    async def load(self, symbols: List[str]):
+        """啟動時從 Redis 還原各週期最後一根 K 線，讓重啟後能接續累計"""
+        pipe = await redis_client.pipeline(transaction=False)
+        keys = [(symbol, tf) for symbol in symbols for tf in TIMEFRAMES]
+        for symbol, tf in keys:
+            pipe.zrevrange(candles_key(symbol, tf), 0, 0)
+        replies = await pipe.execute()
+        for (symbol, tf), rows in zip(keys, replies):
+            if rows:
+                try:
+                    self._current[(symbol, tf)] = json.loads(rows[0])
+                except ValueError:
+                    logger.warning(f"Malformed candle in {candles_key(symbol, tf)}")
+
+    def update(self, symbol: str, price: float, ts: float) -> List[Tuple[str, Dict]]:
+        """
+        以一筆聚合價格計算各週期 K 線，回傳有變動的 (tf, candle)。
+        不修改記憶體狀態；寫入 Redis 成功後需呼叫 commit()。
+        """
+        changed = []
+        for tf, seconds in TIMEFRAMES.items():
+            bucket = int(ts // seconds * seconds)
+            current = self._current.get((symbol, tf))
+            if current is None or bucket > current["time"]:
+                candle = {"time": bucket, "open": price, "high": price, "low": price, "close": price, "ticks": 1}
+            elif bucket == current["time"]:
+                candle = dict(current)
+                candle["high"] = max(candle["high"], price)
+                candle["low"] = min(candle["low"], price)
+                candle["close"] = price
+                candle["ticks"] += 1
+            else:
+                # 晚到的舊區間資料不回寫已結束的 K 線
+                continue
+            changed.append((tf, candle))
+        return changed
+
+    def commit(self, symbol: str, changed: List[Tuple[str, Dict]]):
+        """Redis 寫入成功後套用 update() 的結果"""
+        for tf, candle in changed:
+            self._current[(symbol, tf)] = candle
+
+    def write(self, pipe, symbol: str, changed: List[Tuple[str, Dict]]):
+        """在呼叫端的 pipeline 中覆寫變動的 K 線 (先刪同一區間的舊版本)"""
+        for tf, candle in changed:
+            key = candles_key(symbol, tf)
+            pipe.zremrangebyscore(key, candle["time"], candle["time"])
+            pipe.zadd(key, {json.dumps(candle): candle["time"]})
+
+    async def trim_due(self, symbols: List[str], now: Optional[float] = None) -> int:
+        """每 CANDLE_TRIM_INTERVAL 秒依各週期保留期限裁剪一次，回傳移除的 K 線數"""
+        if now is None:
+            now = time.time()
+        if now - self._last_trim < CANDLE_TRIM_INTERVAL:
+            return 0
+        self._last_trim = now
+        pipe = await redis_client.pipeline(transaction=False)
+        for symbol in symbols:
+            for tf, retention in CANDLE_RETENTION.items():
+                pipe.zremrangebyscore(candles_key(symbol, tf), 0, now - retention)
+        replies = await pipe.execute()
+        return sum(int(r or 0) for r in replies)
+
+
+async def read_candles(symbol: str, tf: str, start: Optional[float], end: Optional[float], limit: int) -> List[Dict]:
+    """讀取區間內時間遞增的最後 limit 根 K 線 (LIMIT 由 Redis 端處理)"""
+    min_score = start if start is not None else "-inf"
+    max_score = end if end is not None else "+inf"
+    rows = await redis_client.zrevrangebyscore(candles_key(symbol, tf), max_score, min_score, start=0, num=limit)
+    return [json.loads(r) for r in reversed(rows or [])]
@@ -0,0 +1,181 @@
+"""
+回應壓縮中介層：依 Accept-Encoding 協商 brotli (br) 或 gzip。
+
+- 只壓縮大於 COMPRESSION_MIN_BYTES 的回應；已有 Content-Encoding、304 與串流事件 (SSE) 不處理
+- 支援分段 (streaming) 回應，逐段壓縮輸出
+- brotli 為選用依賴，未安裝時只提供 gzip
+"""
+import zlib
+from typing import Optional
+
+from backend.config import get_settings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 選用依賴
+    brotli = None
+
+settings = get_settings()
+
+# 不壓縮的內容類型 (已壓縮或需即時推送)
+SKIP_CONTENT_TYPES = ("text/event-stream", "application/gzip", "application/zip")
+
+
+class _GzipCompressor:
+    def __init__(self, level: int):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        # 串流中途：Z_SYNC_FLUSH 讓客戶端可立即解出已送出的內容
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality: int):
+        self._obj = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.process(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+    def finish(self) -> bytes:
+        return self._obj.finish()
+
+
+def _accepted(header: str) -> set:
+    encodings = set()
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """回傳使用的編碼 (br / gzip)，不支援時為 None"""
+    accepted = _accepted(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: Optional[int] = None):
+        self.app = app
+        self.minimum_size = int(minimum_size if minimum_size is not None else settings.COMPRESSION_MIN_BYTES)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = negotiate(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressingResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressingResponder:
+    def __init__(self, app, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send = None
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_with_compression)
+
+    def _new_compressor(self):
+        if self.encoding == "br":
+            return _BrotliCompressor(settings.COMPRESSION_BROTLI_QUALITY)
+        return _GzipCompressor(settings.COMPRESSION_GZIP_LEVEL)
+
+    async def send_with_compression(self, message):
+        kind = message["type"]
+        if kind == "http.response.start":
+            self.start_message = message
+            headers = {k.lower(): v for k, v in message.get("headers", [])}
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+            self.passthrough = (
+                message["status"] < 200
+                or message["status"] in (204, 304)
+                or b"content-encoding" in headers
+                or content_type.startswith(SKIP_CONTENT_TYPES)
+            )
+            return
+
+        if kind != "http.response.body":
+            await self.send(message)
+            return
+
+        if self.passthrough:
+            if self.start_message is not None:
+                await self.send(self.start_message)
+                self.start_message = None
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            if not more_body and len(body) < self.minimum_size:
+                await self.send(start)
+                await self.send(message)
+                self.passthrough = True
+                return
+            self.compressor = self._new_compressor()
+            headers = [
+                (k, _weak_etag(v) if k.lower() == b"etag" else v)
+                for k, v in start.get("headers", [])
+                if k.lower() != b"content-length"
+            ]
+            headers = _add_vary(headers)
+            headers.append((b"content-encoding", self.encoding.encode()))
+            if not more_body:
+                data = self.compressor.compress(body) + self.compressor.finish()
+                headers.append((b"content-length", str(len(data)).encode()))
+                await self.send({**start, "headers": headers})
+                await self.send({"type": "http.response.body", "body": data})
+                return
+            await self.send({**start, "headers": headers})
+
+        if more_body:
+            data = self.compressor.compress(body) + self.compressor.flush()
+            if data:
+                await self.send({"type": "http.response.body", "body": data, "more_body": True})
+        else:
+            data = self.compressor.compress(body) + self.compressor.finish()
+            await self.send({"type": "http.response.body", "body": data})
+
+
+def _weak_etag(value: bytes) -> bytes:
+    # 壓縮後的 bytes 與原始表示不同，強 ETag 改為弱 ETag (與 nginx gzip 行為一致)
+    return value if value.startswith(b"W/") else b"W/" + value
+
+
+def _add_vary(headers):
+    for i, (key, value) in enumerate(headers):
+        if key.lower() == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[i] = (key, value + b", Accept-Encoding")
+            return headers
+    headers.append((b"vary", b"Accept-Encoding"))
+    return headers
@@ -21,10 +21,17 @@ class Settings(BaseSettings):
     # API Auth
     API_KEYS: str = ""  # Comma separated API keys
     ADMIN_API_KEYS: str = ""  # Comma separated admin keys
+    # API key 快取的完整重新載入間隔 (變更時另由 pubsub 立即失效)
+    AUTH_CACHE_REFRESH_SECONDS: int = 30
 
     # Rate Limit
     RATE_LIMIT_PER_MINUTE: int = 120
     RATE_LIMIT_BURST: int = 30
+    # 個別路由 / 個別 key 的限制，格式 "name=每分鐘次數:突發次數"，逗號分隔 (key 優先於路由)
+    RATE_LIMIT_ROUTES: str = ""
+    RATE_LIMIT_KEYS: str = ""
+    # 每次向 Redis 預扣的格數，於本地消耗 (1 = 每個請求都查詢 Redis)
+    RATE_LIMIT_LEASE_SIZE: int = 10
     
     # Circuit Breaker Defaults
     FAILURE_THRESHOLD: int = 5
@@ -36,6 +43,58 @@ class Settings(BaseSettings):
     # History retention
     HISTORY_RETENTION_HOURS: int = 24
     HISTORY_MAX_POINTS: int = 10000
+    # 歷史儲存格式：json (每筆完整 JSON) / compact (Gorilla 壓縮區塊，可保留更久)
+    HISTORY_STORE: str = "json"
+    HISTORY_CHUNK_SECONDS: int = 3600
+    HISTORY_COMPACT_RETENTION_DAYS: int = 30
+    # 歷史裁剪攤銷：每 N 筆寫入或每 T 秒裁剪一次 (超量上限 N 筆 / T 秒)
+    HISTORY_TRIM_EVERY_N: int = 60
+    HISTORY_TRIM_INTERVAL_SECONDS: int = 30
+    # 進程內近期歷史環形緩衝，每個 symbol 保留的點數 (0 = 停用)
+    HISTORY_RING_SIZE: int = 3600
+    # /api/v1/history 的 max_points 降採樣：讀取來源點數上限與結果快取
+    HISTORY_DOWNSAMPLE_SOURCE_LIMIT: int = 50000
+    HISTORY_DOWNSAMPLE_CACHE_SECONDS: float = 10
+    HISTORY_DOWNSAMPLE_CACHE_SIZE: int = 256
+    # /api/v1/history/export 每批讀取的點數
+    HISTORY_EXPORT_CHUNK_SIZE: int = 2000
+    # 本機磁碟長期封存 (每 symbol 每日一個二進位檔)，/api/v1/history 超出 Redis 範圍時讀取
+    ARCHIVE_ENABLED: bool = False
+    ARCHIVE_DIR: str = "data/archive"
+    ARCHIVE_FLUSH_SECONDS: float = 5
+    ARCHIVE_RETENTION_DAYS: int = 365
+
+    # 變動抑制發布：價格與開收盤狀態未變時，每 N 秒才發布一次心跳 (0 = 每次都發布)
+    PUBLISH_HEARTBEAT_SECONDS: float = 10
+
+    # WebSocket 每個客戶端的待送緩衝：同一 symbol 只保留最新值，最多 N 個 symbol (超過時丟棄最舊)
+    WS_CLIENT_QUEUE_SIZE: int = 256
+    # 待送緩衝持續未清空超過 N 秒的慢速客戶端會被中斷連線
+    WS_SLOW_CLIENT_SECONDS: float = 15
+
+    # SSE (/api/v1/stream)：Last-Event-ID 重連可補送的最近訊息數，與無訊息時的保活註解間隔秒數
+    SSE_REPLAY_SIZE: int = 1000
+    SSE_KEEPALIVE_SECONDS: float = 15
+
+    # 串流限速 (max_rate) 共用時間輪的 tick 秒數 (flush 計時精度)
+    STREAM_TIMER_TICK_SECONDS: float = 0.05
+
+    # HTTP 快取 (ETag / 304)：/latest 與 /history 回應的 Cache-Control max-age 秒數，供 nginx 微快取
+    HTTP_CACHE_LATEST_SECONDS: int = 1
+    HTTP_CACHE_HISTORY_SECONDS: int = 5
+
+    # 回應壓縮 (brotli 需安裝 brotli 套件，否則只用 gzip)
+    COMPRESSION_MIN_BYTES: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+
+    # Ingest 模式
+    # inline: API 進程內直接輪詢與聚合 (單進程，預設)
+    # sharded: API 進程只服務客戶端，由 `python -m backend.ingest` 分片多進程採集
+    INGEST_MODE: str = "inline"
+    INGEST_WORKERS: int = 2
+    INGEST_STREAM_KEY: str = "market:ticks"
+    INGEST_STREAM_MAXLEN: int = 10000
 
     class Config:
         env_file = ".env"
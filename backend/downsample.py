@@ -0,0 +1,90 @@
+"""
+歷史資料的伺服器端降採樣 (Largest-Triangle-Three-Buckets)。
+
+圖表寬度只有數百像素時，以 LTTB 從每個分桶中挑出與相鄰桶形成最大三角形面積的點，
+在大幅減少點數的同時保留走勢的視覺形狀 (峰谷不會被平均掉)。
+結果以 (symbol, start, end, limit, max_points, 資料版本) 為鍵短暫快取，儀表板的重複查詢可直接重用。
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+from backend.config import get_settings
+
+settings = get_settings()
+
+# LTTB 至少需要首、尾與一個中間點
+MIN_POINTS = 3
+
+
+def lttb(points: List[Dict], threshold: int) -> List[Dict]:
+    """將時間遞增的點 (含 timestamp / price) 降採樣為最多 threshold 筆，保留首尾點"""
+    n = len(points)
+    threshold = max(MIN_POINTS, int(threshold))
+    if n <= threshold:
+        return points
+
+    xs = [p["timestamp"] for p in points]
+    ys = [p["price"] for p in points]
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0  # 上一個選中點的索引
+
+    for i in range(threshold - 2):
+        # 下一個桶的平均點作為三角形的第三個頂點
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if next_start >= next_end:
+            next_start, next_end = n - 1, n
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = xs[a], ys[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+class DownsampleCache:
+    """有 TTL 與容量上限的 LRU 快取 (進程內)"""
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = float(ttl if ttl is not None else settings.HISTORY_DOWNSAMPLE_CACHE_SECONDS)
+        self.max_entries = max(1, int(max_entries or settings.HISTORY_DOWNSAMPLE_CACHE_SIZE))
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, now: Optional[float] = None) -> Optional[List[Dict]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now is None:
+            now = time.time()
+        expires, value = entry
+        if now >= expires:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: List[Dict], now: Optional[float] = None):
+        if self.ttl <= 0:
+            return
+        if now is None:
+            now = time.time()
+        self._entries[key] = (now + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+downsample_cache = DownsampleCache()
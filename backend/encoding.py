@@ -0,0 +1,64 @@
+"""
+API 回應編碼：JSON (預設) 或 MessagePack (Accept: application/msgpack，選用依賴)，
+以及欄式 (columnar) 版面：以 timestamps[] / prices[] 等平行陣列取代逐點物件。
+"""
+import json
+from typing import Dict, List, Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - 選用依賴
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+LAYOUTS = ("rows", "columns")
+
+CANDLE_FIELDS = ("time", "open", "high", "low", "close", "ticks")
+
+
+def wants_msgpack(request: Request) -> bool:
+    """Accept 明確要求 msgpack 且已安裝 msgpack 時才使用 (其餘一律 JSON)"""
+    if msgpack is None:
+        return False
+    accept = request.headers.get("accept", "")
+    return any(
+        item.split(";")[0].strip().lower() in (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+        for item in accept.split(",")
+    )
+
+
+def media_type(request: Request) -> str:
+    return MSGPACK_MEDIA_TYPE if wants_msgpack(request) else "application/json"
+
+
+def encode(request: Request, content, headers: Optional[Dict[str, str]] = None) -> Response:
+    """依協商結果回傳 msgpack 或 JSON 回應"""
+    if wants_msgpack(request):
+        return Response(msgpack.packb(content, use_bin_type=True), media_type=MSGPACK_MEDIA_TYPE, headers=headers)
+    return JSONResponse(content, headers=headers)
+
+
+def json_to_msgpack(body: bytes) -> bytes:
+    """將已序列化的 JSON 轉為 msgpack (用於預先組好的 /latest 回應)"""
+    return msgpack.packb(json.loads(body), use_bin_type=True)
+
+
+def msgpack_envelope(timestamp: float, key: str, packed: bytes) -> bytes:
+    """組成 msgpack 的 {"timestamp": ..., key: ...}，其中 key 的值為已編碼的 msgpack (不重新編碼)"""
+    return b"\x82" + msgpack.packb("timestamp") + msgpack.packb(timestamp) + msgpack.packb(key) + packed
+
+
+def history_columns(points: List[Dict]) -> Dict[str, List]:
+    """歷史點轉為欄式：{"timestamp": [...], "price": [...]}"""
+    return {
+        "timestamp": [p["timestamp"] for p in points],
+        "price": [p["price"] for p in points],
+    }
+
+
+def candle_columns(candles: List[Dict]) -> Dict[str, List]:
+    return {field: [c[field] for c in candles] for field in CANDLE_FIELDS}
@@ -0,0 +1,67 @@
+"""
+歷史資料串流匯出 (NDJSON / CSV，可即時 gzip 壓縮)。
+
+由 history.iter_history 逐批讀取 Redis (及磁碟封存)，每批立即格式化並輸出，
+記憶體用量只與批次大小相關，與匯出區間長短無關。
+"""
+import json
+import zlib
+from typing import AsyncIterator, List, Optional
+
+from backend.config import get_settings
+from backend.history import iter_history
+
+settings = get_settings()
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+CSV_HEADER = "symbol,timestamp,price\n"
+
+
+def _format_ndjson(symbol: str, batch) -> str:
+    lines = []
+    for ts, price, raw in batch:
+        # json 模式直接輸出儲存的原始 JSON，不重新解析/序列化
+        lines.append(raw if raw is not None else json.dumps({"symbol": symbol, "price": price, "timestamp": ts}))
+    return "\n".join(lines) + "\n"
+
+
+def _format_csv(symbol: str, batch) -> str:
+    lines = []
+    for ts, price, raw in batch:
+        if price is None:
+            price = json.loads(raw)["price"]
+        lines.append(f"{symbol},{ts!r},{price!r}")
+    return "\n".join(lines) + "\n"
+
+
+async def export_history(
+    symbols: List[str],
+    start: Optional[float],
+    end: Optional[float],
+    fmt: str = "ndjson",
+    compress: bool = False,
+    chunk_size: Optional[int] = None,
+) -> AsyncIterator[bytes]:
+    """依序匯出各 symbol 的歷史，產生可直接交給 StreamingResponse 的位元組區塊"""
+    chunk_size = max(1, int(chunk_size or settings.HISTORY_EXPORT_CHUNK_SIZE))
+    formatter = _format_csv if fmt == "csv" else _format_ndjson
+    # wbits=31：輸出完整 gzip 格式 (含標頭與 CRC)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def encode(text: str) -> bytes:
+        data = text.encode()
+        return compressor.compress(data) if compressor else data
+
+    if fmt == "csv":
+        yield encode(CSV_HEADER)
+    for symbol in symbols:
+        async for batch in iter_history(symbol, start, end, chunk_size):
+            data = encode(formatter(symbol, batch))
+            if data:
+                yield data
+    if compressor:
+        yield compressor.flush()
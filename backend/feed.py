@@ -0,0 +1,80 @@
+"""
+每個進程共用的 Redis PubSub 訂閱 (單一連線 + pattern 訂閱)。
+
+各模組在啟動前以 market_feed.on(pattern, handler) 註冊處理函式，
+start() 後由單一背景任務接收訊息並依 pattern 分派，避免每個功能各自建立訂閱連線。
+handler 簽名為 handler(channel: str, data: str)，可為一般函式或 coroutine。
+"""
+import asyncio
+import inspect
+import logging
+from typing import Callable, Dict, List
+
+from backend.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# 每一個聚合點 (不受變動抑制) 的通知頻道，分片模式由 ingest 的 aggregator 發布
+POINTS_CHANNEL_PREFIX = "market:points:"
+
+
+class MarketFeed:
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable]] = {}
+        self._pubsub = None
+        self._task = None
+
+    def on(self, pattern: str, handler: Callable):
+        """註冊 pattern 的處理函式 (需在 start() 之前呼叫)"""
+        self._handlers.setdefault(pattern, []).append(handler)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """建立訂閱；回傳時已完成 PSUBSCRIBE，之後發布的訊息不會遺漏"""
+        if self.running or not self._handlers:
+            return
+        self._pubsub = await redis_client.pubsub()
+        await self._pubsub.psubscribe(*self._handlers)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pubsub:
+            try:
+                await self._pubsub.punsubscribe()
+                await self._pubsub.close()
+            except Exception as e:
+                logger.warning(f"Error closing market feed: {e}")
+            self._pubsub = None
+
+    async def _run(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Market feed error: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not message or message.get("type") != "pmessage":
+                continue
+            for handler in self._handlers.get(message["pattern"], []):
+                try:
+                    result = handler(message["channel"], message["data"])
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.error(f"Market feed handler error on {message['channel']}: {e}")
+
+
+market_feed = MarketFeed()
@@ -0,0 +1,471 @@
+"""
+歷史資料的寫入、維護與讀取。
+
+兩種儲存格式 (HISTORY_STORE)：
+- json：每筆完整 JSON 存於 ZSET market:history:{symbol} (預設)
+- compact：Gorilla 壓縮區塊 (見 history_codec)，未封存的點暫存於 LIST
+  market:hist:open:{symbol}，每個時間視窗封存為 market:hist:chunks:{symbol} 內的一個成員；
+  交易對、來源等中繼資料不逐點儲存 (最新中繼資料保留在 market:latest:{symbol})
+
+寫入路徑只做單一追加；裁剪與封存改由背景任務攤銷執行：
+每個 symbol 累積 HISTORY_TRIM_EVERY_N 筆寫入或距上次裁剪超過
+HISTORY_TRIM_INTERVAL_SECONDS 秒時才處理一次。
+超量上限：最多多保留 N 筆，或超出保留時間 T 秒。
+
+超出 Redis 保留範圍的區間可由磁碟封存 (見 archive) 補齊。
+"""
+import base64
+import binascii
+import json
+import math
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from backend.config import get_settings
+from backend.redis_client import redis_client
+from backend.metrics import record_history_trim
+from backend.history_codec import encode_chunk, decode_chunk
+from backend.archive import tick_archive
+from backend.history_ring import recent_history
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def history_key(symbol: str) -> str:
+    return f"market:history:{symbol}"
+
+
+def compact_open_key(symbol: str) -> str:
+    return f"market:hist:open:{symbol}"
+
+
+def compact_chunks_key(symbol: str) -> str:
+    return f"market:hist:chunks:{symbol}"
+
+
+def use_compact_store() -> bool:
+    return settings.HISTORY_STORE == "compact"
+
+
+def append_history(pipe, output: Dict, output_json: str):
+    """在呼叫端的 pipeline 中追加一筆歷史 (寫入路徑只有單一指令)"""
+    symbol = output["symbol"]
+    if use_compact_store():
+        pipe.rpush(compact_open_key(symbol), f"{round(output['timestamp'] * 1000)}:{output['price']!r}")
+    else:
+        pipe.zadd(history_key(symbol), {output_json: output["timestamp"]})
+
+
+def _parse_open_point(row: str) -> Tuple[int, float]:
+    ts_ms, price = row.split(":", 1)
+    return int(ts_ms), float(price)
+
+
+def _chunk_member(window_start: int, points: List[Tuple[int, float]]) -> str:
+    blob = base64.b64encode(encode_chunk(points)).decode("ascii")
+    return f"{window_start}:{len(points)}:{blob}"
+
+
+def _decode_member(member: str) -> List[Tuple[int, float]]:
+    _start, _count, blob = member.split(":", 2)
+    return decode_chunk(base64.b64decode(blob))
+
+
+def _member_count(member: str) -> int:
+    return int(member.split(":", 2)[1])
+
+
+class CompactHistoryStore:
+    """壓縮歷史的封存、保留與區間讀取"""
+
+    def __init__(self, chunk_seconds: Optional[int] = None):
+        self.chunk_seconds = max(60, int(chunk_seconds or settings.HISTORY_CHUNK_SECONDS))
+
+    def _window(self, ts_ms: int) -> int:
+        return (ts_ms // 1000) // self.chunk_seconds * self.chunk_seconds
+
+    async def maintain(self, symbols: List[str]) -> Dict[str, int]:
+        """
+        封存已結束時間視窗的點並套用保留期限，回傳各 symbol 移除的點數。
+        只以 LTRIM 移除已讀取的前綴，期間新追加到尾端的點不受影響。
+        """
+        pipe = await redis_client.pipeline(transaction=False)
+        for symbol in symbols:
+            pipe.lrange(compact_open_key(symbol), 0, -1)
+        open_rows = await pipe.execute()
+
+        now = time.time()
+        current_window = int(now) // self.chunk_seconds * self.chunk_seconds
+        retention_days = max(1, int(settings.HISTORY_COMPACT_RETENTION_DAYS))
+        expire_before = now - retention_days * 86400 - self.chunk_seconds
+
+        pipe = await redis_client.pipeline(transaction=True)
+        expired_reply_index = []
+        op_count = 0
+        for symbol, rows in zip(symbols, open_rows):
+            chunks_key = compact_chunks_key(symbol)
+            points = [_parse_open_point(r) for r in rows or []]
+            # 封存到最後一個屬於已結束視窗的點為止 (亂序抵達的點一併封存)
+            sealed = 0
+            for i, (ts_ms, _price) in enumerate(points):
+                if self._window(ts_ms) < current_window:
+                    sealed = i + 1
+            if sealed:
+                windows: Dict[int, List[Tuple[int, float]]] = {}
+                for point in points[:sealed]:
+                    windows.setdefault(self._window(point[0]), []).append(point)
+                for window_start, window_points in windows.items():
+                    pipe.zadd(chunks_key, {_chunk_member(window_start, window_points): window_start})
+                pipe.ltrim(compact_open_key(symbol), sealed, -1)
+                op_count += len(windows) + 1
+
+            expired_reply_index.append(op_count)
+            pipe.zrangebyscore(chunks_key, 0, expire_before)
+            pipe.zremrangebyscore(chunks_key, 0, expire_before)
+            op_count += 2
+        replies = await pipe.execute()
+
+        return {
+            symbol: sum(_member_count(m) for m in replies[index] or [])
+            for symbol, index in zip(symbols, expired_reply_index)
+        }
+
+    async def read(self, symbol: str, start: Optional[float], end: Optional[float], limit: int) -> List[Dict]:
+        """解碼區間內的點 (含尚未封存者)，回傳時間遞增的最後 limit 筆"""
+        open_rows = await redis_client.lrange(compact_open_key(symbol), 0, -1)
+        points = [_parse_open_point(r) for r in open_rows or []]
+        chunks_key = compact_chunks_key(symbol)
+
+        if start is not None or end is not None:
+            lo = start if start is not None else 0
+            hi = end if end is not None else math.inf
+            members = await redis_client.zrangebyscore(
+                chunks_key, max(0, lo - self.chunk_seconds), "+inf" if math.isinf(hi) else hi
+            )
+            for member in members or []:
+                points.extend(_decode_member(member))
+            lo_ms, hi_ms = lo * 1000, hi * 1000
+            points = [p for p in points if lo_ms <= p[0] <= hi_ms]
+        else:
+            # 由新到舊逐批讀取區塊直到足夠
+            offset, batch = 0, 4
+            while len(points) < limit:
+                members = await redis_client.zrevrange(chunks_key, offset, offset + batch - 1)
+                if not members:
+                    break
+                for member in members:
+                    points.extend(_decode_member(member))
+                offset += batch
+
+        points.sort(key=lambda p: p[0])
+        return [
+            {"symbol": symbol, "price": price, "timestamp": ts_ms / 1000}
+            for ts_ms, price in points[-limit:]
+        ]
+
+
+compact_store = CompactHistoryStore()
+
+
+# 分頁游標：每個 symbol 記錄 (上一頁最舊的分數, 該分數已回傳的筆數)，下一頁由此往更舊讀取
+Position = Tuple[float, int]
+
+
+def encode_cursor(positions: Dict[str, Position]) -> Optional[str]:
+    """將各 symbol 的分頁位置編碼為不透明游標，全部讀完時回傳 None"""
+    if not positions:
+        return None
+    payload = json.dumps({"v": 1, "p": {s: [score, skip] for s, (score, skip) in positions.items()}})
+    return base64.urlsafe_b64encode(payload.encode()).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Position]:
+    """還原 encode_cursor 的輸出，格式不符時拋出 ValueError"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if payload.get("v") != 1:
+            raise ValueError("unsupported cursor version")
+        return {str(s): (float(score), int(skip)) for s, (score, skip) in payload["p"].items()}
+    except (TypeError, KeyError, AttributeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(f"invalid cursor: {e}") from e
+
+
+async def _redis_oldest(symbol: str) -> Optional[float]:
+    """Redis 目前保留的最舊時間 (compact 為最舊區塊的視窗起點)，無資料時為 None"""
+    if use_compact_store():
+        rows = await redis_client.zrange(compact_chunks_key(symbol), 0, 0, withscores=True)
+        if rows:
+            return float(rows[0][1])
+        open_rows = await redis_client.lrange(compact_open_key(symbol), 0, 0)
+        return _parse_open_point(open_rows[0])[0] / 1000 if open_rows else None
+    rows = await redis_client.zrange(history_key(symbol), 0, 0, withscores=True)
+    return float(rows[0][1]) if rows else None
+
+
+async def _read_archive(
+    symbol: str, start: float, end: Optional[float], limit: int, skip: int = 0
+) -> List[Dict]:
+    """
+    讀取 [start, end] (含 end) 內早於 Redis 保留範圍的部分 (磁碟封存)。
+    skip 為分頁位置：時間戳等於 end 的最新 skip 筆已在上一頁回傳。
+    """
+    boundary = await _redis_oldest(symbol)
+    archive_end = math.nextafter(end, math.inf) if end is not None else time.time()
+    if boundary is not None and boundary < archive_end:
+        # 時間戳 >= boundary 的點由 Redis 回答 (分頁位置也已套用在 Redis 讀取上)
+        archive_end, skip = boundary, 0
+    if start >= archive_end:
+        return []
+    archived = await tick_archive.read(symbol, start, archive_end, limit + skip)
+    archived = archived[:max(0, len(archived) - skip)]
+    return [{"symbol": symbol, "price": price, "timestamp": ts} for ts, price in archived]
+
+
+def _next_position(timestamps: List[float], limit: int, position: Optional[Position]) -> Optional[Position]:
+    if len(timestamps) < limit:
+        return None
+    oldest = timestamps[0]
+    same = sum(1 for ts in timestamps if ts == oldest)
+    if position is not None and position[0] == oldest:
+        # 整頁都落在同一個分數上，累加略過筆數
+        return oldest, position[1] + same
+    return oldest, same
+
+
+async def read_history_page(
+    symbols: List[str],
+    start: Optional[float],
+    end: Optional[float],
+    limit: int,
+    positions: Optional[Dict[str, Position]] = None,
+    cached: bool = True,
+    compact: bool = False,
+) -> Tuple[Dict[str, List[Dict]], Dict[str, Position]]:
+    """
+    讀取多個 symbol 區間內時間遞增的最後 limit 筆 (由新往舊分頁)，回傳 (資料, 下一頁位置)。
+    json 模式以 ZRANGE BYSCORE REV + LIMIT 在 Redis 端截斷，所有 symbol 共用一個 pipeline；
+    啟用 ARCHIVE_ENABLED 時，早於 Redis 保留範圍的部分由磁碟封存補齊。
+    positions 為上一頁回傳的位置；不在其中的 symbol 視為已讀完。
+    第一頁先查詢進程內的近期緩衝 (history_ring)，涵蓋完整結果時不讀 Redis。
+    compact=True 表示呼叫端只使用 price / timestamp，緩衝命中時不解析完整列。
+    """
+    bounds = {}
+    for symbol in symbols:
+        if positions is None:
+            bounds[symbol] = (end, 0)
+        elif symbol in positions:
+            score, skip = positions[symbol]
+            bounds[symbol] = (end, 0) if end is not None and end < score else (score, skip)
+
+    data: Dict[str, List[Dict]] = {symbol: [] for symbol in symbols}
+    pending = dict(bounds)
+    if cached and positions is None:
+        for symbol in bounds:
+            points = recent_history.query(symbol, start, end, limit, compact)
+            if points is not None:
+                data[symbol] = points
+                del pending[symbol]
+
+    if use_compact_store():
+        for symbol, (max_score, skip) in pending.items():
+            points = await compact_store.read(symbol, start, max_score, limit + skip)
+            data[symbol] = points[:len(points) - skip]
+    elif pending:
+        pipe = await redis_client.pipeline(transaction=False)
+        for symbol, (max_score, skip) in pending.items():
+            pipe.zrevrangebyscore(
+                history_key(symbol),
+                max_score if max_score is not None else "+inf",
+                start if start is not None else "-inf",
+                start=skip,
+                num=limit,
+            )
+        replies = await pipe.execute()
+        for symbol, rows in zip(pending, replies):
+            data[symbol] = [json.loads(r) for r in reversed(rows or [])]
+
+    next_positions: Dict[str, Position] = {}
+    for symbol, (max_score, skip) in bounds.items():
+        points = data[symbol]
+        if symbol in pending and settings.ARCHIVE_ENABLED and start is not None and len(points) < limit:
+            if points:
+                archived = await _read_archive(symbol, start, points[0]["timestamp"], limit - len(points))
+            else:
+                archived = await _read_archive(symbol, start, max_score, limit, skip)
+            points = archived + points
+            data[symbol] = points
+        position = _next_position(
+            [p["timestamp"] for p in points], limit, positions.get(symbol) if positions else None
+        )
+        if position is not None:
+            next_positions[symbol] = position
+    return data, next_positions
+
+
+def read_recent_encoded(
+    symbols: List[str], start: Optional[float], end: Optional[float], limit: int
+) -> Optional[Tuple[Dict[str, bytes], Dict[str, Position]]]:
+    """
+    第一頁完全由近期緩衝涵蓋時，回傳 (symbol -> JSON 陣列 bytes, 下一頁位置)；任一 symbol 未涵蓋則回傳 None。
+    列直接取自緩衝中預先編碼的 bytes，不經 json.loads / 重新序列化。
+    """
+    encoded: Dict[str, bytes] = {}
+    next_positions: Dict[str, Position] = {}
+    for symbol in dict.fromkeys(symbols):
+        hit = recent_history.query_encoded(symbol, start, end, limit)
+        if hit is None:
+            return None
+        encoded[symbol], timestamps = hit
+        position = _next_position(timestamps, limit, None)
+        if position is not None:
+            next_positions[symbol] = position
+    return encoded, next_positions
+
+
+async def read_history(symbol: str, start: Optional[float], end: Optional[float], limit: int) -> List[Dict]:
+    """讀取單一 symbol 區間內時間遞增的最後 limit 筆"""
+    data, _ = await read_history_page([symbol], start, end, limit)
+    return data[symbol]
+
+
+# 匯出列：(timestamp, price, 原始 JSON)；json 模式只有原始 JSON，其餘只有價格
+ExportRow = Tuple[float, Optional[float], Optional[str]]
+
+
+async def _iter_json(symbol: str, lo, hi: float, chunk_size: int):
+    key = history_key(symbol)
+    skip = 0
+    while True:
+        rows = await redis_client.zrangebyscore(key, lo, hi, start=skip, num=chunk_size, withscores=True)
+        if not rows:
+            return
+        yield [(score, None, member) for member, score in rows]
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][1]
+        same = sum(1 for _member, score in rows if score == last)
+        skip = skip + same if last == lo else same
+        lo = last
+
+
+async def _iter_compact(symbol: str, lo: float, hi: float, chunk_size: int):
+    chunks_key = compact_chunks_key(symbol)
+    lo_ms, hi_ms = lo * 1000, hi * 1000
+    batch: List[ExportRow] = []
+    score, skip = max(0, lo - compact_store.chunk_seconds), 0
+    while True:
+        rows = await redis_client.zrangebyscore(chunks_key, score, hi, start=skip, num=4, withscores=True)
+        for member, _score in rows or []:
+            for ts_ms, price in sorted(_decode_member(member)):
+                if lo_ms <= ts_ms <= hi_ms:
+                    batch.append((ts_ms / 1000, price, None))
+            if len(batch) >= chunk_size:
+                yield batch
+                batch = []
+        if not rows or len(rows) < 4:
+            break
+        last = rows[-1][1]
+        same = sum(1 for _member, s in rows if s == last)
+        skip = skip + same if last == score else same
+        score = last
+
+    # 尚未封存的點 (最多一個時間視窗)
+    open_rows = await redis_client.lrange(compact_open_key(symbol), 0, -1)
+    for ts_ms, price in sorted(_parse_open_point(r) for r in open_rows or []):
+        if lo_ms <= ts_ms <= hi_ms:
+            batch.append((ts_ms / 1000, price, None))
+        if len(batch) >= chunk_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def iter_history(symbol: str, start: Optional[float], end: Optional[float], chunk_size: int):
+    """
+    依時間遞增逐批產生單一 symbol 的歷史 (List[ExportRow])，供串流匯出使用。
+    每批最多 chunk_size 筆，記憶體用量與區間大小無關；
+    啟用 ARCHIVE_ENABLED 時先輸出早於 Redis 保留範圍的磁碟封存部分。
+    """
+    hi = end if end is not None else time.time()
+    lo = start
+    if settings.ARCHIVE_ENABLED:
+        if lo is None:
+            lo = hi - max(1, int(settings.ARCHIVE_RETENTION_DAYS)) * 86400
+        boundary = await _redis_oldest(symbol)
+        archive_end = min(hi, boundary) if boundary is not None else hi
+        async for records in tick_archive.iter_read(symbol, lo, archive_end, chunk_size):
+            yield [(ts, price, None) for ts, price in records]
+        lo = max(lo, archive_end)
+
+    if use_compact_store():
+        async for batch in _iter_compact(symbol, lo if lo is not None else 0, hi, chunk_size):
+            yield batch
+    else:
+        async for batch in _iter_json(symbol, lo if lo is not None else "-inf", hi, chunk_size):
+            yield batch
+
+
+class HistoryTrimmer:
+    def __init__(self, every_n: Optional[int] = None, interval: Optional[float] = None):
+        self.every_n = max(1, int(every_n or settings.HISTORY_TRIM_EVERY_N))
+        self.interval = max(1.0, float(interval or settings.HISTORY_TRIM_INTERVAL_SECONDS))
+        self._pending: Dict[str, int] = {}       # symbol -> 上次裁剪後的寫入筆數
+        self._last_trim: Dict[str, float] = {}   # symbol -> 上次裁剪時間
+
+    def note_insert(self, symbol: str):
+        """寫入路徑呼叫：只累加計數"""
+        self._pending[symbol] = self._pending.get(symbol, 0) + 1
+        if symbol not in self._last_trim:
+            self._last_trim[symbol] = time.time()
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        if now is None:
+            now = time.time()
+        return [
+            symbol for symbol, pending in self._pending.items()
+            if pending >= self.every_n
+            or (pending > 0 and now - self._last_trim.get(symbol, 0) >= self.interval)
+        ]
+
+    async def trim(self, symbols: List[str]) -> Dict[str, int]:
+        """以單一 pipeline 裁剪 (compact 模式為封存) 多個 symbol，回傳各自移除的筆數"""
+        if not symbols:
+            return {}
+
+        start = time.perf_counter()
+        if use_compact_store():
+            removed = await compact_store.maintain(symbols)
+        else:
+            removed = await self._trim_json(symbols)
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        now = time.time()
+        for symbol in symbols:
+            self._pending[symbol] = 0
+            self._last_trim[symbol] = now
+            await record_history_trim(symbol, removed[symbol], duration_ms / len(symbols))
+        return removed
+
+    async def _trim_json(self, symbols: List[str]) -> Dict[str, int]:
+        retention_hours = max(1, int(settings.HISTORY_RETENTION_HOURS))
+        cutoff_ts = time.time() - (retention_hours * 3600)
+        max_points = max(1000, int(settings.HISTORY_MAX_POINTS))
+
+        pipe = await redis_client.pipeline(transaction=False)
+        for symbol in symbols:
+            key = history_key(symbol)
+            pipe.zremrangebyscore(key, 0, cutoff_ts)
+            # 負索引：只保留分數最高 (最新) 的 max_points 筆
+            pipe.zremrangebyrank(key, 0, -(max_points + 1))
+        replies = await pipe.execute()
+
+        return {
+            symbol: int(replies[2 * i] or 0) + int(replies[2 * i + 1] or 0)
+            for i, symbol in enumerate(symbols)
+        }
+
+    async def trim_due(self) -> Dict[str, int]:
+        return await self.trim(self.due())
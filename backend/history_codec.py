@@ -0,0 +1,171 @@
+"""
+Gorilla 風格的時間序列壓縮 (Facebook Gorilla, VLDB 2015)。
+
+- 時間戳 (毫秒整數)：delta-of-delta 變長編碼
+- 價格 (float64)：與前一筆做 XOR，只寫入有意義的位元
+
+價格變動小或不變時每點只需數個位元，遠小於完整 JSON (~300 bytes)。
+"""
+import struct
+from typing import List, Tuple
+
+# 資料區塊版本，格式變更時遞增
+CHUNK_VERSION = 1
+
+_HEADER = struct.Struct(">BIqd")  # version, count, first_ts_ms, first_value
+
+# delta-of-delta 區間：(前綴位元, 前綴長度, 值位元數)
+_DOD_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+)
+_DOD_FALLBACK = (0b1111, 4, 64)
+
+
+class BitWriter:
+    def __init__(self):
+        self._buf = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value: int, nbits: int):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._bits += nbits
+        while self._bits >= 8:
+            self._bits -= 8
+            self._buf.append((self._acc >> self._bits) & 0xFF)
+        self._acc &= (1 << self._bits) - 1
+
+    def getvalue(self) -> bytes:
+        if self._bits:
+            return bytes(self._buf) + bytes([(self._acc << (8 - self._bits)) & 0xFF])
+        return bytes(self._buf)
+
+
+class BitReader:
+    def __init__(self, data: bytes, offset: int = 0):
+        self._data = data
+        self._pos = offset
+        self._acc = 0
+        self._bits = 0
+
+    def read(self, nbits: int) -> int:
+        while self._bits < nbits:
+            self._acc = (self._acc << 8) | self._data[self._pos]
+            self._pos += 1
+            self._bits += 8
+        self._bits -= nbits
+        value = self._acc >> self._bits
+        self._acc &= (1 << self._bits) - 1
+        return value
+
+
+def _float_bits(value: float) -> int:
+    return struct.unpack(">Q", struct.pack(">d", value))[0]
+
+
+def _bits_float(bits: int) -> float:
+    return struct.unpack(">d", struct.pack(">Q", bits))[0]
+
+
+def _to_signed(value: int, nbits: int) -> int:
+    if value >= 1 << (nbits - 1):
+        value -= 1 << nbits
+    return value
+
+
+def encode_chunk(points: List[Tuple[int, float]]) -> bytes:
+    """將 [(ts_ms, price), ...] 編碼為壓縮區塊 (保持輸入順序)"""
+    if not points:
+        return _HEADER.pack(CHUNK_VERSION, 0, 0, 0.0)
+
+    first_ts, first_value = points[0]
+    writer = BitWriter()
+    prev_ts = first_ts
+    prev_delta = 0
+    prev_bits = _float_bits(first_value)
+    prev_leading = prev_trailing = -1
+
+    for ts, value in points[1:]:
+        # 時間戳：delta-of-delta
+        delta = ts - prev_ts
+        dod = delta - prev_delta
+        if dod == 0:
+            writer.write(0, 1)
+        else:
+            for prefix, prefix_len, nbits in _DOD_BUCKETS:
+                if -(1 << (nbits - 1)) <= dod < (1 << (nbits - 1)):
+                    writer.write(prefix, prefix_len)
+                    writer.write(dod, nbits)
+                    break
+            else:
+                prefix, prefix_len, nbits = _DOD_FALLBACK
+                writer.write(prefix, prefix_len)
+                writer.write(dod, nbits)
+        prev_ts, prev_delta = ts, delta
+
+        # 價格：XOR
+        bits = _float_bits(value)
+        xor = bits ^ prev_bits
+        if xor == 0:
+            writer.write(0, 1)
+        else:
+            leading = min(31, 64 - xor.bit_length())
+            trailing = (xor & -xor).bit_length() - 1
+            if prev_leading >= 0 and leading >= prev_leading and trailing >= prev_trailing:
+                # 落在前一個有效位元視窗內，沿用視窗
+                writer.write(0b10, 2)
+                writer.write(xor >> prev_trailing, 64 - prev_leading - prev_trailing)
+            else:
+                meaningful = 64 - leading - trailing
+                writer.write(0b11, 2)
+                writer.write(leading, 5)
+                writer.write(meaningful & 0x3F, 6)  # 64 以 0 表示
+                writer.write(xor >> trailing, meaningful)
+                prev_leading, prev_trailing = leading, trailing
+        prev_bits = bits
+
+    return _HEADER.pack(CHUNK_VERSION, len(points), first_ts, first_value) + writer.getvalue()
+
+
+def decode_chunk(data: bytes) -> List[Tuple[int, float]]:
+    """還原 encode_chunk 的輸出為 [(ts_ms, price), ...]"""
+    version, count, first_ts, first_value = _HEADER.unpack_from(data, 0)
+    if version != CHUNK_VERSION:
+        raise ValueError(f"Unsupported history chunk version: {version}")
+    if count == 0:
+        return []
+
+    reader = BitReader(data, _HEADER.size)
+    points = [(first_ts, first_value)]
+    prev_ts = first_ts
+    prev_delta = 0
+    prev_bits = _float_bits(first_value)
+    prev_leading = prev_trailing = 0
+
+    for _ in range(count - 1):
+        if reader.read(1) == 0:
+            dod = 0
+        elif reader.read(1) == 0:
+            dod = _to_signed(reader.read(7), 7)
+        elif reader.read(1) == 0:
+            dod = _to_signed(reader.read(9), 9)
+        elif reader.read(1) == 0:
+            dod = _to_signed(reader.read(12), 12)
+        else:
+            dod = _to_signed(reader.read(64), 64)
+        prev_delta += dod
+        prev_ts += prev_delta
+
+        if reader.read(1) == 1:
+            if reader.read(1) == 1:
+                prev_leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                prev_trailing = 64 - prev_leading - meaningful
+            else:
+                meaningful = 64 - prev_leading - prev_trailing
+            prev_bits ^= reader.read(meaningful) << prev_trailing
+        points.append((prev_ts, _bits_float(prev_bits)))
+
+    return points
@@ -0,0 +1,212 @@
+"""
+進程內近期歷史的環形緩衝 (ring buffer)，位於 Redis 之前。
+
+每個 symbol 固定容量，時間戳與價格存於 array('d') (不保存 dict)；
+json 模式另保存每點預先編碼的 JSON bytes，/history 直接串接成回應 (render)，不需逐筆 json.loads。
+query() 回傳與 Redis 讀取相同的列 (json 模式為解析後的完整列)；
+compact=True 時只組成 symbol / price / timestamp 的精簡列，供只需價格的欄式版面使用。
+點依 (時間戳, 原始 JSON) 排序並去除重複，與 ZSET 一致；亂序到達的點插入對應位置。
+- Aggregator 所在進程：由 Aggregator 直接追加
+- 分片模式的 API 進程：由 market_feed 訂閱 market:points:* 追加
+近期區間查詢直接由記憶體回答，只有超出緩衝範圍的冷資料才讀 Redis。
+"""
+import bisect
+import json
+import logging
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from backend.config import get_settings
+from backend.feed import POINTS_CHANNEL_PREFIX
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class HistoryRing:
+    """單一 symbol 的固定容量環形緩衝，時間戳遞增"""
+
+    def __init__(self, capacity: int, keep_raw: bool):
+        self.capacity = max(1, int(capacity))
+        self._ts = array("d", bytes(8 * self.capacity))
+        self._price = array("d", bytes(8 * self.capacity))
+        self._raw: Optional[List[Optional[bytes]]] = [None] * self.capacity if keep_raw else None
+        self._head = 0   # 最舊一筆的實體位置
+        self.size = 0
+
+    def _physical(self, index: int) -> int:
+        return (self._head + index) % self.capacity
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index: int) -> float:
+        """邏輯索引 (0 = 最舊) 的時間戳，供 bisect 使用"""
+        return self._ts[self._physical(index)]
+
+    @property
+    def oldest(self) -> Optional[float]:
+        return self[0] if self.size else None
+
+    @property
+    def newest(self) -> Optional[float]:
+        return self[self.size - 1] if self.size else None
+
+    def append(self, ts: float, price: float, raw: Optional[str] = None) -> bool:
+        encoded = raw.encode() if self._raw is not None and raw is not None else None
+        index = self.size if not self.size or ts >= self.newest else bisect.bisect_right(self, ts)
+        if self._raw is not None:
+            # 相同時間戳依原始 JSON 排序 (ZSET 的成員順序)，相同內容只保留一筆
+            j = index
+            while j > 0 and self[j - 1] == ts:
+                existing = self._raw[self._physical(j - 1)]
+                if existing == encoded:
+                    return False
+                if encoded is not None and existing is not None and existing > encoded:
+                    index = j - 1
+                j -= 1
+        if self.size == self.capacity:
+            if index == 0:
+                return False  # 緩衝已滿且早於所有點：不在任何可由緩衝回答的結果內
+            self._head = (self._head + 1) % self.capacity
+            self.size -= 1
+            index -= 1
+        # 亂序到達時將較新的點後移一格 (少見，O(n))
+        for i in range(self.size, index, -1):
+            dst, src = self._physical(i), self._physical(i - 1)
+            self._ts[dst] = self._ts[src]
+            self._price[dst] = self._price[src]
+            if self._raw is not None:
+                self._raw[dst] = self._raw[src]
+        pos = self._physical(index)
+        self.size += 1
+        self._ts[pos] = ts
+        self._price[pos] = price
+        if self._raw is not None:
+            self._raw[pos] = encoded
+        return True
+
+    def items(self):
+        """依時間遞增產生 (timestamp, price, raw)"""
+        for i in range(self.size):
+            pos = self._physical(i)
+            raw = self._raw[pos] if self._raw is not None else None
+            yield self._ts[pos], self._price[pos], raw.decode() if raw is not None else None
+
+    def span(self, start: Optional[float], end: Optional[float], limit: int) -> Optional[Tuple[int, int]]:
+        """
+        [start, end] 內最後 limit 筆的邏輯索引範圍 [lo, hi)；緩衝無法確定涵蓋完整結果時回傳 None。
+        涵蓋條件：區間內已有 limit 筆，或 start 晚於緩衝中最舊的時間戳。
+        """
+        if not self.size:
+            return None
+        hi = self.size if end is None else bisect.bisect_right(self, end)
+        lo = 0 if start is None else bisect.bisect_left(self, start)
+        if hi - lo < limit and (start is None or start <= self.oldest):
+            return None
+        return max(lo, hi - limit), hi
+
+    def timestamps(self, lo: int, hi: int) -> List[float]:
+        return [self[i] for i in range(lo, hi)]
+
+    def query(
+        self, symbol: str, start: Optional[float], end: Optional[float], limit: int, compact: bool = False
+    ) -> Optional[List[Dict]]:
+        """span 範圍內的列：json 模式解析保存的原始列，compact=True 或未保存原始列時由 ts/price 組成"""
+        bounds = self.span(start, end, limit)
+        if bounds is None:
+            return None
+        points = []
+        for i in range(*bounds):
+            pos = self._physical(i)
+            raw = self._raw[pos] if self._raw is not None and not compact else None
+            if raw is not None:
+                points.append(json.loads(raw))
+            else:
+                points.append({"symbol": symbol, "price": self._price[pos], "timestamp": self._ts[pos]})
+        return points
+
+    def render(self, symbol: str, lo: int, hi: int) -> bytes:
+        """span 範圍內的列編碼為 JSON 陣列：json 模式直接串接預先編碼的 bytes"""
+        rows = []
+        for i in range(lo, hi):
+            pos = self._physical(i)
+            if self._raw is not None:
+                rows.append(self._raw[pos])
+            else:
+                rows.append(json.dumps({"symbol": symbol, "price": self._price[pos], "timestamp": self._ts[pos]}).encode())
+        return b"[" + b", ".join(rows) + b"]"
+
+
+class RecentHistory:
+    """各 symbol 的 HistoryRing 集合"""
+
+    def __init__(self, capacity: Optional[int] = None):
+        self.capacity = int(capacity if capacity is not None else settings.HISTORY_RING_SIZE)
+        self._rings: Dict[str, HistoryRing] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _ring(self, symbol: str) -> HistoryRing:
+        ring = self._rings.get(symbol)
+        if ring is None:
+            # compact 模式的 Redis 讀取只回傳 symbol/price/timestamp，不需保存原始 JSON
+            ring = HistoryRing(self.capacity, keep_raw=settings.HISTORY_STORE != "compact")
+            self._rings[symbol] = ring
+        return ring
+
+    def append(self, symbol: str, ts: float, price: float, raw: Optional[str] = None):
+        if self.enabled:
+            self._ring(symbol).append(ts, price, raw)
+
+    def query(
+        self, symbol: str, start: Optional[float], end: Optional[float], limit: int, compact: bool = False
+    ) -> Optional[List[Dict]]:
+        if not self.enabled:
+            return None
+        ring = self._rings.get(symbol)
+        return ring.query(symbol, start, end, limit, compact) if ring else None
+
+    def query_encoded(
+        self, symbol: str, start: Optional[float], end: Optional[float], limit: int
+    ) -> Optional[Tuple[bytes, List[float]]]:
+        """與 query 相同的範圍，回傳 (JSON 陣列 bytes, 各列時間戳)；未涵蓋時回傳 None"""
+        if not self.enabled:
+            return None
+        ring = self._rings.get(symbol)
+        bounds = ring.span(start, end, limit) if ring else None
+        if bounds is None:
+            return None
+        return ring.render(symbol, *bounds), ring.timestamps(*bounds)
+
+    def handle_point(self, channel: str, data: str):
+        """market:points:{symbol} 訊息處理 (分片模式的 API 進程)"""
+        symbol = channel[len(POINTS_CHANNEL_PREFIX):]
+        point = json.loads(data)
+        self.append(symbol, point["timestamp"], point["price"], data)
+
+    async def warm(self, symbols: List[str]):
+        """
+        啟動時由 Redis 載入各 symbol 最近 capacity 筆。
+        需在訂閱之後呼叫：載入期間已收到的點會接在載入結果之後重放，不會遺漏或重複。
+        """
+        if not self.enabled:
+            return
+        from backend.history import read_history_page
+
+        data, _ = await read_history_page(symbols, None, None, self.capacity, cached=False)
+        for symbol, points in data.items():
+            ring = HistoryRing(self.capacity, keep_raw=settings.HISTORY_STORE != "compact")
+            for point in points:
+                ring.append(point["timestamp"], point["price"], json.dumps(point))
+            live = self._rings.get(symbol)
+            if live is not None:
+                for ts, price, raw in live.items():
+                    ring.append(ts, price, raw)
+            self._rings[symbol] = ring
+        logger.info(f"History ring warmed: {sum(len(p) for p in data.values())} points")
+
+
+recent_history = RecentHistory()
@@ -0,0 +1,38 @@
+"""
+HTTP 快取語意：ETag / If-None-Match / Cache-Control。
+
+ETag 由各 symbol 的資料版本 (最新值內容摘要) 與查詢參數推導，
+比對只需進程內的最新價格表，304 回應不讀 Redis。
+搭配短 max-age，讓 nginx 微快取 (docker/nginx/default.conf) 在邊緣吸收輪詢流量。
+"""
+import hashlib
+from typing import Dict, Iterable
+
+from fastapi import Request
+
+
+def make_etag(parts: Iterable[str]) -> str:
+    """由字串序列計算強 ETag"""
+    digest = hashlib.blake2b("\x1f".join(parts).encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """If-None-Match 是否與目前 ETag 相符 (支援多值、弱比較與 *)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def cache_headers(etag: str, max_age: int) -> Dict[str, str]:
+    # 回應需 API Key：共享快取 (nginx) 須依認證標頭區分；Accept 決定 JSON / msgpack
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max(0, int(max_age))}",
+        "Vary": "X-API-Key, Authorization, Accept",
+    }
@@ -0,0 +1,268 @@
+"""
+分片多進程採集 (Sharded ingestion)
+
+將數據源依成本分配到 N 個 worker 進程輪詢，每筆報價 (tick) 寫入 Redis Stream；
+另由單一 aggregator 進程消費 Stream 並執行 Aggregator.aggregate。
+搭配 INGEST_MODE=sharded 時 API 進程只服務客戶端，不再被爬蟲/HTML 解析阻塞。
+
+用法：
+    python -m backend.ingest                                  # aggregator + INGEST_WORKERS 個 worker
+    python -m backend.ingest --role worker --index 0 --shards 2
+    python -m backend.ingest --role aggregator
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+from typing import List
+
+from backend.config import get_settings
+from backend.redis_client import redis_client
+from backend.http_client import close_session
+from backend.metrics import get_metrics_snapshot
+from backend.aggregator import Aggregator, SYMBOLS
+from backend.scheduler import Scheduler
+from backend.sources.base import BaseSource
+from backend.sources.binance import BinanceSource
+from backend.sources.goldprice import GoldPriceOrgSource
+from backend.sources.sina import SinaFinanceSource
+from backend.sources.bullionvault import BullionVaultSource
+from backend.sources.yahoo import YahooFinanceSource
+from backend.sources.kitco import KitcoSource
+from backend.sources.investing import InvestingSource
+from backend.sources.oanda import OandaSource
+from backend.sources.taiwanbank import TaiwanBankSource
+from backend.sources.exchangerate_host import ExchangerateHostSource
+from backend.sources.open_er_api import OpenErApiSource
+from backend.sources.fawazahmed import FawazahmedSource
+from backend.sources.floatrates import FloatRatesSource
+from backend.sources.gold_api import GoldApiSource
+from backend.sources.apmex import ApmexSource
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# 分片時各來源的相對成本 (未列出者為 1)，Playwright 與 HTML 解析較重
+SOURCE_COST = {
+    "Investing.com": 10,
+    "Kitco": 2,
+    "APMEX": 2,
+    "GoldPrice.org": 2,
+}
+
+# 各 ingest 進程定期回報 metrics 快照，供 API 進程的 /api/v1/metrics 合併顯示
+METRICS_KEY_PREFIX = "metrics:process:"
+METRICS_REPORT_INTERVAL = 5
+
+
+def build_sources() -> List[BaseSource]:
+    """建立全部 15 個數據源 (API inline 模式與 ingest 進程共用)"""
+    return [
+        BinanceSource(),           # 1. Binance PAXG (高頻，黃金)
+        GoldPriceOrgSource(),      # 2. GoldPrice.org (黃金、白銀)
+        SinaFinanceSource(),       # 3. 新浪財經 (全部)
+        GoldApiSource(),           # 4. Gold-API
+        ApmexSource(),             # 5. APMEX
+        BullionVaultSource(),      # 6. BullionVault (黃金)
+        YahooFinanceSource(),      # 7. Yahoo Finance (全部)
+        KitcoSource(),             # 8. Kitco (黃金、白銀)
+        InvestingSource(),         # 9. Investing.com (全部，Playwright)
+        OandaSource(),             # 10. OANDA (外匯)
+        TaiwanBankSource(),        # 11. 台灣銀行 (USD-TWD 官方備援)
+        ExchangerateHostSource(),  # 12. exchangerate.host (USD-TWD)
+        OpenErApiSource(),         # 13. open.er-api.com (USD-TWD)
+        FawazahmedSource(),        # 14. Fawaz API (USD-TWD CDN)
+        FloatRatesSource(),        # 15. FloatRates (USD-TWD)
+    ]
+
+
+async def cleanup_sources(sources: List[BaseSource]):
+    """釋放來源持有的外部資源 (例如 Investing.com 的瀏覽器)"""
+    for source in sources:
+        cleanup = getattr(source, "cleanup", None)
+        if cleanup is None:
+            continue
+        try:
+            await cleanup()
+        except Exception as e:
+            logger.error(f"Error cleaning up {source.source_name}: {e}")
+
+
+def shard_sources(sources: List[BaseSource], shards: int, index: int) -> List[BaseSource]:
+    """
+    依 SOURCE_COST 以貪婪法 (LPT) 將來源分配到各分片。
+    分配結果只取決於來源列表，各進程可獨立算出一致的分片。
+    """
+    shards = max(1, shards)
+    loads = [0] * shards
+    assignment: List[List[int]] = [[] for _ in range(shards)]
+    ordered = sorted(
+        range(len(sources)),
+        key=lambda i: (-SOURCE_COST.get(sources[i].source_name, 1), i),
+    )
+    for i in ordered:
+        target = loads.index(min(loads))
+        loads[target] += SOURCE_COST.get(sources[i].source_name, 1)
+        assignment[target].append(i)
+    return [sources[i] for i in sorted(assignment[index % shards])]
+
+
+class ShardScheduler(Scheduler):
+    """Ingest worker 用的調度器：輪詢結果寫入 Redis Stream 而非本地記憶體"""
+
+    async def _store_result(self, symbol: str, source_name: str, result):
+        # worker 內不執行 aggregate，由此處記錄熔斷器成功
+        self.aggregator.circuit_breaker.record_success(source_name)
+        await redis_client.xadd(
+            settings.INGEST_STREAM_KEY,
+            {"symbol": symbol, "source": source_name, "data": json.dumps(result)},
+            maxlen=settings.INGEST_STREAM_MAXLEN,
+        )
+
+
+async def consume_ticks(scheduler: Scheduler):
+    """消費 Redis Stream，將 tick 填入 scheduler.latest_results 供聚合迴圈使用"""
+    # 從 Stream 保留的 backlog 暖啟動；過期的 tick 會被 Aggregator 的 max_age 過濾
+    last_id = "0-0"
+    while scheduler.running:
+        try:
+            response = await redis_client.xread(
+                {settings.INGEST_STREAM_KEY: last_id}, count=500, block=1000
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error reading tick stream: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        for _stream, entries in response or []:
+            for entry_id, fields in entries:
+                last_id = entry_id
+                try:
+                    result = json.loads(fields["data"])
+                    await scheduler._store_result(fields["symbol"], fields["source"], result)
+                except (KeyError, ValueError) as e:
+                    logger.warning(f"Malformed tick {entry_id}: {e}")
+
+
+async def report_metrics(name: str):
+    """定期將本進程的 metrics 快照寫入 Redis"""
+    while True:
+        try:
+            snapshot = await get_metrics_snapshot()
+            await redis_client.set(
+                f"{METRICS_KEY_PREFIX}{name}",
+                json.dumps(snapshot),
+                ex=METRICS_REPORT_INTERVAL * 3,
+            )
+        except Exception as e:
+            logger.error(f"Error reporting metrics for {name}: {e}")
+        await asyncio.sleep(METRICS_REPORT_INTERVAL)
+
+
+def process_names(shards: int) -> List[str]:
+    return ["aggregator"] + [f"worker-{i}" for i in range(max(1, shards))]
+
+
+async def _connect_shared_redis() -> bool:
+    await redis_client.connect()
+    if redis_client.use_fake:
+        # FakeRedis 為進程內記憶體，無法跨進程共享 Stream
+        logger.error("Sharded ingestion requires a real Redis server")
+        return False
+    return True
+
+
+async def run_worker(index: int, shards: int, symbols: List[str] = SYMBOLS):
+    if not await _connect_shared_redis():
+        return
+    sources = shard_sources(build_sources(), shards, index)
+    scheduler = ShardScheduler(sources, Aggregator(sources))
+    logger.info(f"Ingest worker {index}/{shards} polling: {[s.source_name for s in sources]}")
+    try:
+        await scheduler.run(
+            symbols,
+            aggregate=False,
+            extra_tasks=[report_metrics(f"worker-{index}")],
+        )
+    finally:
+        await scheduler.stop()
+        await cleanup_sources(sources)
+        await redis_client.close()
+        await close_session()
+
+
+async def run_aggregator(symbols: List[str] = SYMBOLS):
+    if not await _connect_shared_redis():
+        return
+    # 只用於權重表，aggregator 進程不輪詢任何來源
+    sources = build_sources()
+    scheduler = Scheduler(sources, Aggregator(sources))
+    logger.info("Ingest aggregator consuming tick stream")
+    try:
+        await scheduler.run(
+            symbols,
+            poll=False,
+            extra_tasks=[consume_ticks(scheduler), report_metrics("aggregator")],
+        )
+    finally:
+        await scheduler.stop()
+        await cleanup_sources(sources)
+        await redis_client.close()
+
+
+def _run_process(role: str, index: int, shards: int):
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, task.cancel)
+        if role == "worker":
+            await run_worker(index, shards)
+        else:
+            await run_aggregator()
+
+    try:
+        asyncio.run(_main())
+    except asyncio.CancelledError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Goldlab.cloud sharded ingestion")
+    parser.add_argument("--role", choices=["all", "worker", "aggregator"], default="all")
+    parser.add_argument("--shards", type=int, default=settings.INGEST_WORKERS, help="Number of worker processes")
+    parser.add_argument("--index", type=int, default=0, help="Shard index (role=worker)")
+    args = parser.parse_args()
+
+    if args.role != "all":
+        _run_process(args.role, args.index, args.shards)
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=_run_process, args=("aggregator", 0, args.shards), name="ingest-aggregator")]
+    processes += [
+        ctx.Process(target=_run_process, args=("worker", i, args.shards), name=f"ingest-worker-{i}")
+        for i in range(max(1, args.shards))
+    ]
+    for proc in processes:
+        proc.start()
+
+    def _terminate(signum, frame):
+        for proc in processes:
+            if proc.is_alive():
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, _terminate)
+    signal.signal(signal.SIGINT, _terminate)
+    for proc in processes:
+        proc.join()
+
+
+if __name__ == "__main__":
+    main()
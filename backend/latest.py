@@ -0,0 +1,117 @@
+"""
+進程內的最新價格表：symbol -> 預先序列化的 JSON bytes。
+
+啟動時以單一 MGET 載入，之後由 Aggregator 直接更新 (inline 模式)，
+或由 market_feed 訂閱 market:points:* 更新 (分片模式的 API 進程)。
+/api/v1/latest 直接串接這些 bytes 組成回應，不需讀 Redis 也不需 json.loads / 重新序列化。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from backend.redis_client import redis_client
+from backend.feed import POINTS_CHANNEL_PREFIX
+from backend.encoding import json_to_msgpack, msgpack_envelope
+
+logger = logging.getLogger(__name__)
+
+# 定期以 MGET 校正 (訂閱中斷期間的遺漏)
+REFRESH_INTERVAL = 30
+
+# 已組好的 "data" 片段快取 (依 symbols 組合)
+RENDER_CACHE_SIZE = 256
+
+
+def latest_key(symbol: str) -> str:
+    return f"market:latest:{symbol}"
+
+
+class LatestTable:
+    def __init__(self):
+        self._data: Dict[str, bytes] = {}
+        self._ts: Dict[str, float] = {}
+        # symbol -> 資料版本 (內容摘要)：同一內容在每個進程得到相同版本，ETag 可跨 worker 共用
+        self._version: Dict[str, str] = {}
+        # (symbols, binary) -> (versions, data 片段)
+        self._rendered: "OrderedDict[Tuple, Tuple[Tuple[str, ...], bytes]]" = OrderedDict()
+
+    def update(self, symbol: str, payload: str, ts: float):
+        """以較新的資料覆寫 (舊於現值者忽略)"""
+        if ts < self._ts.get(symbol, float("-inf")):
+            return
+        data = payload.encode()
+        if data == self._data.get(symbol):
+            return
+        self._data[symbol] = data
+        self._ts[symbol] = ts
+        self._version[symbol] = hashlib.blake2b(data, digest_size=8).hexdigest()
+
+    def get(self, symbol: str) -> Optional[bytes]:
+        return self._data.get(symbol)
+
+    def symbols(self) -> List[str]:
+        return list(self._data)
+
+    def timestamp(self, symbol: str) -> Optional[float]:
+        return self._ts.get(symbol)
+
+    def version(self, symbol: str) -> str:
+        return self._version.get(symbol, "")
+
+    def handle_point(self, channel: str, data: str):
+        """market:points:{symbol} 訊息處理 (分片模式的 API 進程)"""
+        symbol = channel[len(POINTS_CHANNEL_PREFIX):]
+        self.update(symbol, data, json.loads(data)["timestamp"])
+
+    async def load(self, symbols: List[str]):
+        """以單一 MGET 載入 (或校正) 各 symbol 的最新值"""
+        values = await redis_client.mget([latest_key(s) for s in symbols])
+        for symbol, value in zip(symbols, values):
+            if value:
+                try:
+                    self.update(symbol, value, json.loads(value)["timestamp"])
+                except (ValueError, KeyError):
+                    logger.warning(f"Malformed latest value for {symbol}")
+
+    async def refresh_loop(self, symbols: List[str]):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                await self.load(symbols)
+            except Exception as e:
+                logger.error(f"Error refreshing latest table: {e}")
+
+    def render(self, symbols: Iterable[str], timestamp: float, binary: bool = False) -> bytes:
+        """
+        串接預先序列化的 bytes 組成 {"timestamp": ..., "data": {...}}；binary=True 時為 msgpack。
+        各 symbol 版本未變時重用上次組好的 data 片段，timestamp 每次以呼叫時的值組入。
+        """
+        symbols = tuple(dict.fromkeys(symbols))
+        versions = tuple(self.version(s) for s in symbols)
+        cache_key = (symbols, binary)
+        cached = self._rendered.get(cache_key)
+        if cached is not None and cached[0] == versions:
+            self._rendered.move_to_end(cache_key)
+            fragment = cached[1]
+        else:
+            parts = []
+            for symbol in symbols:
+                value = self._data.get(symbol)
+                if value is not None:
+                    parts.append(json.dumps(symbol).encode() + b": " + value)
+            fragment = b"{" + b", ".join(parts) + b"}"
+            if binary:
+                fragment = json_to_msgpack(fragment)
+            self._rendered[cache_key] = (versions, fragment)
+            self._rendered.move_to_end(cache_key)
+            while len(self._rendered) > RENDER_CACHE_SIZE:
+                self._rendered.popitem(last=False)
+        if binary:
+            return msgpack_envelope(timestamp, "data", fragment)
+        return b'{"timestamp": ' + repr(timestamp).encode() + b', "data": ' + fragment + b"}"
+
+
+latest_table = LatestTable()
@@ -1,12 +1,32 @@
-from fastapi import FastAPI, WebSocket, Depends, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request
 from typing import Optional
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from backend.config import get_settings
 from backend.redis_client import redis_client
 from backend.http_client import close_session
 from backend.metrics import get_metrics_snapshot
-from backend.auth import verify_api_key, verify_ws_api_key, verify_admin_api_key
+from backend.auth import (
+    AUTH_INVALIDATE_CHANNEL,
+    invalidate_key_cache,
+    key_cache,
+    verify_admin_api_key,
+    verify_api_key,
+    verify_stream_api_key,
+    verify_ws_api_key,
+)
+from backend.compression import CompressionMiddleware
+from backend.encoding import (
+    LAYOUTS,
+    candle_columns,
+    encode,
+    history_columns,
+    json_to_msgpack,
+    media_type,
+    wants_msgpack,
+)
+import json
 import logging
 import asyncio
 
@@ -23,57 +43,61 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 依 Accept-Encoding 協商 brotli / gzip (只壓縮大於 COMPRESSION_MIN_BYTES 的回應)
+app.add_middleware(CompressionMiddleware)
 
-# 導入所有數據源
-from backend.sources.binance import BinanceSource
-from backend.sources.goldprice import GoldPriceOrgSource
-from backend.sources.sina import SinaFinanceSource
-from backend.sources.bullionvault import BullionVaultSource
-from backend.sources.yahoo import YahooFinanceSource
-from backend.sources.kitco import KitcoSource
-from backend.sources.investing import InvestingSource
-from backend.sources.oanda import OandaSource
-from backend.sources.taiwanbank import TaiwanBankSource
-from backend.sources.exchangerate_host import ExchangerateHostSource
-from backend.sources.open_er_api import OpenErApiSource
-from backend.sources.fawazahmed import FawazahmedSource
-from backend.sources.floatrates import FloatRatesSource
-from backend.sources.gold_api import GoldApiSource
-from backend.sources.apmex import ApmexSource
-# from backend.sources.mock import MockSource
-from backend.aggregator import Aggregator
+from backend.aggregator import Aggregator, SYMBOLS
 from backend.scheduler import Scheduler
+from backend.history import read_history_page, read_recent_encoded, encode_cursor, decode_cursor
+from backend.export import EXPORT_FORMATS, export_history
+from backend.feed import POINTS_CHANNEL_PREFIX, market_feed
+from backend.history_ring import recent_history
+from backend.latest import latest_table
+from backend.ws_hub import FORMATS as WS_FORMATS, STREAM_CHANNEL_PREFIX, parse_max_rate, parse_symbols, ws_hub
+from backend.http_cache import cache_headers, make_etag, not_modified
+from backend.downsample import MIN_POINTS, downsample_cache, lttb
+from backend.candles import TIMEFRAMES, read_candles
+from backend.ingest import build_sources, cleanup_sources, process_names, METRICS_KEY_PREFIX
 
 scheduler = None
 scheduler_task = None
-investing_source = None  # 需要在 shutdown 時清理
+sources = []  # 需要在 shutdown 時清理 (Investing.com 瀏覽器)
+background_tasks = []
 
 @app.on_event("startup")
 async def startup_event():
     await redis_client.connect()
-    
-    global investing_source
-    investing_source = InvestingSource()
+
+    # API key 快取：管理端變更時經 pubsub 立即失效，另定期完整重新載入
+    market_feed.on(AUTH_INVALIDATE_CHANNEL, key_cache.handle_invalidate)
+    # WebSocket 廣播：整個進程只有一個 market:stream:* 訂閱
+    market_feed.on(f"{STREAM_CHANNEL_PREFIX}*", ws_hub.dispatch)
+    background_tasks.append(asyncio.create_task(key_cache.refresh_loop()))
+
+    if settings.INGEST_MODE == "sharded":
+        # 採集與聚合由 backend.ingest 的獨立進程負責，API 進程只服務客戶端；
+        # 最新價格表與近期歷史緩衝改由訂閱 market:points:* 填入 (先訂閱再載入，避免遺漏)
+        market_feed.on(f"{POINTS_CHANNEL_PREFIX}*", latest_table.handle_point)
+        if recent_history.enabled:
+            market_feed.on(f"{POINTS_CHANNEL_PREFIX}*", recent_history.handle_point)
+        await market_feed.start()
+        await key_cache.refresh()
+        await latest_table.load(SYMBOLS)
+        await recent_history.warm(SYMBOLS)
+        background_tasks.append(asyncio.create_task(latest_table.refresh_loop(SYMBOLS)))
+        logger.info("Application started in sharded ingest mode (API only)")
+        return
+
+    await market_feed.start()
+    await key_cache.refresh()
+
+    # 排程啟動前載入最新價格表與近期歷史緩衝，之後由 Aggregator 直接更新
+    await latest_table.load(SYMBOLS)
+    await recent_history.warm(SYMBOLS)
     
     # 初始化所有 15 個數據源 (超規格配置)
-    sources = [
-        BinanceSource(),           # 1. Binance PAXG (高頻，黃金)
-        GoldPriceOrgSource(),      # 2. GoldPrice.org (黃金、白銀)
-        SinaFinanceSource(),       # 3. 新浪財經 (全部)
-        GoldApiSource(),           # 4. Gold-API (新增)
-        ApmexSource(),             # 5. APMEX (新增)
-        BullionVaultSource(),      # 6. BullionVault (黃金)
-        YahooFinanceSource(),      # 7. Yahoo Finance (全部)
-        KitcoSource(),             # 8. Kitco (黃金、白銀)
-        investing_source,          # 7. Investing.com (全部，Playwright)
-        OandaSource(),             # 8. OANDA (外匯)
-        TaiwanBankSource(),        # 9. 台灣銀行 (USD-TWD 官方備援)
-        ExchangerateHostSource(),  # 10. exchangerate.host (USD-TWD)
-        OpenErApiSource(),         # 11. open.er-api.com (USD-TWD)
-        FawazahmedSource(),        # 12. Fawaz API (USD-TWD CDN)
-        FloatRatesSource(),        # 13. FloatRates (USD-TWD)
-        # MockSource(name="Mock"),   # 14. Mock (已移除，確保全真實數據)
-    ]
+    global sources
+    sources = build_sources()
     
     aggregator = Aggregator(sources)
     
@@ -81,15 +105,16 @@ async def startup_event():
     scheduler = Scheduler(sources, aggregator)
     
     # 在後台運行 scheduler
-    scheduler_task = asyncio.create_task(scheduler.run(symbols=[
-        "XAU-USD", "XAG-USD", "USD-TWD", "PAXG-USD", "GC-F", "SI-F", "XAG-USDT", "XAU-USDT",
-        "DXY", "US10Y", "HG-F", "CL-F", "VIX", "GDX", "SIL"
-    ]))
+    scheduler_task = asyncio.create_task(scheduler.run(symbols=SYMBOLS))
     
     logger.info(f"Application started with {len(sources)} data sources")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    for task in background_tasks:
+        task.cancel()
+    await ws_hub.close()
+    await market_feed.stop()
     if scheduler:
         await scheduler.stop()
     if scheduler_task:
@@ -98,9 +123,8 @@ async def shutdown_event():
             await scheduler_task
         except asyncio.CancelledError:
             pass
-    # 清理 Investing.com 瀏覽器
-    if investing_source:
-        await investing_source.cleanup()
+    # 清理 Investing.com 瀏覽器等資源
+    await cleanup_sources(sources)
     await redis_client.close()
     await close_session()
     logger.info("Application shutdown")
@@ -110,55 +134,179 @@ async def root():
     return {"status": "ok", "app": settings.APP_NAME, "sources": 15}
 
 @app.get("/api/v1/latest")
-async def get_latest(symbols: str = "xau-usd,xag-usd,usd-twd,paxg-usd,gc-f,si-f,xag-usdt", api_key: str = Depends(verify_api_key)):
-    """獲取最新匯率數據"""
-    import json
-    result = {}
-    for symbol in symbols.upper().split(","):
-        symbol = symbol.strip()
-        data = await redis_client.get(f"market:latest:{symbol}")
-        if data:
-            result[symbol] = json.loads(data)
-    return {"timestamp": __import__('time').time(), "data": result}
+async def get_latest(request: Request, symbols: str = "xau-usd,xag-usd,usd-twd,paxg-usd,gc-f,si-f,xag-usdt", api_key: str = Depends(verify_api_key)):
+    """獲取最新匯率數據 (由進程內最新價格表串接預先序列化的 JSON，不讀 Redis)"""
+    symbol_list = list(dict.fromkeys(s.strip() for s in symbols.upper().split(",")))
+    binary = wants_msgpack(request)
+    etag = make_etag(["latest", media_type(request)] + [f"{s}={latest_table.version(s)}" for s in symbol_list])
+    headers = cache_headers(etag, settings.HTTP_CACHE_LATEST_SECONDS)
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    body = latest_table.render(symbol_list, __import__('time').time(), binary=binary)
+    return Response(content=body, media_type=media_type(request), headers=headers)
+
+
+def _history_version(symbol: str, end: Optional[float]) -> str:
+    """
+    symbol 在查詢區間內的資料版本。
+    end 早於該 symbol 最新一點時區間已不再增長，版本固定，過去區間的 ETag 保持穩定。
+    """
+    newest = latest_table.timestamp(symbol)
+    if end is not None and newest is not None and end < newest:
+        return "closed"
+    return latest_table.version(symbol)
+
+
+def _history_etag(request, symbol_list, start, end, limit, max_points, cursor, layout) -> str:
+    """歷史查詢的 ETag：查詢參數 + 各 symbol 的資料版本"""
+    parts = ["history", media_type(request), layout, repr(start), repr(end), str(limit), str(max_points), cursor or ""]
+    for symbol in symbol_list:
+        parts.append(f"{symbol}={_history_version(symbol, end)}")
+    return make_etag(parts)
 
 
 @app.get("/api/v1/history")
 async def get_history(
+    request: Request,
     symbols: str = "xau-usd,xag-usd,usd-twd",
     start: Optional[float] = None,
     end: Optional[float] = None,
-    limit: int = 300,
+    limit: Optional[int] = None,
+    max_points: Optional[int] = None,
+    cursor: Optional[str] = None,
+    layout: str = "rows",
     api_key: str = Depends(verify_api_key),
 ):
-    """獲取歷史資料（Redis sorted set）"""
-    import json
-    limit = max(1, min(5000, int(limit)))
+    """
+    獲取歷史資料（Redis sorted set 或壓縮歷史）
+    max_points: 以 LTTB 降採樣至最多 N 點 (此時 limit 上限放寬為 HISTORY_DOWNSAMPLE_SOURCE_LIMIT)
+    cursor: 上一頁回傳的 cursor，往更舊的資料分頁 (不適用於 max_points)
+    layout: rows (逐點物件) / columns ({"timestamp": [...], "price": [...]})
+    """
+    if layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"layout must be one of {', '.join(LAYOUTS)}")
+    if max_points is None:
+        limit = max(1, min(5000, int(limit or 300)))
+    else:
+        source_limit = max(1, int(settings.HISTORY_DOWNSAMPLE_SOURCE_LIMIT))
+        limit = max(1, min(source_limit, int(limit or source_limit)))
+        max_points = max(MIN_POINTS, min(5000, int(max_points)))
     now_ts = __import__('time').time()
-    result = {}
+    symbol_list = [s.strip() for s in symbols.upper().split(",")]
+    etag = _history_etag(request, symbol_list, start, end, limit, max_points, cursor, layout)
+    shape = history_columns if layout == "columns" else (lambda points: points)
+    headers = cache_headers(etag, settings.HTTP_CACHE_HISTORY_SECONDS)
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    if max_points is not None:
+        # 快取鍵含資料版本 (與 ETag 相同)：新點到達後不會以新的 ETag 回傳舊的降採樣結果
+        keys = {s: (s, start, end, limit, max_points, _history_version(s, end)) for s in symbol_list}
+        result = {}
+        missing = []
+        for symbol in symbol_list:
+            points = downsample_cache.get(keys[symbol])
+            if points is None:
+                missing.append(symbol)
+            else:
+                result[symbol] = points
+        if missing:
+            data, _ = await read_history_page(missing, start, end, limit)
+            for symbol in missing:
+                result[symbol] = lttb(data[symbol], max_points)
+                downsample_cache.put(keys[symbol], result[symbol])
+        return encode(
+            request,
+            {"timestamp": now_ts, "data": {s: shape(result[s]) for s in symbol_list}, "cursor": None},
+            headers,
+        )
+
+    positions = None
+    if cursor:
+        try:
+            positions = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    if positions is None and layout == "rows":
+        # 近期緩衝涵蓋時直接串接預先編碼的列 (與 /latest 相同做法)
+        recent = read_recent_encoded(symbol_list, start, end, limit)
+        if recent is not None:
+            encoded, next_positions = recent
+            parts = b", ".join(json.dumps(symbol).encode() + b": " + rows for symbol, rows in encoded.items())
+            body = (
+                b'{"timestamp": ' + repr(now_ts).encode() + b', "data": {' + parts
+                + b'}, "cursor": ' + json.dumps(encode_cursor(next_positions)).encode() + b"}"
+            )
+            if wants_msgpack(request):
+                body = json_to_msgpack(body)
+            return Response(body, media_type=media_type(request), headers=headers)
+    data, next_positions = await read_history_page(
+        symbol_list, start, end, limit, positions, compact=layout == "columns"
+    )
+    return encode(
+        request,
+        {"timestamp": now_ts, "data": {s: shape(p) for s, p in data.items()}, "cursor": encode_cursor(next_positions)},
+        headers,
+    )
 
-    for symbol in symbols.upper().split(","):
-        symbol = symbol.strip()
-        history_key = f"market:history:{symbol}"
 
-        if start is not None or end is not None:
-            min_score = start if start is not None else 0
-            max_score = end if end is not None else now_ts
-            rows = await redis_client.zrangebyscore(history_key, min_score, max_score)
-            if rows:
-                rows = rows[-limit:]
-        else:
-            rows = await redis_client.zrevrange(history_key, 0, limit - 1)
-            if rows:
-                rows = list(reversed(rows))
+@app.get("/api/v1/history/export")
+async def export_history_endpoint(
+    symbols: str = "xau-usd",
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    format: str = "ndjson",
+    gzip: bool = False,
+    api_key: str = Depends(verify_api_key),
+):
+    """串流匯出完整歷史 (format: ndjson / csv，gzip=true 時即時壓縮)"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    symbol_list = [s.strip() for s in symbols.upper().split(",") if s.strip()]
+    filename = f"history.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_history(symbol_list, start, end, format, gzip),
+        media_type="application/gzip" if gzip else EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-        result[symbol] = [json.loads(r) for r in rows] if rows else []
 
-    return {"timestamp": now_ts, "data": result}
+@app.get("/api/v1/candles")
+async def get_candles(
+    request: Request,
+    symbol: str = "xau-usd",
+    tf: str = "1m",
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    limit: int = 500,
+    layout: str = "rows",
+    api_key: str = Depends(verify_api_key),
+):
+    """獲取 OHLC K 線 (tf: 1m / 5m / 15m / 1h / 1d；layout=columns 時以平行陣列回傳)"""
+    if tf not in TIMEFRAMES:
+        raise HTTPException(status_code=400, detail=f"tf must be one of {', '.join(TIMEFRAMES)}")
+    if layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"layout must be one of {', '.join(LAYOUTS)}")
+    limit = max(1, min(5000, int(limit)))
+    symbol = symbol.upper().strip()
+    data = await read_candles(symbol, tf, start, end, limit)
+    if layout == "columns":
+        data = candle_columns(data)
+    return encode(request, {"timestamp": __import__('time').time(), "symbol": symbol, "tf": tf, "data": data})
 
 
 @app.get("/api/v1/metrics")
 async def get_metrics(api_key: str = Depends(verify_api_key)):
-    return await get_metrics_snapshot()
+    snapshot = await get_metrics_snapshot()
+    if settings.INGEST_MODE == "sharded":
+        # 合併各 ingest 進程回報的快照
+        processes = {}
+        for name in process_names(settings.INGEST_WORKERS):
+            raw = await redis_client.get(f"{METRICS_KEY_PREFIX}{name}")
+            processes[name] = json.loads(raw) if raw else None
+        snapshot["processes"] = processes
+    snapshot["websocket"] = ws_hub.stats()
+    return snapshot
 
 
 @app.get("/api/v1/spread-logs")
@@ -203,12 +351,14 @@ async def list_keys(admin_key: str = Depends(verify_admin_api_key)):
 @app.post("/api/v1/admin/keys/disable")
 async def disable_key(payload: AdminKeyPayload, admin_key: str = Depends(verify_admin_api_key)):
     await redis_client.sadd("auth:disabled_keys", payload.key)
+    await invalidate_key_cache()
     return {"key": payload.key, "disabled": True}
 
 
 @app.post("/api/v1/admin/keys/enable")
 async def enable_key(payload: AdminKeyPayload, admin_key: str = Depends(verify_admin_api_key)):
     await redis_client.srem("auth:disabled_keys", payload.key)
+    await invalidate_key_cache()
     return {"key": payload.key, "disabled": False}
 
 
@@ -217,10 +367,10 @@ async def add_key(payload: AdminKeyPayload, admin_key: str = Depends(verify_admi
     key = payload.key.strip()
     if not key:
         raise HTTPException(status_code=400, detail="Key required")
-    allowed = {k.strip() for k in settings.API_KEYS.split(",") if k.strip()}
-    if key in allowed:
+    if key in key_cache.env_keys:
         return {"key": key, "source": "env", "note": "Key already exists in .env"}
     await redis_client.sadd("auth:dynamic_keys", key)
+    await invalidate_key_cache()
     return {
         "key": key,
         "source": "redis",
@@ -233,11 +383,11 @@ async def remove_key(payload: AdminKeyPayload, admin_key: str = Depends(verify_a
     key = payload.key.strip()
     if not key:
         raise HTTPException(status_code=400, detail="Key required")
-    allowed = {k.strip() for k in settings.API_KEYS.split(",") if k.strip()}
-    if key in allowed:
+    if key in key_cache.env_keys:
         raise HTTPException(status_code=400, detail="Key is from .env; remove it there and restart")
     await redis_client.srem("auth:dynamic_keys", key)
     await redis_client.srem("auth:disabled_keys", key)
+    await invalidate_key_cache()
     return {
         "key": key,
         "source": "redis",
@@ -250,34 +400,77 @@ async def websocket_endpoint(websocket: WebSocket):
     if api_key is None:
         return
     await websocket.accept()
-    pubsub = redis_client.redis.pubsub()
-    await pubsub.subscribe(
-        "market:stream:XAU-USD", 
-        "market:stream:XAG-USD", 
-        "market:stream:USD-TWD", 
-        "market:stream:PAXG-USD", 
-        "market:stream:GC-F", 
-        "market:stream:SI-F",
-        "market:stream:XAG-USDT",
-        "market:stream:XAU-USDT",
-        "market:stream:DXY",
-        "market:stream:US10Y",
-        "market:stream:HG-F",
-        "market:stream:CL-F",
-        "market:stream:VIX",
-        "market:stream:GDX",
-        "market:stream:SIL"
-    )
-    
+    # 由進程共用的廣播中心推送，不再為每個客戶端建立 Redis 訂閱
+    # symbols=XAU-USD,USD-TWD 只接收指定資產 (未指定則為全部)；format=binary 使用二進位報價 frame；
+    # max_rate=0.2 限制每秒最多推送次數 (期間的報價依 symbol 合併)
+    stream_format = websocket.query_params.get("format", "json").lower()
+    if stream_format not in WS_FORMATS:
+        await websocket.close(code=1003)
+        return
     try:
+        max_rate = parse_max_rate(websocket.query_params.get("max_rate"))
+    except ValueError:
+        await websocket.close(code=1003)
+        return
+    client = ws_hub.register(
+        parse_symbols(websocket.query_params.get("symbols", "")),
+        binary=stream_format == "binary",
+        max_rate=max_rate,
+    )
+    # 連線後立即送出訂閱資產的最新價格快照
+    ws_hub.send_snapshot(client)
+
+    async def sender():
         while True:
-            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=2.0)
-            if message:
-                await websocket.send_text(message['data'])
+            frame = await client.next()
+            if isinstance(frame, bytes):
+                await websocket.send_bytes(frame)
             else:
-                await asyncio.sleep(0.05)
-    except Exception as e:
-        logger.error(f"WebSocket error: {e}")
+                await websocket.send_text(frame)
+
+    async def receiver():
+        # 控制訊息：{"action": "subscribe" | "unsubscribe", "symbols": ["XAU-USD"]}
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            ws_hub.handle_control(client, message.get("text"))
+
+    # 慢速客戶端被 hub 移除時 evicted 會被設定，以 1013 (Try Again Later) 關閉
+    tasks = [
+        asyncio.create_task(sender()),
+        asyncio.create_task(receiver()),
+        asyncio.create_task(client.evicted.wait()),
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                logger.error(f"WebSocket error: {task.exception()}")
     finally:
-        await pubsub.unsubscribe()
-        await websocket.close()
+        for task in tasks:
+            task.cancel()
+        ws_hub.unregister(client)
+        try:
+            await websocket.close(code=1013 if client.evicted.is_set() else 1000)
+        except Exception:
+            pass
+
+
+@app.get("/api/v1/stream")
+async def stream_events(
+    request: Request,
+    symbols: Optional[str] = None,
+    max_rate: Optional[float] = None,
+    api_key: str = Depends(verify_stream_api_key),
+):
+    """Server-Sent Events：與 /ws/stream 相同的即時報價，共用進程內的廣播中心"""
+    if max_rate is not None and not max_rate > 0:
+        raise HTTPException(status_code=400, detail="max_rate must be positive")
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    return StreamingResponse(
+        ws_hub.event_stream(parse_symbols(symbols or ""), last_event_id, max_rate),
+        media_type="text/event-stream",
+        # 關閉 nginx 的回應緩衝，事件即時送達
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,4 +1,8 @@
-from datetime import datetime, date
+import math
+import time
+from datetime import datetime, date, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 try:
     from zoneinfo import ZoneInfo
 except ImportError:
@@ -114,52 +118,186 @@ def get_good_friday(year: int) -> date:
     return easter - timedelta(days=2)  # Good Friday = Easter - 2 days
 
 
-def is_market_open(symbol: str = "XAU-USD") -> bool:
+def get_nyse_holidays(year: int) -> set:
     """
-    判斷市場是否開盤 (針對黃金/白銀/外匯)
-    
-    規則：
-    1. 美東時間 (ET) 週日 18:00 開盤 至 週五 17:00 收盤
-    2. 每日 17:00-18:00 ET 休市 (Daily Break / 每日維護時段)
-    3. 週六：全天休市
-    4. 美國主要假日：全天休市
-    
-    注意：使用 America/New_York 時區，自動處理夏令/冬令時間切換
-    
-    Binance 等 Crypto 數據源是 7x24，PAXG 等加密貨幣始終開市。
+    取得紐約證交所 (NYSE) 休市日：COMEX 假日 + 六月節 (Juneteenth, 2022 年起)
     """
-    # Crypto 資產永遠開市
-    crypto_keywords = ["BTC", "ETH", "PAXG", "USDT"]
-    if any(kw in symbol.upper() for kw in crypto_keywords):
-        return True
+    holidays = get_us_holidays(year)
+    if year >= 2022:
+        from datetime import timedelta
+        juneteenth = date(year, 6, 19)
+        if juneteenth.weekday() == 5:
+            juneteenth -= timedelta(days=1)
+        elif juneteenth.weekday() == 6:
+            juneteenth += timedelta(days=1)
+        holidays.add(juneteenth)
+    return holidays
 
-    now_et = datetime.now(MARKET_TIMEZONE)
-    today = now_et.date()
-    weekday = now_et.weekday()  # Monday=0, ..., Sunday=6, Saturday=5
-    hour = now_et.hour
-    
-    # 1. 檢查美國假日
-    holidays = get_us_holidays(now_et.year)
-    if today in holidays:
-        return False
-    
-    # 2. 週六 (Saturday): 全天休市
-    if weekday == 5:
-        return False
-    
-    # 3. 週五 (Friday): 17:00 ET 收盤，週末開始
-    if weekday == 4 and hour >= 17:
-        return False
-            
-    # 4. 週日 (Sunday): 18:00 ET 開盤 (17:00-18:00 也是休市)
-    if weekday == 6 and hour < 18:
-        return False
-    
-    # 5. 每日休市時段 (Daily Break): 17:00-18:00 ET
-    #    適用於週一至週四
-    if weekday in [0, 1, 2, 3] and 17 <= hour < 18:
-        return False
-            
-    # 其他時間開市
-    return True
 
+@lru_cache(maxsize=64)
+def _cached_holidays(calendar: str, year: int) -> frozenset:
+    """假日集合依 (曆法, 年份) 快取，避免每次查詢重新計算 (含復活節演算法)"""
+    if calendar == "nyse":
+        return frozenset(get_nyse_holidays(year))
+    return frozenset(get_us_holidays(year))
+
+
+class SessionTemplate:
+    """
+    交易時段模板。
+    weekly: weekday (0=Mon ... 6=Sun) -> [(開盤分鐘, 收盤分鐘)]，以美東時間當日 0:00 起算，1440 表示午夜
+    holidays: 假日曆法名稱 ("us" / "nyse")；假日當天全日休市。None 表示不休假日
+    """
+
+    def __init__(self, name: str, weekly: Dict[int, List[Tuple[int, int]]], holidays: Optional[str] = "us"):
+        self.name = name
+        self.weekly = weekly
+        self.holidays = holidays
+        self.always_open = holidays is None and all(weekly.get(d) == [(0, 1440)] for d in range(7))
+
+    def intervals(self, day: date) -> List[Tuple[int, int]]:
+        if self.holidays and day in _cached_holidays(self.holidays, day.year):
+            return []
+        return self.weekly.get(day.weekday(), [])
+
+
+_FULL_DAY = [(0, 1440)]
+
+# CME Globex (貴金屬、銅、原油、美債)：週日 18:00 開盤至週五 17:00，週一至週四 17:00-18:00 休市
+SESSION_CME = SessionTemplate("cme", {
+    0: [(0, 17 * 60), (18 * 60, 1440)],
+    1: [(0, 17 * 60), (18 * 60, 1440)],
+    2: [(0, 17 * 60), (18 * 60, 1440)],
+    3: [(0, 17 * 60), (18 * 60, 1440)],
+    4: [(0, 17 * 60)],
+    6: [(18 * 60, 1440)],
+})
+
+# 外匯：週日 17:00 開盤至週五 17:00 連續交易
+SESSION_FX = SessionTemplate("fx", {
+    0: _FULL_DAY, 1: _FULL_DAY, 2: _FULL_DAY, 3: _FULL_DAY,
+    4: [(0, 17 * 60)],
+    6: [(17 * 60, 1440)],
+})
+
+# 紐約證交所股票/ETF：週一至週五 09:30-16:00
+SESSION_NYSE = SessionTemplate("nyse", {d: [(9 * 60 + 30, 16 * 60)] for d in range(5)}, holidays="nyse")
+
+# CBOE 指數 (VIX)：週一至週五 09:30-16:15
+SESSION_CBOE = SessionTemplate("cboe", {d: [(9 * 60 + 30, 16 * 60 + 15)] for d in range(5)}, holidays="nyse")
+
+# 加密貨幣：7x24
+SESSION_CRYPTO = SessionTemplate("crypto", {d: _FULL_DAY for d in range(7)}, holidays=None)
+
+SYMBOL_SESSIONS = {
+    "XAU-USD": SESSION_CME,
+    "XAG-USD": SESSION_CME,
+    "GC-F": SESSION_CME,
+    "SI-F": SESSION_CME,
+    "HG-F": SESSION_CME,
+    "CL-F": SESSION_CME,
+    "US10Y": SESSION_CME,
+    "DXY": SESSION_CME,       # ICE 美元指數期貨，時段同 Globex
+    "USD-TWD": SESSION_FX,
+    "GDX": SESSION_NYSE,
+    "SIL": SESSION_NYSE,
+    "VIX": SESSION_CBOE,
+    "PAXG-USD": SESSION_CRYPTO,
+    "XAU-USDT": SESSION_CRYPTO,
+    "XAG-USDT": SESSION_CRYPTO,
+}
+
+
+class MarketCalendar:
+    """
+    預先計算的市場行事曆。
+    每個時段模板快取「目前狀態 + 狀態維持到何時」，到期前的查詢為 O(1)。
+    """
+
+    # 往前/往後展開的天數 (涵蓋最長的週末 + 連假)
+    LOOKBEHIND_DAYS = 1
+    LOOKAHEAD_DAYS = 10
+
+    def __init__(self, sessions: Dict[str, SessionTemplate] = SYMBOL_SESSIONS, tz=MARKET_TIMEZONE):
+        self.sessions = dict(sessions)
+        self.tz = tz
+        self._state: Dict[str, Tuple[bool, float, float]] = {}  # 模板名稱 -> (is_open, 計算時間, 有效至)
+
+    def session_for(self, symbol: str) -> SessionTemplate:
+        symbol = symbol.upper()
+        session = self.sessions.get(symbol)
+        if session is None:
+            # 未登錄的交易對：Crypto 資產 7x24，其餘沿用 CME 時段
+            crypto_keywords = ["BTC", "ETH", "PAXG", "USDT"]
+            session = SESSION_CRYPTO if any(kw in symbol for kw in crypto_keywords) else SESSION_CME
+            self.sessions[symbol] = session
+        return session
+
+    def state(self, symbol: str, now: Optional[float] = None) -> Tuple[bool, float]:
+        """回傳 (是否開盤, 狀態維持到的 epoch 秒數)"""
+        session = self.session_for(symbol)
+        if session.always_open:
+            return True, math.inf
+        if now is None:
+            now = time.time()
+        cached = self._state.get(session.name)
+        if cached and cached[1] <= now < cached[2]:
+            return cached[0], cached[2]
+        is_open, until = self._compute(session, now)
+        self._state[session.name] = (is_open, now, until)
+        return is_open, until
+
+    def is_open(self, symbol: str, now: Optional[float] = None) -> bool:
+        return self.state(symbol, now)[0]
+
+    def seconds_until_change(self, symbol: str, now: Optional[float] = None) -> float:
+        if now is None:
+            now = time.time()
+        return max(0.0, self.state(symbol, now)[1] - now)
+
+    def _to_epoch(self, day: date, minute: int) -> float:
+        if minute >= 1440:
+            day = day + timedelta(days=1)
+            minute = 0
+        local = datetime(day.year, day.month, day.day, minute // 60, minute % 60, tzinfo=self.tz)
+        return local.timestamp()
+
+    def _compute(self, session: SessionTemplate, now: float) -> Tuple[bool, float]:
+        today = datetime.fromtimestamp(now, self.tz).date()
+        spans: List[List[float]] = []
+        for offset in range(-self.LOOKBEHIND_DAYS, self.LOOKAHEAD_DAYS + 1):
+            day = today + timedelta(days=offset)
+            for start, end in session.intervals(day):
+                span = [self._to_epoch(day, start), self._to_epoch(day, end)]
+                # 合併跨午夜相連的時段 (例如週一 18:00-24:00 與週二 00:00-17:00)
+                if spans and spans[-1][1] >= span[0]:
+                    spans[-1][1] = max(spans[-1][1], span[1])
+                else:
+                    spans.append(span)
+
+        for start, end in spans:
+            if now < start:
+                return False, start
+            if now < end:
+                return True, end
+        # 展開範圍內找不到下一次開盤 (不應發生)，一小時後重新計算
+        return False, now + 3600
+
+
+market_calendar = MarketCalendar()
+
+
+def is_market_open(symbol: str = "XAU-USD") -> bool:
+    """
+    判斷市場是否開盤 (依交易對的時段模板，見 SYMBOL_SESSIONS)
+
+    - 貴金屬/能源/美債 (CME Globex)：美東時間週日 18:00 至週五 17:00，每日 17:00-18:00 休市
+    - 外匯 (USD-TWD)：週日 17:00 至週五 17:00
+    - 美股 ETF (GDX/SIL)：週一至週五 09:30-16:00；VIX：09:30-16:15
+    - Crypto (PAXG、USDT 交易對)：7x24
+    - 美國主要假日：全日休市
+
+    注意：使用 America/New_York 時區，自動處理夏令/冬令時間切換。
+    狀態與其有效期限由 market_calendar 快取，查詢為 O(1)。
+    """
+    return market_calendar.is_open(symbol)
@@ -8,10 +8,15 @@ _metrics: Dict[str, Any] = {
     "startTime": time.time(),
     "sources": {},
     "aggregates": {},
+    "history": {},
     "totals": {
         "sourceSuccess": 0,
         "sourceFailure": 0,
         "aggregateSuccess": 0,
+        "publishSent": 0,
+        "publishSuppressed": 0,
+        "historyTrims": 0,
+        "historyPointsRemoved": 0,
     },
 }
 
@@ -34,10 +39,25 @@ def _get_aggregate_bucket(symbol: str) -> Dict[str, Any]:
             "count": 0,
             "avgLatencyMs": 0.0,
             "lastSources": 0,
+            "published": 0,
+            "suppressed": 0,
         }
     return aggregates[symbol]
 
 
+def _get_history_bucket(symbol: str) -> Dict[str, Any]:
+    history = _metrics["history"]
+    if symbol not in history:
+        history[symbol] = {
+            "trims": 0,
+            "pointsRemoved": 0,
+            "lastRemoved": 0,
+            "avgTrimMs": 0.0,
+            "lastTrimMs": 0.0,
+        }
+    return history[symbol]
+
+
 async def record_source_success(source_name: str, latency_ms: float):
     async with _metrics_lock:
         bucket = _get_source_bucket(source_name)
@@ -56,11 +76,17 @@ async def record_source_failure(source_name: str):
         _metrics["totals"]["sourceFailure"] += 1
 
 
-async def record_aggregate(symbol: str, sources_count: int, avg_latency_ms: float):
+async def record_aggregate(symbol: str, sources_count: int, avg_latency_ms: float, published: bool = True):
     async with _metrics_lock:
         bucket = _get_aggregate_bucket(symbol)
         bucket["count"] += 1
         _metrics["totals"]["aggregateSuccess"] += 1
+        if published:
+            bucket["published"] += 1
+            _metrics["totals"]["publishSent"] += 1
+        else:
+            bucket["suppressed"] += 1
+            _metrics["totals"]["publishSuppressed"] += 1
 
         count = bucket["count"]
         prev_avg = bucket["avgLatencyMs"]
@@ -68,9 +94,27 @@ async def record_aggregate(symbol: str, sources_count: int, avg_latency_ms: floa
         bucket["lastSources"] = sources_count
 
 
+async def record_history_trim(symbol: str, removed: int, duration_ms: float):
+    async with _metrics_lock:
+        bucket = _get_history_bucket(symbol)
+        bucket["trims"] += 1
+        bucket["pointsRemoved"] += removed
+        bucket["lastRemoved"] = removed
+        bucket["lastTrimMs"] = round(duration_ms, 3)
+        _metrics["totals"]["historyTrims"] += 1
+        _metrics["totals"]["historyPointsRemoved"] += removed
+
+        count = bucket["trims"]
+        prev_avg = bucket["avgTrimMs"]
+        bucket["avgTrimMs"] = round(((prev_avg * (count - 1)) + duration_ms) / count, 3)
+
+
 async def get_metrics_snapshot() -> Dict[str, Any]:
     async with _metrics_lock:
+        totals = _metrics["totals"]
+        publish_total = totals["publishSent"] + totals["publishSuppressed"]
         return {
             **_metrics,
             "uptimeSeconds": round(time.time() - _metrics["startTime"], 2),
+            "publishSuppressionRatio": round(totals["publishSuppressed"] / publish_total, 4) if publish_total else 0.0,
         }
@@ -0,0 +1,160 @@
+"""
+分散式頻率限制 (GCRA, Generic Cell Rate Algorithm)。
+
+每個 bucket 在 Redis 只存一個值：理論到達時間 (TAT，毫秒)，由 Lua 腳本以 Redis 伺服器時間原子更新，
+所有 worker 與 replica 共用同一份狀態。鍵以 PEXPIRE 自動過期，不需要清理掃描。
+- 持續速率：每分鐘 limit 次 (發射間隔 T = 60000 / limit 毫秒)
+- 突發容量：另可立即消耗 burst 次 (容忍度 tau = T * burst)
+
+本地快速路徑：
+- 租約：腳本一次預扣最多 RATE_LIMIT_LEASE_SIZE 格 (不超過剩餘額度的一半，讓其他 worker 仍可取得)，
+  本地用完前不送 Redis；租約在預扣的額度回補所需時間 (格數 * T) 後失效，未用完的部分作廢，
+  因此保留的額度不會累積成超過 burst 的突發
+- 被拒絕的 bucket 記錄「可再請求的時間」，期間內直接拒絕不送 Redis
+兩者皆為固定容量的 LRU，淘汰為 O(1)。
+FakeRedis (無 Lua) 時以相同演算法在進程內計算；Lua 腳本執行失敗時也退回進程內計算 (不放行全部請求)，
+且只在狀態轉換時記錄 log，Redis 中斷期間不會每個請求都寫一筆。
+時間與間隔皆以整數毫秒計算，PX 只接受整數。
+"""
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from backend.config import get_settings
+from backend.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+KEY_PREFIX = "ratelimit:"
+
+# 本地拒絕快取 / 租約的容量上限
+DENIED_CACHE_SIZE = 10000
+
+GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local batch = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+if tat - now > tolerance then
+    return {0, tat - tolerance - now}
+end
+local available = math.floor((tolerance - (tat - now)) / interval) + 1
+local granted = math.max(1, math.min(batch, math.floor(available / 2)))
+local new_tat = tat + interval * granted
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now))
+return {granted, 0}
+"""
+
+Limit = Tuple[int, int]  # (每分鐘次數, 突發次數)
+
+
+def parse_limits(raw: str) -> Dict[str, Limit]:
+    """解析 "name=limit:burst,name2=limit" 格式 (burst 省略時為 0)"""
+    limits = {}
+    for item in (raw or "").split(","):
+        name, sep, value = item.strip().rpartition("=")
+        if not sep or not name.strip():
+            continue
+        limit, _, burst = value.partition(":")
+        try:
+            limits[name.strip()] = (max(1, int(limit)), max(0, int(burst or 0)))
+        except ValueError:
+            logger.warning(f"Ignoring malformed rate limit rule: {item!r}")
+    return limits
+
+
+class RateLimiter:
+    def __init__(self):
+        self.default: Limit = (max(1, int(settings.RATE_LIMIT_PER_MINUTE)), max(0, int(settings.RATE_LIMIT_BURST)))
+        self.route_limits = parse_limits(settings.RATE_LIMIT_ROUTES)
+        self.key_limits = parse_limits(settings.RATE_LIMIT_KEYS)
+        self.lease_size = max(1, int(settings.RATE_LIMIT_LEASE_SIZE))
+        self._script = None
+        self._degraded = False  # Redis 異常、使用進程內計算中
+        self._leases: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()  # bucket -> (剩餘格數, 失效時間)
+        self._denied: "OrderedDict[str, float]" = OrderedDict()  # bucket -> 可再請求的時間 (epoch 秒)
+        self._local_tat: "OrderedDict[str, float]" = OrderedDict()  # 無 Lua 時的進程內 TAT
+
+    def limit_for(self, api_key: Optional[str], scope: str) -> Limit:
+        """優先序：個別 key > 個別路由 > 預設"""
+        if api_key and api_key in self.key_limits:
+            return self.key_limits[api_key]
+        return self.route_limits.get(scope, self.default)
+
+    async def allow(self, client_id: str, api_key: Optional[str], scope: str) -> bool:
+        bucket = f"{KEY_PREFIX}{client_id}:{api_key or 'anonymous'}:{scope}"
+        now = time.time()
+        lease = self._leases.get(bucket)
+        if lease is not None:
+            remaining, expires = lease
+            if now < expires:
+                if remaining > 1:
+                    self._leases[bucket] = (remaining - 1, expires)
+                else:
+                    del self._leases[bucket]
+                return True
+            del self._leases[bucket]
+        denied_until = self._denied.get(bucket)
+        if denied_until is not None:
+            if now < denied_until:
+                return False
+            del self._denied[bucket]
+
+        limit, burst = self.limit_for(api_key, scope)
+        # 整數毫秒：無法整除 60000 的限額 (如 7/min) 也能作為 Redis 的 PX 參數
+        interval_ms = math.ceil(60000 / limit)
+        tolerance_ms = interval_ms * burst
+        try:
+            if redis_client.redis is None:
+                await redis_client.connect()
+            if redis_client.use_fake:
+                allowed, retry_ms = self._allow_local(bucket, now, interval_ms, tolerance_ms)
+            else:
+                if self._script is None:
+                    self._script = await redis_client.register_script(GCRA_SCRIPT)
+                allowed, retry_ms = await self._script(
+                    keys=[bucket], args=[interval_ms, tolerance_ms, self.lease_size]
+                )
+            if self._degraded:
+                self._degraded = False
+                logger.info("Rate limiter Redis recovered")
+        except Exception as e:
+            # Redis 異常時退回進程內計算：限額改為各 worker 各自計算，但不會全面放行或全面拒絕
+            if not self._degraded:
+                self._degraded = True
+                logger.warning(f"Rate limiter error, using local limiter: {e}")
+            allowed, retry_ms = self._allow_local(bucket, now, interval_ms, tolerance_ms)
+
+        allowed = int(allowed)
+        if not allowed:
+            self._remember(self._denied, bucket, now + float(retry_ms) / 1000)
+        elif allowed > 1:
+            # 本次使用一格，其餘留在本地；預扣的額度回補後租約失效
+            self._remember(self._leases, bucket, (allowed - 1, now + allowed * interval_ms / 1000))
+        return bool(allowed)
+
+    def _allow_local(self, bucket: str, now: float, interval_ms: float, tolerance_ms: float):
+        now_ms = now * 1000
+        tat = max(self._local_tat.get(bucket, now_ms), now_ms)
+        if tat - now_ms > tolerance_ms:
+            return 0, tat - tolerance_ms - now_ms
+        self._remember(self._local_tat, bucket, tat + interval_ms)
+        return 1, 0
+
+    @staticmethod
+    def _remember(cache: OrderedDict, bucket: str, value):
+        cache[bucket] = value
+        cache.move_to_end(bucket)
+        if len(cache) > DENIED_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+rate_limiter = RateLimiter()
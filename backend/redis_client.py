@@ -42,11 +42,33 @@ class RedisClient:
             await self.redis.close()
             logger.info("Redis connection closed")
     
+    async def pipeline(self, transaction=True):
+        """取得 pipeline；transaction=True 時以 MULTI/EXEC 原子執行，整批只需一次往返"""
+        if not self.redis:
+            await self.connect()
+        return self.redis.pipeline(transaction=transaction)
+
+    async def register_script(self, script):
+        """註冊 Lua 腳本 (EVALSHA，未快取時自動改用 EVAL)"""
+        if not self.redis:
+            await self.connect()
+        return self.redis.register_script(script)
+
+    async def pubsub(self):
+        if not self.redis:
+            await self.connect()
+        return self.redis.pubsub()
+
     async def get(self, key):
         if not self.redis:
             await self.connect()
         return await self.redis.get(key)
     
+    async def mget(self, keys):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.mget(keys)
+
     async def set(self, key, value, ex=None):
         if not self.redis:
             await self.connect()
@@ -77,6 +99,11 @@ class RedisClient:
             await self.connect()
         return await self.redis.srem(key, member)
 
+    async def lrange(self, key, start, end):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.lrange(key, start, end)
+
     async def zadd(self, key, mapping):
         if not self.redis:
             await self.connect()
@@ -92,10 +119,19 @@ class RedisClient:
             await self.connect()
         return await self.redis.zrevrange(key, start, end, withscores=withscores)
 
-    async def zrangebyscore(self, key, min_score, max_score, withscores=False):
+    async def zrangebyscore(self, key, min_score, max_score, start=None, num=None, withscores=False):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.zrangebyscore(
+            key, min_score, max_score, start=start, num=num, withscores=withscores
+        )
+
+    async def zrevrangebyscore(self, key, max_score, min_score, start=None, num=None, withscores=False):
         if not self.redis:
             await self.connect()
-        return await self.redis.zrangebyscore(key, min_score, max_score, withscores=withscores)
+        return await self.redis.zrevrangebyscore(
+            key, max_score, min_score, start=start, num=num, withscores=withscores
+        )
 
     async def zremrangebyrank(self, key, start, end):
         if not self.redis:
@@ -112,4 +148,14 @@ class RedisClient:
             await self.connect()
         return await self.redis.zcard(key)
 
+    async def xadd(self, key, fields, maxlen=None):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.xadd(key, fields, maxlen=maxlen, approximate=True)
+
+    async def xread(self, streams, count=None, block=None):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.xread(streams, count=count, block=block)
+
 redis_client = RedisClient()
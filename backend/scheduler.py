@@ -1,15 +1,19 @@
 import asyncio
+import time
 from typing import List, Dict
 import logging
 from backend.sources.base import BaseSource
 from backend.aggregator import Aggregator
 from backend.metrics import record_source_failure, record_source_success
-from backend.market_hours import is_market_open
+from backend.market_hours import market_calendar
 from backend.redis_client import redis_client
+from backend.archive import tick_archive
+from backend.config import get_settings
 import os
 import json
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 # 數據源配置 - 頻率設定依據各來源的 Rate Limit 政策
 # 
@@ -28,6 +32,9 @@ logger = logging.getLogger(__name__)
 # │ Mock           │ 2s       │ 0s       │ 測試用                                  │
 # └────────────────┴──────────┴──────────┴─────────────────────────────────────────┘
 
+# 休市期間的輪詢間隔上限 (秒)；開盤時間到達時立即恢復正常頻率
+CLOSED_MARKET_POLL_SECONDS = 300
+
 SOURCE_CONFIG = {
     "Binance": {"interval": 2, "offset": 0, "max_age": 6},       # Binance API 限制寬鬆，2 秒安全
     "GoldPrice.org": {"interval": 15, "offset": 1, "max_age": 45},  # 保守避免封鎖
@@ -56,6 +63,12 @@ class Scheduler:
         self._tasks: List[asyncio.Task] = []
         self._interval_scale: Dict[str, float] = {s.source_name: 1.0 for s in sources}
 
+    async def _store_result(self, symbol: str, source_name: str, result: Dict):
+        """保存單一來源的最新結果 (分片模式下由子類改寫為寫入 Redis Stream)"""
+        if symbol not in self.latest_results:
+            self.latest_results[symbol] = {}
+        self.latest_results[symbol][source_name] = result
+
     async def _poll_source(self, source: BaseSource, symbol: str):
         """輪詢單一數據源"""
         if not source.supports(symbol):
@@ -72,16 +85,14 @@ class Scheduler:
                 if self.aggregator.circuit_breaker.is_available(source.source_name):
                     result = await source.get_data(symbol)
                     if result:
-                        # 如果市場關閉，放寬 max_age 以配合 30s 的輪詢間隔
+                        # 如果市場關閉，放寬 max_age 以配合休市期間的低頻輪詢
                         # 避免因為輪詢變慢導致數據被判定為過期
                         current_max_age = max_age
-                        if not is_market_open(symbol) and "Binance" not in source.source_name:
-                            current_max_age = max(max_age, 60) # 至少 60 秒有效期
+                        if not market_calendar.is_open(symbol) and "Binance" not in source.source_name:
+                            current_max_age = max(max_age, CLOSED_MARKET_POLL_SECONDS * 2)
                             
                         result["max_age"] = current_max_age
-                        if symbol not in self.latest_results:
-                            self.latest_results[symbol] = {}
-                        self.latest_results[symbol][source.source_name] = result
+                        await self._store_result(symbol, source.source_name, result)
                         self._interval_scale[source.source_name] = max(
                             1.0, self._interval_scale[source.source_name] * 0.9
                         )
@@ -103,23 +114,47 @@ class Scheduler:
                 await record_source_failure(source.source_name)
             
             # 動態調整輪詢間隔
-            # 如果市場關閉 (且非 24/7 的 Binance/Crypto 來源)，固定每 30 秒更新一次
-            if not is_market_open(symbol) and "Binance" not in source.source_name:
-                await asyncio.sleep(30)
+            # 如果市場關閉 (且非 24/7 的 Binance/Crypto 來源)，降低輪詢頻率並在開盤時準時恢復
+            is_open, state_until = market_calendar.state(symbol)
+            if not is_open and "Binance" not in source.source_name:
+                await asyncio.sleep(min(CLOSED_MARKET_POLL_SECONDS, max(1.0, state_until - time.time())))
             else:
                 await asyncio.sleep(base_interval * self._interval_scale[source.source_name])
 
     async def _aggregate_loop(self, symbols: List[str]):
         """定期聚合所有來源的數據"""
+        try:
+            # 還原各週期最後一根 K 線，重啟後接續累計
+            await self.aggregator.candles.load(symbols)
+        except Exception as e:
+            logger.error(f"Error loading candles: {e}")
+
         while self.running:
+            batch = {}
             for symbol in symbols:
                 if symbol in self.latest_results:
                     results = list(self.latest_results[symbol].values())
                     if results:
-                        await self.aggregator.aggregate(symbol, results)
+                        batch[symbol] = results
+            if batch:
+                # 一次向量化處理所有交易對
+                await self.aggregator.aggregate_batch(batch)
             
             await asyncio.sleep(1)  # 每秒聚合一次
 
+    async def _history_maintenance_loop(self, symbols: List[str]):
+        """背景裁剪歷史資料與 K 線 (攤銷，不在每次寫入時執行)"""
+        trimmer = self.aggregator.history_trimmer
+        while self.running:
+            try:
+                await trimmer.trim_due()
+                await self.aggregator.candles.trim_due(symbols)
+                if settings.ARCHIVE_ENABLED:
+                    await tick_archive.flush_due()
+            except Exception as e:
+                logger.error(f"Error trimming history: {e}")
+            await asyncio.sleep(1)
+
     async def _log_spread_loop(self):
         """每分鐘記錄現貨與合約價差"""
         # Ensure logs directory exists
@@ -170,22 +205,36 @@ class Scheduler:
             
             await asyncio.sleep(15)
 
-    async def run(self, symbols: List[str]):
+    async def run(self, symbols: List[str], poll: bool = True, aggregate: bool = True, extra_tasks=None):
+        """
+        啟動調度。
+        poll: 是否輪詢數據源 (分片模式下僅 ingest worker 開啟)
+        aggregate: 是否執行聚合與價差記錄 (分片模式下僅 aggregator 進程開啟)
+        extra_tasks: 額外一併管理的 coroutine (例如 Redis Stream 消費者)
+        """
         self.running = True
         logger.info("Scheduler started.")
         
         tasks = []
         
         # 為每個 symbol 和每個 source 創建輪詢任務
-        for symbol in symbols:
-            for source in self.sources:
-                tasks.append(asyncio.create_task(self._poll_source(source, symbol)))
-        
-        # 創建聚合任務
-        tasks.append(asyncio.create_task(self._aggregate_loop(symbols)))
+        if poll:
+            for symbol in symbols:
+                for source in self.sources:
+                    tasks.append(asyncio.create_task(self._poll_source(source, symbol)))
         
-        # 創建價差記錄任務
-        tasks.append(asyncio.create_task(self._log_spread_loop()))
+        if aggregate:
+            # 創建聚合任務
+            tasks.append(asyncio.create_task(self._aggregate_loop(symbols)))
+            
+            # 創建歷史裁剪任務
+            tasks.append(asyncio.create_task(self._history_maintenance_loop(symbols)))
+            
+            # 創建價差記錄任務
+            tasks.append(asyncio.create_task(self._log_spread_loop()))
+
+        for coro in extra_tasks or []:
+            tasks.append(asyncio.create_task(coro))
         
         # 等待所有任務
         self._tasks = tasks
@@ -201,4 +250,7 @@ class Scheduler:
         if self._tasks:
             await asyncio.gather(*self._tasks, return_exceptions=True)
         self._tasks = []
+        if settings.ARCHIVE_ENABLED:
+            # 停止前寫出封存緩衝中尚未落盤的點
+            await tick_archive.flush()
         logger.info("Scheduler stopping...")
@@ -0,0 +1,84 @@
+"""
+雜湊時間輪 (hashed timing wheel)：大量週期性計時器共用一個 asyncio task。
+
+每個 tick 只處理當前槽位的項目，排程與取消皆為 O(1)；
+超過一圈的延遲以剩餘圈數 (rounds) 記錄。沒有項目時 task 自動結束，下次排程時再啟動。
+autostart=False 時不啟動背景 task，由呼叫端以 advance() 手動推進 (測試用)。
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 到期回呼：回傳下一次的延遲秒數 (None 表示不再排程)
+Callback = Callable[[Any], Optional[float]]
+
+
+class TimingWheel:
+    def __init__(self, tick: float, slots: int = 512, autostart: bool = True):
+        self.tick = max(0.001, float(tick))
+        self.autostart = autostart
+        self._slots: List[Dict[Any, Tuple[int, Callback]]] = [{} for _ in range(max(1, slots))]
+        self._where: Dict[Any, int] = {}  # 項目 -> 所在槽位
+        self._cursor = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def schedule(self, item: Any, delay: float, callback: Callback):
+        """delay 秒後 (以 tick 為精度，至少一個 tick) 呼叫 callback(item)；同一項目重複排程時覆蓋"""
+        self.cancel(item)
+        ticks = max(1, round(delay / self.tick))
+        index = (self._cursor + ticks) % len(self._slots)
+        self._slots[index][item] = ((ticks - 1) // len(self._slots), callback)
+        self._where[item] = index
+        if self.autostart and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def cancel(self, item: Any):
+        index = self._where.pop(item, None)
+        if index is not None:
+            self._slots[index].pop(item, None)
+
+    async def close(self):
+        """停止背景 task (應用程式關閉時呼叫)；之後再排程會重新啟動"""
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def advance(self):
+        """前進一個 tick，執行到期的回呼"""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        slot = self._slots[self._cursor]
+        expired = []
+        for item, (rounds, callback) in list(slot.items()):
+            if rounds > 0:
+                slot[item] = (rounds - 1, callback)
+            else:
+                del slot[item]
+                del self._where[item]
+                expired.append((item, callback))
+        for item, callback in expired:
+            try:
+                delay = callback(item)
+            except Exception as e:
+                logger.error(f"Timing wheel callback error: {e}")
+                continue
+            if delay is not None:
+                self.schedule(item, delay, callback)
+
+    async def _run(self):
+        next_tick = time.monotonic() + self.tick
+        while self._where:
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            # 落後時一次補跑多個 tick，計時不因事件迴圈延遲而累積偏移
+            while self._where and next_tick <= time.monotonic():
+                self.advance()
+                next_tick += self.tick
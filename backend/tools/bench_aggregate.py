@@ -0,0 +1,71 @@
+"""
+聚合效能基準：比較逐一 compute 與向量化 compute_batch。
+
+    python -m backend.tools.bench_aggregate --symbols 15 200 2000
+"""
+import argparse
+import random
+import time
+
+from backend.aggregator import Aggregator
+from backend.ingest import build_sources
+
+
+def make_batch(aggregator: Aggregator, n_symbols: int, sources_per_symbol: int, now: float):
+    names = list(aggregator.weights)
+    batch = {}
+    for i in range(n_symbols):
+        base = random.uniform(1, 3000)
+        batch[f"SYM{i}"] = [
+            {
+                "source": name,
+                "price": base * (1 + random.gauss(0, 0.001)),
+                "latency": random.uniform(20, 1500),
+                "timestamp": now - random.uniform(0, 20),
+                "max_age": random.choice([6, 15, 30, 180]),
+            }
+            for name in random.sample(names, min(sources_per_symbol, len(names)))
+        ]
+    return batch
+
+
+def bench(n_symbols: int, sources_per_symbol: int, rounds: int):
+    aggregator = Aggregator(build_sources())
+    now = time.time()
+    batch = make_batch(aggregator, n_symbols, sources_per_symbol, now)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        scalar = {symbol: aggregator.compute(symbol, results, now) for symbol, results in batch.items()}
+    scalar_ms = (time.perf_counter() - start) * 1000 / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        vectorized = aggregator.compute_batch(batch, now)
+    batch_ms = (time.perf_counter() - start) * 1000 / rounds
+
+    identical = all(
+        (scalar[s] and scalar[s][0]) == (vectorized[s] and vectorized[s][0]) for s in batch
+    )
+    print(
+        f"{n_symbols:>6} | {scalar_ms:>12.2f} ms | {batch_ms:>12.2f} ms | "
+        f"{scalar_ms / batch_ms:>7.1f}x | {'yes' if identical else 'NO'}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scalar vs vectorized aggregation")
+    parser.add_argument("--symbols", type=int, nargs="+", default=[15, 200, 2000])
+    parser.add_argument("--sources", type=int, default=8, help="Sources per symbol")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(42)
+    print(f"{'Symbols':>6} | {'Scalar':>15} | {'Batch':>15} | {'Speedup':>8} | Identical")
+    print("-" * 66)
+    for n in args.symbols:
+        bench(n, args.sources, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
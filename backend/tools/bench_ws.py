@@ -0,0 +1,125 @@
+"""
+WebSocket 廣播基準：連線數與推送延遲 (p50 / p99)。
+
+進程內模式 (預設)：直接對 BroadcastHub 註冊 N 個客戶端佇列並廣播，量測 hub 的扇出延遲。
+
+    python -m backend.tools.bench_ws --clients 10000 --messages 50
+
+端對端模式：對執行中的伺服器建立 N 條 /ws/stream 連線，經 Redis 發布帶時間戳的訊息，
+量測客戶端收到的延遲，並回報 Redis 的連線數 (每個 API 進程應只有一個訂閱連線)。
+需要真實 Redis；大量連線時請先調高 ulimit -n。
+
+    python -m backend.tools.bench_ws --url ws://localhost:8000/ws/stream?api_key=dev_key --clients 10000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import List
+
+BENCH_SYMBOL = "BENCH"
+
+
+def _report(latencies: List[float], expected: int, elapsed: float):
+    if not latencies:
+        print("no messages received")
+        return
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"delivered {len(latencies)}/{expected} in {elapsed:.2f}s | "
+        f"p50 {statistics.median(latencies) * 1000:.2f} ms | p99 {p99 * 1000:.2f} ms | "
+        f"max {latencies[-1] * 1000:.2f} ms"
+    )
+
+
+async def bench_hub(clients: int, messages: int, interval: float):
+    from backend.ws_hub import BroadcastHub, STREAM_CHANNEL_PREFIX
+
+    hub = BroadcastHub()
+    latencies: List[float] = []
+    registered = [hub.register() for _ in range(clients)]
+
+    async def consume(client):
+        # 落後的客戶端會被合併 (conflation)，以最後一筆的序號判斷結束
+        while True:
+            data = json.loads(await client.next())
+            latencies.append(time.perf_counter() - data["sent"])
+            if data["seq"] == messages - 1:
+                return
+
+    tasks = [asyncio.create_task(consume(c)) for c in registered]
+    start = time.perf_counter()
+    for i in range(messages):
+        payload = json.dumps({"symbol": BENCH_SYMBOL, "price": 100 + i, "seq": i, "sent": time.perf_counter()})
+        hub.dispatch(f"{STREAM_CHANNEL_PREFIX}{BENCH_SYMBOL}", payload)
+        await asyncio.sleep(interval)
+    await asyncio.gather(*tasks)
+    print(f"in-process hub: {clients} clients, 0 extra Redis connections | {hub.stats()}")
+    _report(latencies, clients * messages, time.perf_counter() - start)
+
+
+async def bench_server(url: str, clients: int, messages: int, interval: float):
+    import aiohttp
+    from backend.redis_client import redis_client
+
+    await redis_client.connect()
+    if redis_client.use_fake:
+        print("End-to-end mode requires a real Redis server")
+        return
+    before = (await redis_client.redis.info("clients"))["connected_clients"]
+
+    latencies: List[float] = []
+    received = 0
+    session = aiohttp.ClientSession()
+    sockets = []
+    for i in range(clients):
+        sockets.append(await session.ws_connect(url, heartbeat=None))
+        if i % 1000 == 999:
+            print(f"connected {i + 1}")
+    after = (await redis_client.redis.info("clients"))["connected_clients"]
+
+    async def consume(ws):
+        nonlocal received
+        async for msg in ws:
+            data = json.loads(msg.data)
+            if data.get("symbol") == BENCH_SYMBOL:
+                # 以 wall clock 比較 (發布端與客戶端在同一台機器)
+                latencies.append(time.time() - data["sent"])
+                received += 1
+                if data["seq"] == messages - 1:
+                    return
+
+    tasks = [asyncio.create_task(consume(ws)) for ws in sockets]
+    start = time.perf_counter()
+    for i in range(messages):
+        payload = json.dumps({"symbol": BENCH_SYMBOL, "price": 100 + i, "seq": i, "sent": time.time()})
+        await redis_client.publish(f"market:stream:{BENCH_SYMBOL}", payload)
+        await asyncio.sleep(interval)
+    await asyncio.wait(tasks, timeout=10)
+    print(f"{clients} WebSocket clients | Redis connections: {before} before, {after} after connecting")
+    _report(latencies, clients * messages, time.perf_counter() - start)
+
+    for ws in sockets:
+        await ws.close()
+    await session.close()
+    await redis_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark WebSocket fan-out")
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between published messages")
+    parser.add_argument("--url", help="ws:// URL of a running server (end-to-end mode)")
+    args = parser.parse_args()
+
+    if args.url:
+        asyncio.run(bench_server(args.url, args.clients, args.messages, args.interval))
+    else:
+        asyncio.run(bench_hub(args.clients, args.messages, args.interval))
+
+
+if __name__ == "__main__":
+    main()
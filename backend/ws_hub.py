@@ -0,0 +1,429 @@
+"""
+每個進程一個的 WebSocket 廣播中心 (fan-out hub)。
+
+以 market_feed 的單一 pattern 訂閱 (market:stream:*) 接收報價，
+再推送到各已註冊客戶端的佇列；每個連線只負責從自己的佇列取出並送出。
+1000 個客戶端也只有一個 Redis 訂閱連線，且不需輪詢。
+
+每個客戶端有自己的訂閱集合 ("*" 代表全部)，hub 維護 symbol → clients 索引，
+訊息只送給訂閱該 symbol 的客戶端。只接受系統追蹤的 symbol (SYMBOLS)，其餘忽略，
+客戶端無法以任意字串讓索引無限成長。
+
+背壓：每個客戶端的待送緩衝以 symbol 為鍵，送出前再有新報價時只保留最新值 (conflation)，
+記憶體上限為訂閱的 symbol 數；緩衝持續未清空超過 WS_SLOW_CLIENT_SECONDS 的客戶端會被移除，
+不會拖慢其他客戶端或讓記憶體無限成長。
+
+二進位格式 (format=binary，選用)：報價以固定 18 bytes 的 binary frame 送出
+(uint16 symbol id、float64 price、float64 timestamp，little-endian)；
+symbol 名稱、來源等較少變動的欄位以文字 frame {"type": "meta", ...} 送出，
+只在客戶端第一次收到該 symbol 或內容改變時才送。編碼在 dispatch 時每則訊息只做一次。
+
+連線 (或新增訂閱) 時先送一個 {"type": "snapshot", "timestamp": ..., "data": {...}} frame，
+內容取自進程內的最新價格表，客戶端不需另外呼叫 /api/v1/latest。
+
+SSE (/api/v1/stream) 與 WebSocket 共用同一個 hub。每則訊息有 "{epoch}-{seq}" 形式的 event id
+(epoch 為進程啟動時產生的隨機值)，最近 SSE_REPLAY_SIZE 則保留在重播緩衝；
+客戶端以 Last-Event-ID 重連時補送遺漏的訊息，epoch 不符 (換了進程) 或已超出緩衝時改送快照。
+
+限速 (max_rate=N，每秒最多 N 次)：報價照常在待送緩衝依 symbol 合併，但只在每 1/N 秒的 flush 時送出；
+所有限速客戶端的計時由同一個時間輪 (TimingWheel) 驅動，不為每個連線建立 task。
+"""
+import asyncio
+import json
+import logging
+import secrets
+import struct
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, Optional, Set, Tuple, Union
+
+from backend.aggregator import SYMBOLS
+from backend.config import get_settings
+from backend.latest import latest_table
+from backend.timing_wheel import TimingWheel
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+STREAM_CHANNEL_PREFIX = "market:stream:"
+
+# 訂閱全部 symbol
+ALL_SYMBOLS = "*"
+
+FORMATS = ("json", "binary")
+
+# 二進位報價 frame：symbol id, price, timestamp
+TICK = struct.Struct("<Hdd")
+
+# SSE 斷線後瀏覽器重連的等待毫秒數
+SSE_RETRY_MS = 3000
+
+# 以 meta frame 傳送的欄位 (延遲等每筆都變的欄位不送)
+META_FIELDS = ("sources", "details", "fastest", "is_market_open")
+
+
+def parse_max_rate(raw: Optional[str]) -> Optional[float]:
+    """max_rate query 參數 (每秒次數，須為正數)；未指定時回傳 None，格式錯誤時拋出 ValueError"""
+    if raw is None or raw == "":
+        return None
+    rate = float(raw)
+    if not rate > 0:
+        raise ValueError("max_rate must be positive")
+    return rate
+
+
+def parse_symbols(raw) -> Set[str]:
+    """接受 "XAU-USD,usd-twd" 字串或字串列表，回傳大寫 symbol 集合"""
+    items = raw.split(",") if isinstance(raw, str) else raw
+    return {str(s).strip().upper() for s in items if str(s).strip()}
+
+
+class Update:
+    """一則廣播訊息；二進位編碼由 hub 在有二進位客戶端時填入"""
+
+    __slots__ = ("symbol", "text", "event_id", "seq", "tick", "meta", "meta_version")
+
+    def __init__(self, symbol: str, text: str, event_id: Optional[str] = None, seq: int = 0):
+        self.symbol = symbol
+        self.text = text
+        self.event_id = event_id
+        self.seq = seq
+        self.tick: Optional[bytes] = None
+        self.meta: Optional[str] = None
+        self.meta_version = 0
+
+
+class HubClient:
+    """單一連線的待送緩衝與訂閱集合"""
+
+    def __init__(
+        self,
+        maxsize: int,
+        symbols: Optional[Set[str]] = None,
+        slow_seconds: float = 0,
+        binary: bool = False,
+        event_stream: bool = False,
+    ):
+        self.maxsize = max(1, maxsize)
+        self.slow_seconds = slow_seconds
+        self.binary = binary
+        self.event_stream = event_stream  # SSE：next() 回傳 "id: ...\ndata: ...\n\n" 格式
+        self.symbols: Set[str] = set(symbols) if symbols is not None else {ALL_SYMBOLS}
+        self.pending: "OrderedDict[str, Update]" = OrderedDict()  # symbol -> 最新一筆待送訊息
+        # 控制回覆、快照與重播訊息 (文字, event id)，優先於即時報價送出
+        self.control: Deque[Tuple[str, Optional[str]]] = deque()
+        self.meta_versions: Dict[str, int] = {}  # 二進位模式：已送出的 meta 版本
+        self._follow: Optional[bytes] = None  # meta frame 之後緊接著送出的報價
+        # 限速：flush 間隔秒數 (None 為不限速) 與本次 flush 可送出的筆數
+        self.interval: Optional[float] = None
+        self._release = 0
+        self.behind_since: Optional[float] = None
+        self.conflated = 0
+        self.dropped = 0
+        self.evicted = asyncio.Event()
+        self._ready = asyncio.Event()
+
+    def push(self, symbol: str, data: Update) -> bool:
+        """加入待送緩衝；回傳 False 表示客戶端落後過久，應中斷連線"""
+        if symbol in self.pending:
+            # 尚未送出的舊值直接被新值取代，保留原本的送出順序
+            self.conflated += 1
+        elif len(self.pending) >= self.maxsize:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        self.pending[symbol] = data
+
+        now = time.monotonic()
+        if self.interval is None:
+            self._ready.set()
+            if self.behind_since is None:
+                self.behind_since = now
+                return True
+        # 限速客戶端等到 flush 才送；behind_since 由 flush 判定 (上次 flush 未送完才算落後)
+        if self.behind_since is not None and self.slow_seconds and now - self.behind_since > self.slow_seconds:
+            return False
+        return True
+
+    def flush(self):
+        """時間輪到期：放行目前緩衝內的報價 (每個 symbol 一筆最新值)"""
+        if self._release and self.behind_since is None:
+            self.behind_since = time.monotonic()
+        self._release = len(self.pending)
+        if self._release:
+            self._ready.set()
+
+    def wants(self, symbol: str) -> bool:
+        return ALL_SYMBOLS in self.symbols or symbol in self.symbols
+
+    def notify(self, data: str, event_id: Optional[str] = None):
+        """控制回覆 (訂閱確認、錯誤) 與報價共用同一個送出迴圈，避免兩處同時寫入 socket"""
+        if len(self.control) >= self.maxsize:
+            self.control.popleft()
+            self.dropped += 1
+        self.control.append((data, event_id))
+        self._ready.set()
+
+    def replay(self, updates: Iterable[Update]):
+        """SSE 重連時補送的訊息 (不受 maxsize 限制，數量由重播緩衝決定)"""
+        self.control.extend((u.text, u.event_id) for u in updates if self.wants(u.symbol))
+        self._ready.set()
+
+    def _sendable(self) -> bool:
+        return bool(self.pending) and (self.interval is None or self._release > 0)
+
+    def _format(self, data: str, event_id: Optional[str]) -> str:
+        if not self.event_stream:
+            return data
+        lines = "".join(f"data: {line}\n" for line in data.splitlines())
+        return (f"id: {event_id}\n" if event_id else "") + lines + "\n"
+
+    async def next(self) -> Union[str, bytes]:
+        """下一個要送出的 frame (str 為文字 frame，bytes 為二進位 frame)"""
+        if self._follow is not None:
+            frame, self._follow = self._follow, None
+            return frame
+        while not self.control and not self._sendable():
+            self._ready.clear()
+            await self._ready.wait()
+        if self.control:
+            return self._format(*self.control.popleft())
+        symbol, update = self.pending.popitem(last=False)
+        if self.interval is not None:
+            self._release = self._release - 1 if self.pending else 0
+            if not self._release:
+                self.behind_since = None
+        elif not self.pending:
+            self.behind_since = None
+        if not self.binary or update.tick is None:
+            return self._format(update.text, update.event_id)
+        if self.meta_versions.get(symbol) != update.meta_version:
+            self.meta_versions[symbol] = update.meta_version
+            self._follow = update.tick
+            return update.meta
+        return update.tick
+
+
+class BroadcastHub:
+    def __init__(self, symbols: Optional[Iterable[str]] = None):
+        # 可訂閱的 symbol (None 表示不限制)
+        self.known: Optional[Set[str]] = set(symbols) if symbols is not None else None
+        self.clients: Set[HubClient] = set()
+        self.by_symbol: Dict[str, Set[HubClient]] = {}
+        self.evicted = 0
+        # 已中斷連線客戶端的累計數 (現存客戶端的計數在 stats() 中加總)
+        self._closed_conflated = 0
+        self._closed_dropped = 0
+        # 二進位格式：客戶端數 (為 0 時不做二進位編碼)、symbol id 與目前的 meta
+        self.binary_clients = 0
+        self.symbol_ids: Dict[str, int] = {}
+        self._meta: Dict[str, Tuple[tuple, int, str]] = {}  # symbol -> (欄位值, 版本, meta JSON)
+        # SSE event id 與重播緩衝
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.history: Deque[Update] = deque(maxlen=max(1, settings.SSE_REPLAY_SIZE))
+        # 限速客戶端的 flush 計時
+        self.wheel = TimingWheel(settings.STREAM_TIMER_TICK_SECONDS)
+
+    def register(
+        self,
+        symbols: Optional[Iterable[str]] = None,
+        binary: bool = False,
+        event_stream: bool = False,
+        max_rate: Optional[float] = None,
+    ) -> HubClient:
+        # 未指定時訂閱全部；指定的 symbol 全部未知時不訂閱任何 symbol (而非全部)
+        client = HubClient(
+            settings.WS_CLIENT_QUEUE_SIZE,
+            self.accept(symbols) if symbols else None,
+            settings.WS_SLOW_CLIENT_SECONDS,
+            binary,
+            event_stream,
+        )
+        self.clients.add(client)
+        self._index(client)
+        if binary:
+            self.binary_clients += 1
+        if max_rate:
+            client.interval = max(self.wheel.tick, 1.0 / max_rate)
+            self.wheel.schedule(client, client.interval, self._flush)
+        return client
+
+    async def close(self):
+        await self.wheel.close()
+
+    @staticmethod
+    def _flush(client: HubClient) -> float:
+        client.flush()
+        return client.interval
+
+    def unregister(self, client: HubClient):
+        if client not in self.clients:
+            return
+        self.clients.discard(client)
+        self._unindex(client)
+        self.wheel.cancel(client)
+        if client.binary:
+            self.binary_clients -= 1
+        self._closed_conflated += client.conflated
+        self._closed_dropped += client.dropped
+
+    def evict(self, client: HubClient):
+        logger.warning(f"Evicting slow WebSocket client ({len(client.pending)} pending, {client.conflated} conflated)")
+        self.evicted += 1
+        self.unregister(client)
+        client.evicted.set()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "clients": len(self.clients),
+            "conflated": self._closed_conflated + sum(c.conflated for c in self.clients),
+            "dropped": self._closed_dropped + sum(c.dropped for c in self.clients),
+            "evicted": self.evicted,
+            "throttled": len(self.wheel),
+        }
+
+    def accept(self, symbols: Iterable[str]) -> Set[str]:
+        """過濾掉未追蹤的 symbol ("*" 保留)"""
+        if self.known is None:
+            return set(symbols)
+        return {s for s in symbols if s == ALL_SYMBOLS or s in self.known}
+
+    def subscribe(self, client: HubClient, symbols: Iterable[str]):
+        self._unindex(client)
+        client.symbols |= set(symbols)
+        self._index(client)
+
+    def unsubscribe(self, client: HubClient, symbols: Iterable[str]):
+        self._unindex(client)
+        client.symbols -= set(symbols)
+        self._index(client)
+
+    def _index_keys(self, client: HubClient) -> Set[str]:
+        # 訂閱全部的客戶端只放在 "*" 索引，避免同一則訊息重複推送
+        return {ALL_SYMBOLS} if ALL_SYMBOLS in client.symbols else client.symbols
+
+    def _index(self, client: HubClient):
+        for symbol in self._index_keys(client):
+            self.by_symbol.setdefault(symbol, set()).add(client)
+
+    def _unindex(self, client: HubClient):
+        for symbol in self._index_keys(client):
+            subscribers = self.by_symbol.get(symbol)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self.by_symbol[symbol]
+
+    def event_id(self) -> str:
+        return f"{self.epoch}-{self.seq}"
+
+    def resume(self, client: HubClient, last_event_id: str) -> bool:
+        """依 Last-Event-ID 補送遺漏的訊息；無法接續 (epoch 不符或超出緩衝) 時回傳 False"""
+        epoch, _, seq = last_event_id.strip().rpartition("-")
+        if epoch != self.epoch:
+            return False
+        try:
+            seq = int(seq)
+        except ValueError:
+            return False
+        oldest = self.history[0].seq if self.history else self.seq + 1
+        if seq > self.seq or seq < oldest - 1:
+            return False
+        client.replay(u for u in self.history if u.seq > seq)
+        return True
+
+    def send_snapshot(self, client: HubClient, symbols: Optional[Iterable[str]] = None):
+        """以最新價格表組成快照 frame，排在所有即時報價之前送出"""
+        symbols = client.symbols if symbols is None else set(symbols)
+        if ALL_SYMBOLS in symbols:
+            symbols = latest_table.symbols()
+        else:
+            symbols = sorted(s for s in symbols if latest_table.get(s) is not None)
+        if not symbols:
+            return
+        body = latest_table.render(symbols, time.time())
+        client.notify('{"type": "snapshot", ' + body[1:].decode(), self.event_id())
+
+    def handle_control(self, client: HubClient, text: Optional[str]):
+        """處理 {"action": "subscribe" | "unsubscribe", "symbols": [...]}，回覆目前的訂閱清單"""
+        try:
+            payload = json.loads(text or "")
+            action = payload.get("action")
+            symbols = parse_symbols(payload.get("symbols") or [])
+        except (ValueError, AttributeError, TypeError):
+            client.notify(json.dumps({"type": "error", "detail": "Invalid control message"}))
+            return
+        ignored = set()
+        if action == "subscribe":
+            accepted = self.accept(symbols)
+            ignored = symbols - accepted
+            added = set() if ALL_SYMBOLS in client.symbols else accepted - client.symbols
+            self.subscribe(client, accepted)
+        elif action == "unsubscribe":
+            added = set()
+            self.unsubscribe(client, symbols)
+        else:
+            client.notify(json.dumps({"type": "error", "detail": f"Unknown action: {action}"}))
+            return
+        reply = {"type": "subscribed", "symbols": sorted(client.symbols)}
+        if ignored:
+            reply["ignored"] = sorted(ignored)
+        client.notify(json.dumps(reply))
+        if added:
+            self.send_snapshot(client, added)
+
+    async def event_stream(
+        self, symbols: Set[str], last_event_id: Optional[str] = None, max_rate: Optional[float] = None
+    ):
+        """SSE 事件串流：接續 Last-Event-ID 或先送快照，無訊息時定期送保活註解"""
+        client = self.register(symbols, event_stream=True, max_rate=max_rate)
+        try:
+            if not last_event_id or not self.resume(client, last_event_id):
+                self.send_snapshot(client)
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            while not client.evicted.is_set():
+                try:
+                    yield await asyncio.wait_for(client.next(), settings.SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unregister(client)
+
+    def _encode_binary(self, update: Update):
+        try:
+            payload = json.loads(update.text)
+            price, timestamp = float(payload["price"]), float(payload["timestamp"])
+        except (ValueError, KeyError, TypeError):
+            return  # 非報價格式的訊息，二進位客戶端改收原始文字
+        symbol = update.symbol
+        symbol_id = self.symbol_ids.setdefault(symbol, len(self.symbol_ids))
+        fields = tuple(json.dumps(payload.get(name)) for name in META_FIELDS)
+        current = self._meta.get(symbol)
+        if current is None or current[0] != fields:
+            version = current[1] + 1 if current else 1
+            meta = {"type": "meta", "id": symbol_id, "symbol": symbol}
+            meta.update({name: payload.get(name) for name in META_FIELDS})
+            current = (fields, version, json.dumps(meta))
+            self._meta[symbol] = current
+        update.tick = TICK.pack(symbol_id, price, timestamp)
+        update.meta_version = current[1]
+        update.meta = current[2]
+
+    def dispatch(self, channel: str, data: str):
+        """market_feed 的 market:stream:* 處理函式"""
+        symbol = channel[len(STREAM_CHANNEL_PREFIX):]
+        self.seq += 1
+        update = Update(symbol, data, f"{self.epoch}-{self.seq}", self.seq)
+        self.history.append(update)
+        if self.binary_clients:
+            self._encode_binary(update)
+        slow = []
+        for key in (ALL_SYMBOLS, symbol):
+            for client in self.by_symbol.get(key, ()):
+                if not client.push(symbol, update):
+                    slow.append(client)
+        for client in slow:
+            self.evict(client)
+
+
+ws_hub = BroadcastHub(SYMBOLS)
@@ -631,23 +631,6 @@ const DashboardSection = () => {
       // 目前後端預設設定 (config.py) 允許任意 API Key，除非在 .env 設定了鎖定。
       const apiKey = "dev_key";
       
-      // 1. Initial Fetch (防止 WebSocket 連線前空白)
-      fetch(`/api/v1/latest?symbols=XAU-USD,XAG-USD,USD-TWD,GC-F,SI-F,XAG-USDT,XAU-USDT,DXY,US10Y,HG-F,CL-F,VIX,GDX,SIL`, {
-        headers: { 'X-API-Key': apiKey }
-      })
-      .then(res => res.json())
-      .then(data => {
-        if (data.data) {
-           const initialData = {};
-           Object.keys(data.data).forEach(key => {
-             initialData[key] = data.data[key];
-           });
-           setMarketData(prev => ({...prev, ...initialData}));
-           marketDataRef.current = {...marketDataRef.current, ...initialData};
-        }
-      })
-      .catch(err => console.error("Initial fetch error:", err));
-
       // 自動判斷 WebSocket 網址
       const protocol = window.location.protocol === "https:" ? "wss:" : "ws:";
       const host = window.location.host; // goldlab.cloud
@@ -668,6 +651,17 @@ const DashboardSection = () => {
           const raw = event.data;
           if (raw.startsWith("{")) {
             const data = JSON.parse(raw);
+            // 連線後伺服器先送出最新價格快照 (取代連線前的 /api/v1/latest 請求)
+            if (data.type === "snapshot") {
+              setMarketData((prev) => {
+                const next = { ...prev, ...data.data };
+                marketDataRef.current = next;
+                return next;
+              });
+              return;
+            }
+            // 其他控制訊息 (subscribed / error / meta) 不是報價
+            if (data.type) return;
             setPrevMarketData((prev) => ({
               ...prev,
               [data.symbol]: marketDataRef.current[data.symbol]?.price,
@@ -0,0 +1,315 @@
+import json
+import time
+
+import pytest
+import fakeredis.aioredis
+from unittest.mock import patch
+
+from backend.history_codec import encode_chunk, decode_chunk
+
+
+def test_history_codec_roundtrip():
+    ts = 1_705_500_000_000
+    price = 2650.45
+    points = []
+    for i in range(2000):
+        ts += (1000, 1000, 999, 1003, 0, 61_000)[i % 6]
+        if i % 3 == 0:
+            price = round(price + (0.01, -0.02, 0.05)[i % 3 == 0 and (i // 3) % 3], 2)
+        points.append((ts, price))
+    points.append((ts - 5_000, 1e-300))  # 亂序時間戳與極端值
+    points.append((ts + 10 ** 10, float("inf")))
+
+    blob = encode_chunk(points)
+    assert decode_chunk(blob) == points
+    # 相較完整 JSON (~300 bytes/點) 大幅縮小
+    assert len(blob) / len(points) < 8
+    assert decode_chunk(encode_chunk([])) == []
+
+
+@pytest.mark.asyncio
+async def test_compact_store_seal_and_read():
+    from backend.history import CompactHistoryStore, compact_open_key, compact_chunks_key
+
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    store = CompactHistoryStore(chunk_seconds=60)
+    now = float(int(time.time()))
+    old = [(int((now - 600 + i) * 1000), 100.0 + i / 100) for i in range(5)]
+    recent = [(int(now * 1000), 101.5)]
+    await fake.rpush(compact_open_key("XAU-USD"), *[f"{ts}:{p!r}" for ts, p in old + recent])
+
+    with patch("backend.history.redis_client", fake):
+        removed = await store.maintain(["XAU-USD"])
+        assert removed == {"XAU-USD": 0}
+        # 已結束視窗的點封存為區塊，當前視窗的點留在 LIST
+        assert await fake.llen(compact_open_key("XAU-USD")) == 1
+        assert await fake.zcard(compact_chunks_key("XAU-USD")) >= 1
+
+        latest = await store.read("XAU-USD", None, None, 3)
+        assert [p["price"] for p in latest] == [100.03, 100.04, 101.5]
+
+        ranged = await store.read("XAU-USD", now - 600, now - 598, 100)
+        assert [p["timestamp"] for p in ranged] == [ts / 1000 for ts, _ in old[:3]]
+
+
+@pytest.mark.asyncio
+async def test_candles_incremental_rollup():
+    from backend.candles import CandleAggregator, read_candles
+
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    candles = CandleAggregator()
+    base = 1_705_500_000 // 3600 * 3600
+    ticks = [(base + 1, 10.0), (base + 20, 12.0), (base + 40, 9.0), (base + 61, 11.0), (base + 30, 50.0)]
+
+    with patch("backend.candles.redis_client", fake):
+        for ts, price in ticks:
+            pipe = fake.pipeline(transaction=True)
+            changed = candles.update("XAU-USD", price, ts)
+            candles.write(pipe, "XAU-USD", changed)
+            await pipe.execute()
+            candles.commit("XAU-USD", changed)
+
+        # 未 commit (寫入失敗) 的結果不影響記憶體中的 K 線
+        candles.update("XAU-USD", 99.0, base + 62)
+        assert candles._current[("XAU-USD", "1m")]["close"] == 11.0
+
+        minute = await read_candles("XAU-USD", "1m", None, None, 10)
+        hour = await read_candles("XAU-USD", "1h", base, base + 3600, 10)
+
+    # 晚到的舊區間資料 (base + 30) 不回寫已結束的 1m K 線
+    assert minute == [
+        {"time": base, "open": 10.0, "high": 12.0, "low": 9.0, "close": 9.0, "ticks": 3},
+        {"time": base + 60, "open": 11.0, "high": 11.0, "low": 11.0, "close": 11.0, "ticks": 1},
+    ]
+    assert hour == [{"time": base, "open": 10.0, "high": 50.0, "low": 9.0, "close": 50.0, "ticks": 5}]
+
+
+@pytest.mark.asyncio
+async def test_archive_range_read_and_fallthrough(tmp_path):
+    from backend.archive import TickArchive
+    from backend.history import read_history, history_key
+
+    archive = TickArchive(root=str(tmp_path), flush_interval=1)
+    day = 86400
+    base = float(int(time.time()) // day * day - 3 * day)
+    # 跨三天，每 10 分鐘一點；亂序的點會被丟棄
+    for i in range(3 * 144):
+        archive.add("XAU-USD", base + i * 600, 2000.0 + i)
+    archive.add("XAU-USD", base, 1.0)
+    assert await archive.flush() == 3 * 144
+    assert len(list((tmp_path / "XAU-USD").iterdir())) == 3
+
+    rows = await archive.read("XAU-USD", base + 600, base + day + 1200, 1000)
+    assert rows[0] == (base + 600, 2001.0)
+    assert rows[-1] == (base + day + 600, 2000.0 + 145)
+    # 只取區間內最後 limit 筆 (跨日檔)
+    rows = await archive.read("XAU-USD", base, base + 3 * day, 5)
+    assert [p for _, p in rows] == [2000.0 + i for i in range(3 * 144 - 5, 3 * 144)]
+
+    # Redis 只保留最後一天，較舊的部分由封存補齊
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    recent_start = base + 2 * day
+    for i in range(144):
+        ts = recent_start + i * 600
+        await fake.zadd(history_key("XAU-USD"), {f'{{"symbol": "XAU-USD", "price": {2288.0 + i}, "timestamp": {ts}}}': ts})
+
+    with patch("backend.history.redis_client", fake), \
+         patch("backend.history.tick_archive", archive), \
+         patch("backend.history.settings.ARCHIVE_ENABLED", True):
+        points = await read_history("XAU-USD", base + day, base + 3 * day, 1000)
+
+    timestamps = [p["timestamp"] for p in points]
+    assert timestamps == sorted(set(timestamps))
+    assert timestamps[0] == base + day
+    assert len(points) == 2 * 144
+
+
+@pytest.mark.asyncio
+async def test_cursor_pages_across_archive_boundary(tmp_path):
+    from backend.archive import TickArchive
+    from backend.history import read_history_page, history_key, encode_cursor, decode_cursor
+
+    archive = TickArchive(root=str(tmp_path), flush_interval=1)
+    base = float(int(time.time()) // 86400 * 86400 - 86400)
+    # 封存：同一時間戳有多筆，且跨越分頁邊界
+    archived = [(base + 10, 1.0), (base + 20, 2.0), (base + 20, 3.0), (base + 20, 4.0), (base + 20, 5.0), (base + 30, 6.0)]
+    for ts, price in archived:
+        archive.add("XAU-USD", ts, price)
+    await archive.flush()
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    for ts, price in [(base + 40, 7.0), (base + 50, 8.0)]:
+        await fake.zadd(history_key("XAU-USD"), {json.dumps({"symbol": "XAU-USD", "price": price, "timestamp": ts}): ts})
+
+    pages = []
+    positions = None
+    with patch("backend.history.redis_client", fake), \
+         patch("backend.history.tick_archive", archive), \
+         patch("backend.history.settings.ARCHIVE_ENABLED", True):
+        while True:
+            data, next_positions = await read_history_page(["XAU-USD"], base, None, 3, positions, cached=False)
+            pages.append([p["price"] for p in data["XAU-USD"]])
+            cursor = encode_cursor(next_positions)
+            if cursor is None:
+                break
+            positions = decode_cursor(cursor)
+
+    assert pages == [[6.0, 7.0, 8.0], [3.0, 4.0, 5.0], [1.0, 2.0]]
+
+
+def test_lttb_downsample_keeps_shape():
+    import math
+    from backend.downsample import lttb, DownsampleCache
+
+    points = [
+        {"symbol": "XAU-USD", "price": 2000 + 50 * math.sin(i / 500), "timestamp": 1_700_000_000 + i}
+        for i in range(20000)
+    ]
+    points[12345]["price"] = 2500.0  # 單點尖峰不可被平均掉
+
+    sampled = lttb(points, 300)
+    assert len(sampled) == 300
+    assert sampled[0] is points[0] and sampled[-1] is points[-1]
+    assert [p["timestamp"] for p in sampled] == sorted(p["timestamp"] for p in sampled)
+    assert max(p["price"] for p in sampled) == 2500.0
+    assert lttb(points[:100], 300) == points[:100]
+
+    cache = DownsampleCache(ttl=10, max_entries=2)
+    cache.put("a", sampled, now=0)
+    cache.put("b", [], now=0)
+    assert cache.get("a", now=5) is sampled
+    cache.put("c", [], now=5)  # 淘汰最久未使用的 "b"
+    assert cache.get("b", now=5) is None
+    assert cache.get("a", now=11) is None
+
+
+@pytest.mark.asyncio
+async def test_history_cursor_pagination():
+    from backend.history import read_history_page, history_key, encode_cursor, decode_cursor
+
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    expected = {}
+    for symbol, count in (("XAU-USD", 23), ("XAG-USD", 7)):
+        rows = {}
+        for i in range(count):
+            ts = 1_700_000_000 + i // 3  # 每個時間戳 3 筆，跨頁邊界需正確略過
+            point = {"symbol": symbol, "price": 100.0 + i, "timestamp": ts}
+            rows[json.dumps(point)] = ts
+        await fake.zadd(history_key(symbol), rows)
+        expected[symbol] = sorted(
+            (json.loads(r) for r in rows), key=lambda p: (p["timestamp"], json.dumps(p))
+        )
+
+    pages = {"XAU-USD": [], "XAG-USD": []}
+    positions = None
+    with patch("backend.history.redis_client", fake):
+        for _ in range(10):
+            data, next_positions = await read_history_page(
+                ["XAU-USD", "XAG-USD"], 1_699_999_000, None, 5, positions
+            )
+            for symbol, points in data.items():
+                assert len(points) <= 5
+                pages[symbol] = points + pages[symbol]
+            cursor = encode_cursor(next_positions)
+            if cursor is None:
+                break
+            positions = decode_cursor(cursor)
+
+    for symbol in pages:
+        assert pages[symbol] == expected[symbol]
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+@pytest.mark.asyncio
+async def test_history_export_streams_ndjson_and_csv():
+    import gzip
+    from backend.export import export_history
+    from backend.history import history_key
+
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    rows = {}
+    for i in range(25):
+        ts = 1_700_000_000 + i // 2
+        rows[json.dumps({"symbol": "XAU-USD", "price": 100.0 + i, "timestamp": ts})] = ts
+    await fake.zadd(history_key("XAU-USD"), rows)
+
+    with patch("backend.history.redis_client", fake):
+        chunks = [c async for c in export_history(["XAU-USD"], None, None, "ndjson", chunk_size=4)]
+        assert len(chunks) == 7
+        lines = b"".join(chunks).decode().splitlines()
+        assert sorted(lines) == sorted(rows) and len(lines) == 25
+
+        blob = b"".join([c async for c in export_history(["XAU-USD"], 1_700_000_005, None, "csv", compress=True, chunk_size=4)])
+    lines = gzip.decompress(blob).decode().splitlines()
+    assert lines[0] == "symbol,timestamp,price"
+    assert len(lines) == 1 + 15
+    assert lines[1].startswith("XAU-USD,1700000005.0,")
+
+
+@pytest.mark.asyncio
+async def test_history_ring_serves_recent_ranges():
+    from backend.history_ring import RecentHistory
+    from backend.history import read_history_page, read_recent_encoded, history_key
+
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    base = 1_700_000_000
+    stored = [{"symbol": "XAU-USD", "price": 100.0 + i, "timestamp": base + i} for i in range(20)]
+    await fake.zadd(history_key("XAU-USD"), {json.dumps(p): p["timestamp"] for p in stored})
+
+    recent = RecentHistory(capacity=8)
+    with patch("backend.history.redis_client", fake), patch("backend.history.recent_history", recent):
+        # 訂閱後、載入前已收到的點會接在載入結果之後
+        live = {"symbol": "XAU-USD", "price": 120.0, "timestamp": base + 20}
+        recent.handle_point("market:points:XAU-USD", json.dumps(live))
+        await recent.warm(["XAU-USD"])
+        assert [p["timestamp"] for p in recent.query("XAU-USD", None, None, 8)] == list(range(base + 13, base + 21))
+
+        # 環形覆寫：只保留最新 8 筆
+        for i in range(21, 25):
+            recent.append("XAU-USD", base + i, 100.0 + i, json.dumps({"symbol": "XAU-USD", "price": 100.0 + i, "timestamp": base + i}))
+        assert recent.query("XAU-USD", base + 18, None, 100)[0]["timestamp"] == base + 18
+        assert recent.query("XAU-USD", base + 10, None, 100) is None  # 超出緩衝，需讀 Redis
+        assert recent.query("XAU-USD", base + 10, None, 3)[-1]["timestamp"] == base + 24
+
+        await fake.flushall()  # 近期查詢不再需要 Redis
+        data, positions = await read_history_page(["XAU-USD"], None, base + 22, 4)
+        assert [p["price"] for p in data["XAU-USD"]] == [119.0, 120.0, 121.0, 122.0]
+        assert positions == {"XAU-USD": (base + 19, 1)}
+        # 第一頁直接串接緩衝中預先編碼的原始列
+        encoded, positions = read_recent_encoded(["XAU-USD", "XAU-USD"], None, base + 22, 4)
+        assert encoded["XAU-USD"] == b"[" + b", ".join(
+            json.dumps({"symbol": "XAU-USD", "price": 100.0 + i, "timestamp": base + i}).encode() for i in range(19, 23)
+        ) + b"]"
+        assert positions == {"XAU-USD": (base + 19, 1)}
+        assert read_recent_encoded(["XAU-USD", "XAG-USD"], None, None, 4) is None
+        data, _ = await read_history_page(["XAU-USD"], base, None, 100)
+        assert data["XAU-USD"] == []
+
+
+@pytest.mark.asyncio
+async def test_history_ring_matches_redis_rows():
+    from backend.history_ring import RecentHistory
+    from backend.history import read_history_page, history_key
+
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    base = 1_700_000_000
+    recent = RecentHistory(capacity=16)
+    arrivals = [0, 1, 2, 4, 5, 3, 5, 6, 6, 7]  # 含亂序與相同時間戳
+    for i, offset in enumerate(arrivals):
+        point = {
+            "symbol": "XAU-USD", "price": 100.0 + i, "timestamp": base + offset,
+            "sources": ["a", "b"], "fastest": "a", "is_market_open": True, "details": {"a": 100.0 + i},
+        }
+        raw = json.dumps(point)
+        await fake.zadd(history_key("XAU-USD"), {raw: point["timestamp"]})
+        recent.append("XAU-USD", point["timestamp"], point["price"], raw)
+    recent.append("XAU-USD", base + 7, 109.0, raw)  # 重複內容不重複保存
+
+    with patch("backend.history.redis_client", fake), patch("backend.history.recent_history", recent):
+        for start, end, limit in ((None, None, 8), (base + 2, base + 6, 10), (None, base + 5, 3)):
+            hit, hit_positions = await read_history_page(["XAU-USD"], start, end, limit)
+            assert recent.query("XAU-USD", start, end, limit) is not None
+            stored, stored_positions = await read_history_page(["XAU-USD"], start, end, limit, cached=False)
+            assert hit == stored and hit_positions == stored_positions
+        compact, _ = await read_history_page(["XAU-USD"], None, None, 3, compact=True)
+        assert compact["XAU-USD"][0] == {"symbol": "XAU-USD", "price": 107.0, "timestamp": base + 6}
@@ -35,20 +35,24 @@ async def test_aggregator_logic():
     agg = Aggregator([])
     # We strip redis calls for unit test or mock redis
     # Here we mock redis_client
-    from unittest.mock import AsyncMock, patch
+    from unittest.mock import ANY, AsyncMock, MagicMock, patch
     with patch("backend.aggregator.redis_client") as mock_redis:
-        mock_redis.publish = AsyncMock()
-        mock_redis.set = AsyncMock()
+        pipe = MagicMock()
+        pipe.execute = AsyncMock()
+        mock_redis.pipeline = AsyncMock(return_value=pipe)
         
         output = await agg.aggregate("TEST", results)
+
+        # 所有寫入合併為單一 pipeline 往返
+        pipe.execute.assert_awaited_once()
+        pipe.publish.assert_called_once()
         
-        # Median is 100.75? No, sorted: 100, 100.5, 101, 1000.
-        # Median of [100, 100.5, 101, 1000] is 100.75
-        # 100 is > 0.3% away from 100.75 (0.75/100.75 = 0.7%), so filtered out.
-        # Filtered: [100.5, 101.0] -> Mean is 100.75
+        # Median of [100, 100.5, 101, 1000] is 100.75, MAD is 0.5.
+        # MAD threshold = min(max(3 * 0.5, 0.05%), 1%) = 1.0075,
+        # so only 1000 is filtered out -> mean of [100, 100.5, 101] is 100.5
         
         assert output is not None
-        assert output["price"] == 100.75
+        assert output["price"] == 100.5
 
         # Logic says: "sources": len(valid_prices) which is BEFORE filtering?
         # looking at aggregator.py:
@@ -59,3 +63,583 @@ async def test_aggregator_logic():
         # Yes, it reports total valid responses, not filtered ones.
         # So sources should be 4.
         assert output["sources"] == 4
+
+        # pipeline 失敗時不記錄發布狀態：同一價格在下一輪仍會發布
+        moved = [{**r, "price": r["price"] + 1} for r in results]
+        candle = dict(agg.candles._current[("TEST", "1m")])
+        pipe.execute = AsyncMock(side_effect=ConnectionError("redis down"))
+        with pytest.raises(ConnectionError):
+            await agg.aggregate("TEST", moved)
+        # 記憶體中的 K 線也不套用未寫入 Redis 的點
+        assert agg.candles._current[("TEST", "1m")] == candle
+        pipe.publish.reset_mock()
+        pipe.execute = AsyncMock()
+        await agg.aggregate("TEST", moved)
+        pipe.publish.assert_any_call("market:stream:TEST", ANY)
+
+
+def test_shard_sources_partition():
+    from backend.ingest import build_sources, shard_sources
+
+    sources = build_sources()
+    shards = [shard_sources(sources, 3, i) for i in range(3)]
+
+    # 每個來源恰好分配到一個分片
+    names = [s.source_name for shard in shards for s in shard]
+    assert sorted(names) == sorted(s.source_name for s in sources)
+
+    # Playwright 來源獨佔成本最高的分片
+    heavy = next(shard for shard in shards if any(s.source_name == "Investing.com" for s in shard))
+    assert len(heavy) < len(sources) // 3
+
+
+def test_aggregate_batch_matches_scalar():
+    pytest.importorskip("numpy")
+    import json
+    import random
+    import time
+
+    agg = Aggregator([])
+    now = time.time()
+    rng = random.Random(7)
+    batch = {}
+    for i in range(40):
+        base = rng.uniform(1, 3000)
+        batch[f"SYM{i}"] = [
+            {
+                "source": f"S{j}",
+                "price": base * (1 + rng.gauss(0, 0.002)) if j != 3 else base * 1.2,
+                "latency": rng.uniform(10, 1500),
+                # 整數、缺少的時間戳需與逐一計算序列化結果相同
+                "timestamp": rng.choice([now - rng.uniform(0, 40), int(now) - rng.randint(0, 40), None]),
+                "max_age": rng.choice([None, 6, 15, 60]),
+            }
+            for j in range(rng.randint(0, 9))
+        ] + [None, {"source": "S9", "price": 0}]
+
+    vectorized = agg.compute_batch(batch, now)
+    for symbol, results in batch.items():
+        scalar = agg.compute(symbol, results, now)
+        assert json.dumps(scalar and scalar[0]) == json.dumps(vectorized[symbol] and vectorized[symbol][0])
+
+
+@pytest.mark.asyncio
+async def test_aggregate_batch_vectorize_threshold():
+    pytest.importorskip("numpy")
+    from unittest.mock import AsyncMock, patch
+    from backend.aggregator import VECTORIZE_MIN_SYMBOLS
+
+    agg = Aggregator([])
+    agg._publish_many = AsyncMock()
+
+    def make(n):
+        return {f"SYM{i}": [{"source": "S", "price": 1.0 + i, "latency": 10}] for i in range(n)}
+
+    # 實際的交易對數 (15) 低於門檻：逐一計算，不呼叫 NumPy
+    with patch.object(agg, "compute_batch", wraps=agg.compute_batch) as batch_path:
+        await agg.aggregate_batch(make(15))
+        assert not batch_path.called
+        await agg.aggregate_batch(make(VECTORIZE_MIN_SYMBOLS - 1))
+        assert not batch_path.called
+        result = await agg.aggregate_batch(make(VECTORIZE_MIN_SYMBOLS))
+        assert batch_path.call_count == 1 and len(result) == VECTORIZE_MIN_SYMBOLS
+
+
+@pytest.mark.asyncio
+async def test_history_trimmer_amortized():
+    import time
+    import fakeredis.aioredis
+    from unittest.mock import AsyncMock, patch
+    from backend.history import HistoryTrimmer, history_key
+
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    trimmer = HistoryTrimmer(every_n=3, interval=3600)
+    now = time.time()
+    old_ts = now - 48 * 3600
+    await fake.zadd(history_key("XAU-USD"), {"old": old_ts, "a": now, "b": now + 1})
+
+    trimmer.note_insert("XAU-USD")
+    trimmer.note_insert("XAU-USD")
+    assert trimmer.due() == []
+    trimmer.note_insert("XAU-USD")
+    assert trimmer.due() == ["XAU-USD"]
+
+    with patch("backend.history.redis_client") as mock_redis:
+        mock_redis.pipeline = AsyncMock(side_effect=lambda transaction=True: fake.pipeline(transaction=transaction))
+        removed = await trimmer.trim_due()
+
+    assert removed == {"XAU-USD": 1}
+    assert await fake.zcard(history_key("XAU-USD")) == 2
+    assert trimmer.due() == []
+
+
+def test_publish_policy_suppresses_unchanged():
+    from backend.aggregator import PublishPolicy
+
+    policy = PublishPolicy(heartbeat=10)
+    tick = {"symbol": "XAU-USD", "price": 2650.45, "is_market_open": True}
+
+    def publish(output, now):
+        if policy.should_publish(output, now):
+            policy.record(output, now)
+            return True
+        return False
+
+    assert publish(tick, now=100.0)
+    assert not publish(dict(tick), now=101.0)
+    # 價格改變或開收盤狀態改變時立即發布
+    assert publish({**tick, "price": 2650.46}, now=102.0)
+    assert publish({**tick, "price": 2650.46, "is_market_open": False}, now=103.0)
+    # 心跳
+    assert not publish({**tick, "price": 2650.46, "is_market_open": False}, now=112.0)
+    assert publish({**tick, "price": 2650.46, "is_market_open": False}, now=113.0)
+    # 未記錄 (發布失敗) 的狀態不會抑制下一次發布
+    assert policy.should_publish({**tick, "price": 1.0}, now=114.0)
+    assert policy.should_publish({**tick, "price": 1.0}, now=115.0)
+
+
+def test_market_calendar_sessions():
+    from datetime import datetime
+    from backend.market_hours import MarketCalendar, MARKET_TIMEZONE
+
+    def at(*args):
+        return datetime(*args, tzinfo=MARKET_TIMEZONE).timestamp()
+
+    cal = MarketCalendar()
+    # 週一中午：金屬、股票皆開盤；晚間 17:30 金屬每日休市、股票已收盤
+    assert cal.is_open("XAU-USD", at(2026, 10, 19, 12, 0))
+    assert cal.is_open("GDX", at(2026, 10, 19, 12, 0))
+    assert not cal.is_open("XAU-USD", at(2026, 10, 19, 17, 30))
+    assert not cal.is_open("GDX", at(2026, 10, 19, 17, 30))
+    assert cal.is_open("XAU-USD", at(2026, 10, 19, 18, 30))
+    assert not cal.is_open("GDX", at(2026, 10, 19, 18, 30))
+
+    # 週日 18:30 金屬開盤，股票與 VIX 仍休市；Crypto 永遠開市
+    sunday = at(2026, 10, 18, 18, 30)
+    assert cal.is_open("SI-F", sunday)
+    assert not cal.is_open("VIX", sunday)
+    assert cal.is_open("PAXG-USD", sunday)
+
+    # 狀態有效期限：股票收盤後維持休市至隔日 09:30
+    is_open, until = cal.state("SIL", at(2026, 10, 19, 17, 30))
+    assert not is_open
+    assert until == at(2026, 10, 20, 9, 30)
+
+    # 感恩節全日休市
+    assert not cal.is_open("XAU-USD", at(2026, 11, 26, 12, 0))
+
+
+@pytest.mark.asyncio
+async def test_latest_table_render():
+    import json
+    import fakeredis.aioredis
+    from unittest.mock import patch
+    from backend.latest import LatestTable
+
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await fake.set("market:latest:XAU-USD", json.dumps({"symbol": "XAU-USD", "price": 2650.5, "timestamp": 100}))
+    await fake.set("market:latest:XAG-USD", json.dumps({"symbol": "XAG-USD", "price": 31.2, "timestamp": 100}))
+
+    table = LatestTable()
+    with patch("backend.latest.redis_client", fake):
+        await table.load(["XAU-USD", "XAG-USD", "USD-TWD"])
+
+    table.handle_point("market:points:XAU-USD", json.dumps({"symbol": "XAU-USD", "price": 2651.0, "timestamp": 101}))
+    table.update("XAU-USD", json.dumps({"symbol": "XAU-USD", "price": 1.0, "timestamp": 99}), 99)  # 較舊，忽略
+
+    body = json.loads(table.render(["XAU-USD", "USD-TWD", "XAG-USD", "XAU-USD"], 123.5))
+    assert body["timestamp"] == 123.5
+    assert list(body["data"]) == ["XAU-USD", "XAG-USD"]
+    assert body["data"]["XAU-USD"]["price"] == 2651.0
+
+    # 版本未變時重用 data 片段，但 timestamp 為每次呼叫的時間
+    again = table.render(["XAU-USD", "USD-TWD", "XAG-USD"], 124.0)
+    assert json.loads(again) == {**body, "timestamp": 124.0}
+    msgpack = pytest.importorskip("msgpack")
+    table.render(["XAU-USD"], 1.0, binary=True)
+    packed = msgpack.unpackb(table.render(["XAU-USD"], 2.0, binary=True))
+    assert packed["timestamp"] == 2.0 and packed["data"]["XAU-USD"]["price"] == 2651.0
+
+
+def test_latest_etag_not_modified():
+    import json
+    from fastapi.testclient import TestClient
+    from backend.main import app
+    from backend.latest import latest_table
+
+    latest_table.update("XAU-USD", json.dumps({"symbol": "XAU-USD", "price": 2650.5, "timestamp": 100}), 100)
+    client = TestClient(app)
+    first = client.get("/api/v1/latest?symbols=xau-usd", headers={"X-API-Key": "dev_key"})
+    assert first.status_code == 200
+    assert first.json()["data"]["XAU-USD"]["price"] == 2650.5
+    etag = first.headers["etag"]
+    assert "max-age" in first.headers["cache-control"]
+
+    cached = client.get("/api/v1/latest?symbols=xau-usd", headers={"X-API-Key": "dev_key", "If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+
+    latest_table.update("XAU-USD", json.dumps({"symbol": "XAU-USD", "price": 2651.0, "timestamp": 101}), 101)
+    changed = client.get("/api/v1/latest?symbols=xau-usd", headers={"X-API-Key": "dev_key", "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+
+def test_history_downsample_cache_follows_data_version():
+    import json
+    from unittest.mock import patch
+    from fastapi.testclient import TestClient
+    from backend.main import app
+    from backend.latest import latest_table
+
+    stored = [{"symbol": "DS-USD", "price": 1.0 + i, "timestamp": i} for i in range(10)]
+
+    async def read_page(symbols, start, end, limit, positions=None, **kwargs):
+        return {s: list(stored) for s in symbols}, {}
+
+    latest_table.update("DS-USD", json.dumps(stored[-1]), 9)
+    client = TestClient(app)
+    url = "/api/v1/history?symbols=ds-usd&max_points=5"
+    with patch("backend.main.read_history_page", side_effect=read_page) as read:
+        first = client.get(url, headers={"X-API-Key": "dev_key"})
+        again = client.get(url, headers={"X-API-Key": "dev_key"})
+        assert read.call_count == 1 and again.json()["data"] == first.json()["data"]
+
+        # 新點到達：ETag 與降採樣結果一起更新，不會以新的 ETag 回傳舊結果
+        stored.append({"symbol": "DS-USD", "price": 50.0, "timestamp": 10})
+        latest_table.update("DS-USD", json.dumps(stored[-1]), 10)
+        changed = client.get(url, headers={"X-API-Key": "dev_key", "If-None-Match": first.headers["etag"]})
+    assert changed.status_code == 200 and changed.headers["etag"] != first.headers["etag"]
+    assert changed.json()["data"]["DS-USD"][-1]["price"] == 50.0 and read.call_count == 2
+
+
+def test_compression_and_msgpack_negotiation():
+    import gzip
+    import json
+    import msgpack
+    from fastapi.testclient import TestClient
+    from backend.main import app
+    from backend.latest import latest_table
+
+    for i in range(15):
+        symbol = f"T{i}-USD"
+        latest_table.update(symbol, json.dumps({"symbol": symbol, "price": 1.0 + i, "timestamp": 100, "sources": 3, "fastest": "Binance" * 20}), 100)
+    symbols = ",".join(f"t{i}-usd" for i in range(15))
+    client = TestClient(app)
+
+    resp = client.get(f"/api/v1/latest?symbols={symbols}", headers={"X-API-Key": "dev_key", "Accept-Encoding": "gzip"})
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.headers["etag"].startswith('W/"')
+    assert "Accept-Encoding" in resp.headers["vary"]
+    assert len(resp.json()["data"]) == 15
+
+    raw = client.get(
+        f"/api/v1/latest?symbols={symbols}",
+        headers={"X-API-Key": "dev_key", "Accept-Encoding": "identity", "Accept": "application/msgpack"},
+    )
+    assert raw.headers["content-type"] == "application/msgpack"
+    assert "content-encoding" not in raw.headers
+    assert msgpack.unpackb(raw.content)["data"]["T3-USD"]["price"] == 4.0
+    assert len(raw.content) < len(gzip.decompress(gzip.compress(resp.content)))
+
+
+@pytest.mark.asyncio
+async def test_key_cache_invalidation():
+    import fakeredis.aioredis
+    from unittest.mock import patch
+    from backend import auth
+
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    await fake.sadd("auth:dynamic_keys", "k1", "k2")
+    cache = auth.KeyCache()
+    with patch("backend.auth.redis_client", fake), patch("backend.auth.key_cache", cache):
+        assert await auth._is_allowed("k1")
+        assert not await auth._is_disabled("k1")
+
+        # 驗證路徑不再讀 Redis：直接寫入 Redis 不會立即生效
+        await fake.sadd("auth:disabled_keys", "k1")
+        assert not await auth._is_disabled("k1")
+
+        # 其他進程收到失效通知後重新載入
+        await cache.handle_invalidate(auth.AUTH_INVALIDATE_CHANNEL, "1")
+        assert await auth._is_disabled("k1")
+        assert isinstance(cache.disabled_keys, frozenset)
+
+        await fake.srem("auth:dynamic_keys", "k2")
+        await auth.invalidate_key_cache()
+        assert not await auth._is_allowed("k2")
+
+
+@pytest.mark.asyncio
+async def test_gcra_rate_limiter():
+    from types import SimpleNamespace
+    from unittest.mock import patch
+    from backend.rate_limit import RateLimiter, parse_limits
+
+    assert parse_limits("/api/v1/history=30:5, k1=10,bad") == {"/api/v1/history": (30, 5), "k1": (10, 0)}
+
+    limiter = RateLimiter()
+    limiter.default = (60, 2)
+    limiter.key_limits = {"vip": (600, 0)}
+    assert limiter.limit_for("vip", "/x") == (600, 0)
+
+    # 進程內 (FakeRedis) 路徑：突發 burst + 1 次後拒絕，並由本地快取直接拒絕
+    local = SimpleNamespace(redis=object(), use_fake=True)
+    with patch("backend.rate_limit.redis_client", local):
+        results = [await limiter.allow("1.1.1.1", "k", "/x") for _ in range(5)]
+    assert results == [True, True, True, False, False]
+
+    # Redis Lua 路徑 (需 lupa 提供 FakeRedis 的 Lua 支援)
+    pytest.importorskip("lupa")
+    import fakeredis.aioredis
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+    async def register_script(script):
+        return fake.register_script(script)
+
+    shared = SimpleNamespace(redis=fake, use_fake=False, register_script=register_script)
+    workers = [RateLimiter(), RateLimiter()]
+    for worker in workers:
+        worker.default = (60, 2)
+    with patch("backend.rate_limit.redis_client", shared):
+        # 兩個 worker 共用同一個 bucket，總量不因 worker 數倍增
+        results = [await workers[i % 2].allow("2.2.2.2", "k", "/x") for i in range(6)]
+    assert results.count(True) == 3
+    assert await fake.pttl("ratelimit:2.2.2.2:k:/x") > 0
+
+    # 無法整除 60000 的限額 (7/min → 間隔 8572 ms) 仍以整數 PX 寫入，不會因腳本錯誤而放行
+    odd = RateLimiter()
+    odd.default = (7, 2)
+    with patch("backend.rate_limit.redis_client", shared), patch("backend.rate_limit.logger") as log:
+        results = [await odd.allow("3.3.3.3", "k", "/x") for _ in range(10)]
+    assert results.count(True) == 3 and not log.warning.called
+
+    # 租約：放行的請求由本地預扣的額度消耗，多數不經 Redis
+    calls = []
+
+    async def counting_script(script):
+        registered = fake.register_script(script)
+
+        async def run(keys, args):
+            calls.append(keys[0])
+            return await registered(keys=keys, args=args)
+        return run
+
+    counted = SimpleNamespace(redis=fake, use_fake=False, register_script=counting_script)
+    leased = RateLimiter()
+    leased.default, leased.lease_size = (120, 30), 10
+    with patch("backend.rate_limit.redis_client", counted):
+        results = [await leased.allow("5.5.5.5", "k", "/x") for _ in range(40)]
+    # 突發額度 burst + 1 = 31 仍然精確，但只需少量 Redis 往返
+    assert results.count(True) == 31 and results[-1] is False
+    assert len(calls) == 8
+
+    # 腳本執行失敗時退回進程內 GCRA，而不是放行全部請求
+    async def broken(keys, args):
+        raise RuntimeError("NOSCRIPT")
+
+    failing = RateLimiter()
+    failing.default = (60, 1)
+    failing._script = broken
+    with patch("backend.rate_limit.redis_client", shared), patch("backend.rate_limit.logger") as log:
+        results = [await failing.allow("4.4.4.4", "k", "/x") for _ in range(4)]
+    assert results == [True, True, False, False]
+    # 中斷期間只在狀態轉換時記錄一次
+    assert log.warning.call_count == 1 and not log.error.called
+
+
+@pytest.mark.asyncio
+async def test_ws_hub_fanout():
+    from backend.ws_hub import BroadcastHub, HubClient, Update
+
+    hub = BroadcastHub()
+    a, b = hub.register(), hub.register()
+    hub.dispatch("market:stream:XAU-USD", '{"symbol": "XAU-USD"}')
+    assert await a.next() == await b.next() == '{"symbol": "XAU-USD"}'
+
+    hub.unregister(b)
+    hub.dispatch("market:stream:XAG-USD", "x")
+    assert len(a.pending) == 1 and not b.pending
+
+    # 同一 symbol 未送出前只保留最新值；緩衝滿時丟棄最舊的 symbol
+    slow = HubClient(2)
+    for i in range(3):
+        slow.push("XAU-USD", Update("XAU-USD", str(i)))
+    slow.push("XAG-USD", Update("XAG-USD", "ag"))
+    slow.push("USD-TWD", Update("USD-TWD", "twd"))
+    assert (slow.conflated, slow.dropped) == (2, 1)
+    assert [await slow.next(), await slow.next()] == ["ag", "twd"]
+    assert slow.behind_since is None
+
+
+@pytest.mark.asyncio
+async def test_ws_hub_symbol_subscriptions():
+    import json
+    from unittest.mock import patch
+    from backend.latest import LatestTable
+    from backend.ws_hub import BroadcastHub
+
+    hub = BroadcastHub()
+    everything = hub.register()
+    twd = hub.register({"USD-TWD"})
+    hub.dispatch("market:stream:XAU-USD", "xau")
+    hub.dispatch("market:stream:USD-TWD", "twd")
+    assert len(everything.pending) == 2
+    assert len(twd.pending) == 1 and await twd.next() == "twd"
+
+    with patch("backend.ws_hub.latest_table", LatestTable()):  # 空的最新價格表：不附帶快照
+        hub.handle_control(twd, '{"action": "subscribe", "symbols": ["xau-usd"]}')
+    assert json.loads(await twd.next()) == {"type": "subscribed", "symbols": ["USD-TWD", "XAU-USD"]}
+    hub.handle_control(twd, '{"action": "unsubscribe", "symbols": ["USD-TWD"]}')
+    assert json.loads(await twd.next())["symbols"] == ["XAU-USD"]
+    hub.dispatch("market:stream:USD-TWD", "twd")
+    hub.dispatch("market:stream:XAU-USD", "xau")
+    assert len(twd.pending) == 1 and await twd.next() == "xau"
+
+    hub.handle_control(twd, "not json")
+    assert json.loads(await twd.next())["type"] == "error"
+    hub.unregister(everything)
+    hub.unregister(twd)
+    assert hub.by_symbol == {}
+
+    # 只接受追蹤中的 symbol：未知字串不進入索引
+    tracked = BroadcastHub(["XAU-USD", "USD-TWD"])
+    client = tracked.register({"XAU-USD", "NOPE-1"})
+    unknown = tracked.register({"NOPE-2"})
+    assert client.symbols == {"XAU-USD"} and unknown.symbols == set()
+    with patch("backend.ws_hub.latest_table", LatestTable()):
+        tracked.handle_control(client, json.dumps({"action": "subscribe", "symbols": [f"x{i}" for i in range(100)] + ["usd-twd"]}))
+    reply = json.loads(await client.next())
+    assert reply["symbols"] == ["USD-TWD", "XAU-USD"] and len(reply["ignored"]) == 100
+    assert set(tracked.by_symbol) == {"XAU-USD", "USD-TWD"}
+    tracked.dispatch("market:stream:XAU-USD", "xau")
+    assert not unknown.pending
+
+
+@pytest.mark.asyncio
+async def test_ws_hub_evicts_slow_clients():
+    from backend.ws_hub import BroadcastHub
+
+    hub = BroadcastHub()
+    slow, fast = hub.register(), hub.register()
+    slow.slow_seconds = fast.slow_seconds = 5
+    hub.dispatch("market:stream:XAU-USD", "1")
+    await fast.next()
+    # slow 的緩衝從未清空，超過門檻後被移除
+    slow.behind_since -= 10
+    hub.dispatch("market:stream:XAU-USD", "2")
+    assert slow.evicted.is_set() and not fast.evicted.is_set()
+    assert hub.clients == {fast}
+    assert hub.stats() == {"clients": 1, "conflated": 1, "dropped": 0, "evicted": 1, "throttled": 0}
+
+
+@pytest.mark.asyncio
+async def test_ws_hub_binary_frames():
+    import json
+    from backend.ws_hub import BroadcastHub, TICK
+
+    hub = BroadcastHub()
+    binary, text = hub.register(binary=True), hub.register()
+    tick = {"symbol": "XAU-USD", "price": 2650.45, "timestamp": 1705500000.1, "sources": 6,
+            "details": ["Binance"], "fastest": "Binance", "avgLatency": 150.5, "is_market_open": True}
+
+    hub.dispatch("market:stream:XAU-USD", json.dumps(tick))
+    meta = json.loads(await binary.next())
+    assert meta["type"] == "meta" and meta["symbol"] == "XAU-USD" and meta["details"] == ["Binance"]
+    assert TICK.unpack(await binary.next()) == (meta["id"], 2650.45, 1705500000.1)
+    assert json.loads(await text.next())["avgLatency"] == 150.5
+
+    # meta 未變時只送 18 bytes 的報價 frame；來源改變時重送 meta
+    hub.dispatch("market:stream:XAU-USD", json.dumps({**tick, "price": 2651.0, "avgLatency": 99}))
+    frame = await binary.next()
+    assert isinstance(frame, bytes) and len(frame) == TICK.size
+    hub.dispatch("market:stream:XAU-USD", json.dumps({**tick, "sources": 5}))
+    assert json.loads(await binary.next())["sources"] == 5
+    assert isinstance(await binary.next(), bytes)
+
+
+@pytest.mark.asyncio
+async def test_ws_snapshot_on_connect():
+    import json
+    from unittest.mock import patch
+    from backend.latest import LatestTable
+    from backend.ws_hub import BroadcastHub
+
+    table = LatestTable()
+    table.update("XAU-USD", json.dumps({"symbol": "XAU-USD", "price": 2650.0, "timestamp": 1.0}), 1.0)
+    table.update("USD-TWD", json.dumps({"symbol": "USD-TWD", "price": 32.5, "timestamp": 1.0}), 1.0)
+    hub = BroadcastHub()
+    with patch("backend.ws_hub.latest_table", table):
+        client = hub.register({"XAU-USD", "XAG-USD"})
+        hub.send_snapshot(client)
+        hub.dispatch("market:stream:XAU-USD", "live")
+        snapshot = json.loads(await client.next())
+        assert snapshot["type"] == "snapshot" and list(snapshot["data"]) == ["XAU-USD"]
+        assert await client.next() == "live"
+
+        # 新增訂閱時補送新 symbol 的快照
+        hub.handle_control(client, '{"action": "subscribe", "symbols": ["USD-TWD"]}')
+        assert json.loads(await client.next())["type"] == "subscribed"
+        assert list(json.loads(await client.next())["data"]) == ["USD-TWD"]
+
+
+@pytest.mark.asyncio
+async def test_sse_resume_from_last_event_id():
+    from backend.ws_hub import BroadcastHub
+
+    hub = BroadcastHub()
+    hub.dispatch("market:stream:XAU-USD", '{"price": 1}')
+    hub.dispatch("market:stream:USD-TWD", '{"price": 2}')
+    hub.dispatch("market:stream:XAU-USD", '{"price": 3}')
+
+    # 接續 seq 1 之後、且只補送訂閱的 symbol
+    stream = hub.event_stream({"XAU-USD"}, f"{hub.epoch}-1")
+    assert (await stream.__anext__()).startswith("retry:")
+    assert await stream.__anext__() == f'id: {hub.epoch}-3\ndata: {{"price": 3}}\n\n'
+    hub.dispatch("market:stream:XAU-USD", '{"price": 4}')
+    assert (await stream.__anext__()).startswith(f"id: {hub.epoch}-4\n")
+    await stream.aclose()
+    assert not hub.clients
+
+    # 其他進程的 epoch 或超出緩衝時無法接續 (改送快照)
+    client = hub.register(event_stream=True)
+    assert not hub.resume(client, "deadbeef-3")
+    assert not hub.resume(client, f"{hub.epoch}-99")
+    assert hub.resume(client, f"{hub.epoch}-4") and not client.control
+
+
+@pytest.mark.asyncio
+async def test_timing_wheel_schedules_and_cancels():
+    from backend.timing_wheel import TimingWheel
+
+    # 不啟動背景 task，以手動 advance() 推進
+    wheel = TimingWheel(tick=1, slots=4, autostart=False)
+    fired = []
+    wheel.schedule("a", 2, lambda item: fired.append(item) or 3)
+    wheel.schedule("b", 6, lambda item: fired.append(item))  # 超過一圈
+    wheel.schedule("c", 1, lambda item: fired.append(item))
+    wheel.cancel("c")
+    for _ in range(6):
+        wheel.advance()
+    # a 在第 2、5 tick 觸發 (回傳 3 表示再排程)，b 在第 6 tick
+    assert fired == ["a", "a", "b"] and len(wheel) == 1
+
+
+@pytest.mark.asyncio
+async def test_ws_hub_max_rate_coalesces():
+    from backend.ws_hub import BroadcastHub
+
+    hub = BroadcastHub()
+    client = hub.register(max_rate=0.5)
+    assert client.interval == 2.0 and len(hub.wheel) == 1
+    for price in (1, 2, 3):
+        hub.dispatch("market:stream:XAU-USD", f"xau{price}")
+    hub.dispatch("market:stream:XAG-USD", "xag")
+    assert not client._sendable() and client.behind_since is None
+
+    # 時間輪到期時送出每個 symbol 的最新值
+    client.flush()
+    assert [await client.next(), await client.next()] == ["xau3", "xag"]
+    assert not client._sendable() and client.conflated == 2
+
+    hub.unregister(client)
+    assert len(hub.wheel) == 0
+    await hub.close()